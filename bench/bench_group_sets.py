@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================================
+# bench_group_sets.py
+# Author: Juan Sebastian Diaz Boada
+# juan.sebastian.diaz.boada@ki.se
+# Creation Date: 18/10/2026
+# =============================================================================================
+""" Scaling of the grouping of cells in clones, from 1k to 1M cells.
+
+    For each number of cells, builds a synthetic dataset of CDR3 sequences (see synthetic.py)
+    and times three ways of grouping its cells in clones: the previous nested loops of
+    'group_sets' (see legacy_group_sets.py), the hashed 'group_sets(generate_clone_sets(...))'
+    of bin/data_functions.py, and the path of step 6, 'generate_clone_keys' followed by
+    'group_multiple_with_freq'. Checks that the three give the same clones, i.e. that two
+    cells are in the same group with one of them if and only if they are with the others. The
+    previous grouping takes a time quadratic in the number of cells, so it is only run up to
+    'legacy_max' cells. Run from the root of the repository, e.g.
+
+        python3 bench/bench_group_sets.py --sizes 1000 10000 100000 1000000
+
+    Parameters
+    ----------
+    sizes : list of ints, optional
+        Numbers of cells. Defaults to 1000, 2000, 5000, 10000, 100000 and 1000000.
+    legacy_max : int, optional
+        Largest number of cells grouped with the previous nested loops. Defaults to 10000.
+    missing : float, optional
+        Fraction of missing sequences. Defaults to 0.5.
+    seed : int, optional
+        Seed of the random generator. Defaults to 0.
+"""
+import os,sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+module_path = os.path.abspath('bin')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from data_functions import generate_clone_sets, group_sets
+from data_functions import generate_clone_keys, group_multiple_with_freq
+from legacy_group_sets import generate_clone_sets_legacy, group_sets_legacy
+from synthetic import clone_dataframe
+#---------------------------------------------------------------------------------------------------#
+def step6_groups(df,cols):
+    """ Group numbers of the cells of 'df' given by the clone definition and grouping of step 6,
+        in the order of 'df'."""
+    keys = generate_clone_keys(df,{'TCR':cols})
+    grouped = group_multiple_with_freq(keys,['TCR'],new_names=['clone'])
+    return grouped['group_clone'].reindex(df.index).to_numpy(dtype=int)
+#---------------------------------------------------------------------------------------------------#
+def same_clones(a,b):
+    """ Wether two arrays of group numbers split the cells in the same groups, whatever the
+        numbers of the groups."""
+    return np.array_equal(pd.factorize(np.asarray(a))[0],pd.factorize(np.asarray(b))[0])
+#---------------------------------------------------------------------------------------------------#
+def _timed(func,*args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+#---------------------------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes',type=int,nargs='+',default=[1000,2000,5000,10000,100000,1000000],help="Numbers of cells. Defaults to 1000 2000 5000 10000 100000 1000000.")
+    parser.add_argument('--legacy_max',type=int,default=10000,help="Largest number of cells grouped with the previous nested loops. Defaults to 10000.")
+    parser.add_argument('--missing',type=float,default=0.5,help="Fraction of missing sequences. Defaults to 0.5.")
+    parser.add_argument('--seed',type=int,default=0,help="Seed of the random generator. Defaults to 0.")
+    o = parser.parse_args()
+
+    cols = ['A_1','A_2','B_1','B_2']
+    failed = False
+    print("{:>9} {:>8} {:>12} {:>12} {:>12} {:>6}".format('cells','clones','legacy','group_sets',
+                                                          'step 6','equal'))
+    for n in o.sizes:
+        df = clone_dataframe(n,missing=o.missing,seed=o.seed,cols=cols)
+        hashed, t_hashed = _timed(lambda: group_sets(generate_clone_sets(df,cols)))
+        step6, t_step6 = _timed(step6_groups,df,cols)
+        equal = same_clones(hashed,step6)
+        if n<=o.legacy_max:
+            legacy, t_legacy = _timed(lambda: group_sets_legacy(generate_clone_sets_legacy(df,cols)))
+            equal = equal and same_clones(legacy,hashed)
+            t_legacy = "{:.3f}s".format(t_legacy)
+        else:
+            t_legacy = 'skipped'
+        failed = failed or not equal
+        print("{:>9} {:>8} {:>12} {:>11.3f}s {:>11.3f}s {:>6}".format(n,len(set(hashed)-{-1}),
+                                                                    t_legacy,t_hashed,t_step6,
+                                                                    str(equal)))
+    sys.exit(int(failed))
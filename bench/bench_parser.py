@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================================
+# bench_parser.py
+# Author: Juan Sebastian Diaz Boada
+# juan.sebastian.diaz.boada@ki.se
+# Creation Date: 18/10/2026
+# =============================================================================================
+""" Micro-benchmark of the parser of 'filtered_TCRs.txt' against the previous one.
+
+    Writes the TraCeR output of a synthetic plate (see synthetic.py), checks that the streaming
+    parser of bin/objects.py and the previous one (see legacy_parser.py) give the same cells on
+    every file, and times both on all the files with the page cache warm. Run from the root of
+    the repository, e.g.
+
+        python3 bench/bench_parser.py --cells 100000
+
+    Parameters
+    ----------
+    cells : int, optional
+        Number of cells of the synthetic plate. Defaults to 100000.
+    dir : string, optional
+        Folder of the synthetic plate. It is written if it does not exist, and kept. Defaults
+        to a temporary folder that is deleted at the end.
+    repeats : int, optional
+        Number of times each parser is timed. Defaults to 3.
+"""
+import os,sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+
+module_path = os.path.abspath('bin')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from objects import read_tracer_cell
+from legacy_parser import create_cell_legacy
+from synthetic import write_tracer_plate
+#---------------------------------------------------------------------------------------------------#
+def cell_contents(cell):
+    """ Contents of a cell and its chains, to compare the output of two parsers."""
+    chains = [None if c is None else (type(c).__name__,c.__getstate__())
+              for c in cell.A_chains + cell.B_chains + cell.G_chains + cell.D_chains]
+    return (cell.name,cell.n_A,cell.n_B,cell.n_G,cell.n_D,chains)
+#---------------------------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cells',type=int,default=100000,help="Number of cells of the synthetic plate. Defaults to 100000.")
+    parser.add_argument('--dir',type=str,default=None,help="Folder of the synthetic plate, written if missing and kept. Defaults to a temporary folder.")
+    parser.add_argument('--repeats',type=int,default=3,help="Number of times each parser is timed. Defaults to 3.")
+    o = parser.parse_args()
+
+    root = o.dir if o.dir is not None else tempfile.mkdtemp(prefix='bench_parser_')
+    try:
+        if not os.path.isdir(os.path.join(root,'AB')):
+            if o.dir is None:
+                os.rmdir(root)
+            print("Writing a synthetic plate of {} cells in {}".format(o.cells,root))
+            write_tracer_plate(root,o.cells)
+        files = [(loci,f) for loci in ('AB','GD') for f in
+                 sorted(glob.glob(os.path.join(root,loci,'*','filtered_TCR_seqs','filtered_TCRs.txt')))]
+        mismatches = [f for loci,f in files
+                      if cell_contents(read_tracer_cell(f,loci))!=cell_contents(create_cell_legacy(f,loci))]
+        print("{} files, {} with different cells".format(len(files),len(mismatches)))
+        for f in mismatches[:5]:
+            print("  " + f)
+        for loci,f in files: # Warm the page cache
+            with open(f) as handle:
+                handle.read()
+        for name,parse in [('legacy',create_cell_legacy),('streaming',read_tracer_cell)]*o.repeats:
+            start = time.perf_counter()
+            for loci,f in files:
+                parse(f,loci)
+            seconds = time.perf_counter() - start
+            print("{:>9}: {:.2f} s, {:.1f} us/file".format(name,seconds,1e6*seconds/len(files)))
+    finally:
+        if o.dir is None:
+            shutil.rmtree(root,ignore_errors=True)
+    sys.exit(int(bool(mismatches)))
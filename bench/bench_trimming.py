@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================================
+# bench_trimming.py
+# Author: Juan Sebastian Diaz Boada
+# juan.sebastian.diaz.boada@ki.se
+# Creation Date: 18/10/2026
+# =============================================================================================
+""" Benchmark and comparison of the python trimming of step 3 against TrimGalore.
+
+    Writes the paired fastq files of a synthetic cell (see synthetic.py), trims them with
+    'trim_cell' of bin/trimming.py and, if available, with TrimGalore as in
+    '03_run_trim_galore.sh' (or with cutadapt and the parameters TrimGalore gives it, if only
+    cutadapt is installed, e.g. outside the containers), and compares the trimmed read pairs.
+    The python trimming matches the adapter with substitutions only, while cutadapt also allows
+    insertions and deletions, so the outputs are not identical: the pairs that differ are
+    counted, together with how many of them have an insertion or deletion in the adapter of the
+    synthetic reads. Run from the root of the repository, e.g.
+
+        python3 bench/bench_trimming.py --pairs 100000
+
+    Parameters
+    ----------
+    pairs : int, optional
+        Number of read pairs of the synthetic cell. Defaults to 100000.
+    dir : string, optional
+        Folder where the synthetic and trimmed files are written, and kept. Defaults to a
+        temporary folder that is deleted at the end.
+    cores : int, optional
+        Number of cores given to TrimGalore or cutadapt. Defaults to 1, as one python process.
+    seed : int, optional
+        Seed of the random generator. Defaults to 0.
+"""
+import os,sys
+import gzip
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+module_path = os.path.abspath('bin')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from trimming import ADAPTERS, trim_cell
+from synthetic import write_fastq_pair
+#---------------------------------------------------------------------------------------------------#
+def reference_trim(fastq_ins,out_dir,cores=1,adapter=ADAPTERS['Illumina']):
+    """ Trims a pair of fastq files with TrimGalore as in '03_run_trim_galore.sh', or with
+        cutadapt and the default parameters of TrimGalore if TrimGalore is not installed.
+
+        Parameters
+        ----------
+        fastq_ins : tuple of strings
+            Paths to the R1 and R2 files, named '<cell>_R1.fastq.gz' and '<cell>_R2.fastq.gz'.
+        out_dir : string
+            Folder where the trimmed files are written.
+        cores : int, optional
+            Number of cores of TrimGalore or cutadapt. Default is 1.
+        adapter : bytes, optional
+            Adapter given to cutadapt. TrimGalore detects it. Default is the Illumina adapter.
+
+        Returns
+        -------
+        tuple
+            Name of the tool used and paths to the trimmed R1 and R2 files, or None if neither
+            tool is installed.
+    """
+    os.makedirs(out_dir,exist_ok=True)
+    names = [os.path.basename(f).replace('_R{}.fastq.gz'.format(i),'_R{0}_val_{0}.fq.gz'.format(i))
+             for i,f in zip((1,2),fastq_ins)]
+    fastq_outs = [os.path.join(out_dir,name) for name in names]
+    if shutil.which('trim_galore') is not None:
+        subprocess.run(['trim_galore','--paired',*fastq_ins,'-o',out_dir,'--cores',str(cores)],
+                       check=True,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        return 'trim_galore', fastq_outs
+    if shutil.which('cutadapt') is not None:
+        subprocess.run(['cutadapt','-j',str(cores),'-e','0.1','-q','20','-O','1','-m','20',
+                        '-a',adapter.decode(),'-A',adapter.decode(),
+                        '-o',fastq_outs[0],'-p',fastq_outs[1],*fastq_ins],
+                       check=True,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        return 'cutadapt', fastq_outs
+    return None
+#---------------------------------------------------------------------------------------------------#
+def _read_pairs(fastq_files):
+    """ Internal function. Dictionary mapping the name of each read pair of trimmed fastq files to
+        its sequences and qualities."""
+    lines = []
+    for path in fastq_files:
+        with gzip.open(path,'rb') as f:
+            lines.append(f.read().split(b'\n'))
+    return {lines[0][i].split()[0][1:].decode():(lines[0][i+1],lines[0][i+3],lines[1][i+1],
+                                                 lines[1][i+3])
+            for i in range(0,len(lines[0])-3,4)}
+#---------------------------------------------------------------------------------------------------#
+def compare_trimmed(fastq_a,fastq_b):
+    """ Compares the read pairs of two pairs of trimmed fastq.gz files by read name.
+
+        Parameters
+        ----------
+        fastq_a, fastq_b : tuple of strings
+            Paths to the R1 and R2 files of each trimming.
+
+        Returns
+        -------
+        dict
+            Number of pairs 'identical' in both, trimmed to 'different' sequences, and written
+            'only_a' or 'only_b', and the set of names of the pairs that are not identical
+            ('mismatched').
+    """
+    a = _read_pairs(fastq_a)
+    b = _read_pairs(fastq_b)
+    mismatched = {name for name in set(a) | set(b) if a.get(name)!=b.get(name)}
+    return {'identical':len(set(a) & set(b)) - len(mismatched & set(a) & set(b)),
+            'different':len(mismatched & set(a) & set(b)),
+            'only_a':len(set(a) - set(b)),'only_b':len(set(b) - set(a)),'mismatched':mismatched}
+#---------------------------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pairs',type=int,default=100000,help="Number of read pairs of the synthetic cell. Defaults to 100000.")
+    parser.add_argument('--dir',type=str,default=None,help="Folder of the synthetic and trimmed files, kept. Defaults to a temporary folder.")
+    parser.add_argument('--cores',type=int,default=1,help="Number of cores of TrimGalore or cutadapt. Defaults to 1.")
+    parser.add_argument('--seed',type=int,default=0,help="Seed of the random generator. Defaults to 0.")
+    o = parser.parse_args()
+
+    root = o.dir if o.dir is not None else tempfile.mkdtemp(prefix='bench_trimming_')
+    try:
+        os.makedirs(root,exist_ok=True)
+        fastq_ins = [os.path.join(root,'cell_R{}.fastq.gz'.format(i)) for i in (1,2)]
+        print("Writing {} synthetic read pairs in {}".format(o.pairs,root))
+        indels = write_fastq_pair(fastq_ins,o.pairs,o.seed)
+        fastq_python = [os.path.join(root,'python','cell_R{0}_val_{0}.fq.gz'.format(i)) for i in (1,2)]
+        os.makedirs(os.path.join(root,'python'),exist_ok=True)
+        start = time.perf_counter()
+        stats = trim_cell(fastq_ins,fastq_python,adapter='Illumina')
+        seconds = time.perf_counter() - start
+        print("{:>12}: {:.1f} s, {:.0f} read pairs/s, {} pairs written".format('python',seconds,
+              o.pairs/seconds,stats['pairs_written']))
+        start = time.perf_counter()
+        reference = reference_trim(fastq_ins,os.path.join(root,'reference'),o.cores)
+        seconds = time.perf_counter() - start
+        if reference is None:
+            print("Neither trim_galore nor cutadapt is installed, the outputs are not compared")
+            sys.exit(0)
+        tool, fastq_reference = reference
+        print("{:>12}: {:.1f} s, {:.0f} read pairs/s with {} cores".format(tool,seconds,
+              o.pairs/seconds,o.cores))
+        result = compare_trimmed(fastq_python,fastq_reference)
+        print("{} identical pairs, {} trimmed differently, {} only written by python and {} only "
+              "by {}".format(result['identical'],result['different'],result['only_a'],
+              result['only_b'],tool))
+        print("{} of the {} pairs that are not identical have an insertion or deletion in the "
+              "adapter".format(len(result['mismatched'] & indels),len(result['mismatched'])))
+    finally:
+        if o.dir is None:
+            shutil.rmtree(root,ignore_errors=True)
@@ -0,0 +1,74 @@
+""" Previous grouping of cells in clones, kept as reference for the benchmarks and tests.
+
+        * generate_clone_sets_legacy
+        * group_sets_legacy
+
+    The sets of sequences of the cells used to be built iterating over the rows of the dataset,
+    and identical sets grouped comparing every set with all the others in two nested loops,
+    which takes a time quadratic in the number of cells.
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import numpy as np
+import pandas as pd
+#---------------------------------------------------------------------------------------------------#
+def generate_clone_sets_legacy(df,cols):
+    """ Returns the clones as a list of sets of CDR3 chains, as done by 'generate_clone_sets'
+        before it was vectorized.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            T-cell dataset containing the CDR3 sequences on interest for each cell.
+        cols : list of strings
+            List with the names of the 4 columns in 'df' where the sequences are.
+
+        Returns
+        -------
+        list of sets
+            List containing sets of sequences defining the clonal form of each cell.
+    """
+    seq_set = []
+    for i in df.iterrows():
+        set_as_list = []
+        for s in i[1][cols].values:
+            if not pd.isna(s):
+                set_as_list.append(s)
+        set_entry = set(set_as_list)
+        seq_set.append(set(set_entry))
+    return seq_set
+#---------------------------------------------------------------------------------------------------#
+def group_sets_legacy(set_list):
+    """ Groups identical sets and returns a list with each set's group number, as done by
+        'group_sets' before it hashed the sets.
+
+        Parameters
+        ----------
+        set_list : list
+            List containing sets to be compared.
+
+        Returns
+        -------
+        np.array
+            Array containing group numbers, the position of the first set of each group, or -1
+            for empty sets. As 0 also marks the sets not grouped yet, the group of the first set
+            is numbered with the position of its second set, if any.
+    """
+    l = len(set_list)
+    group = np.zeros([l],dtype=int)
+    for i in range(l):
+        # Skips the rest of the loop for already assigned sets
+        if group[i]!=0:
+            continue
+        t = [] # List of equality booleans
+        for j in range(l):
+            t.append(set_list[i]==set_list[j])
+        idx = np.where(t)[0] # Array on indices where there is equality
+        if set_list[i]: # For not empty sets
+            group[idx]=i
+        else: # For empty sets
+            group[idx]=-1
+    return group
@@ -0,0 +1,55 @@
+""" Previous parser of 'filtered_TCRs.txt', kept as reference for the benchmarks and tests.
+
+        * create_cell_legacy
+
+    The files used to be read whole with readlines(), the numbers of chains taken from the last
+    character of the 4th and 5th lines and the fields of each chain from the 10 lines after its
+    '##TRINITY' header. It only reads files with up to 9 chains per locus and with that layout of
+    fields, which is what TraCeR writes in practice.
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+from objects import Cell, AlphaChain, BetaChain, GammaChain, DeltaChain
+#---------------------------------------------------------------------------------------------------#
+def create_cell_legacy(in_file,loci):
+    """ Reads the output from TraCeR assemble for a given cell and locus pair, as done by
+        create_cell_from_AB() and append_GD_data() before the streaming parser.
+
+        Parameters
+        ----------
+        in_file : string
+            Path for the 'filtered_TCRs.txt' file.
+        loci : string
+            Locus pair of the file, either 'AB' or 'GD'.
+
+        Returns
+        -------
+        Cell
+            Cell object with the chains of the locus pair and their meta-data loaded.
+    """
+    chain_classes = {'A':AlphaChain,'B':BetaChain,'G':GammaChain,'D':DeltaChain}
+    with open(in_file,'r',encoding='utf8') as f:
+        lines = f.readlines()
+    counts = {'n_' + loci[0]:int(lines[3].strip()[-1]),'n_' + loci[1]:int(lines[4].strip()[-1])}
+    cell = Cell(lines[1].strip(),**counts)
+    names = cell.AB_chain_names if loci=='AB' else cell.GD_chain_names
+    cont = 0
+    for i in range(len(lines)):
+        if lines[i].startswith('##TRINITY'):
+            chain_dict = {}
+            allele = names[cont]
+            locus = allele[0]
+            for line in lines[i+1:i+11]:
+                data_pair = line.strip().split(':\t')
+                if len(data_pair)>1:
+                    chain_dict[data_pair[0]] = data_pair[1]
+            chain = chain_classes[locus](locus,allele)
+            if locus in ['B','D']:
+                chain.add_D_segment(chain_dict['D segment'])
+            chain.fill_metadata(chain_dict)
+            cell.add_chain(chain)
+            cont = cont+1
+    return cell
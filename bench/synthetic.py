@@ -0,0 +1,208 @@
+""" Synthetic inputs for the benchmarks and tests of the pipeline.
+
+        * write_tracer_plate
+        * clone_dataframe
+        * write_fastq_pair
+
+    Writes TraCeR output with the layout read by step 5, i.e.
+    '<root>/AB/<cell>/filtered_TCR_seqs/filtered_TCRs.txt' and the same for GD, with random
+    chains drawn from a small pool of CDR3 sequences so that some cells share clones, builds
+    datasets of CDR3 sequences like the ones grouped in clones by step 6, and writes paired fastq
+    files with adapters and low quality ends like the ones trimmed in step 3. Can be called as a
+    script to write a plate, e.g.
+
+        python3 bench/synthetic.py /tmp/synthetic_plate 100000
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import gzip
+import random
+import argparse
+import numpy as np
+import pandas as pd
+#---------------------------------------------------------------------------------------------------#
+def _chain(rng,locus,i,pool):
+    """ Internal function. Lines of a chain of 'locus' in a 'filtered_TCRs.txt' file."""
+    nt = rng.choice(pool)
+    aa = 'C' + nt[3:9].translate(str.maketrans('ACGT','KSGF'))
+    lines = ['##TRINITY_DN{0}_c0_g1_i{0}##'.format(i),
+             'Productive:\t' + rng.choice(['True','True','False']),
+             'Stop codon:\t' + rng.choice(['True','False']),
+             'In frame:\t' + rng.choice(['True','False']),
+             'ID:\tTR{0}V{1}_{2}_TR{0}J{1}'.format(locus,i,nt[:6]),
+             'V segment:\tTR{}V{}'.format(locus,rng.randint(1,5))]
+    if locus in 'BD':
+        lines.append('D segment:\tTR{}D{}'.format(locus,rng.randint(1,2)))
+    lines += ['J segment:\tTR{}J{}'.format(locus,rng.randint(1,5)),
+              'CDR3aa:\t' + aa,
+              'CDR3nt:\t' + nt,
+              'TPM:\t{:.3f}'.format(rng.uniform(0,1000))]
+    if locus in 'AG':
+        lines.append('')
+    return lines
+#---------------------------------------------------------------------------------------------------#
+def _write_cell(rng,root,loci,cell,counts,pool):
+    """ Internal function. Writes the 'filtered_TCRs.txt' file of a cell and locus pair."""
+    lines = ['------------------',cell,'------------------']
+    lines += ['TCR{} recombinants: {}'.format(locus,n) for locus,n in zip(loci,counts)] + ['']
+    k = 0
+    for locus,n in zip(loci,counts):
+        if n:
+            lines.append('#TCR{}#'.format(locus))
+        for _ in range(n):
+            lines += _chain(rng,locus,k,pool)
+            k += 1
+        lines.append('')
+    folder = os.path.join(root,loci,cell,'filtered_TCR_seqs')
+    os.makedirs(folder)
+    with open(os.path.join(folder,'filtered_TCRs.txt'),'w') as f:
+        f.write('\n'.join(lines) + '\n')
+#---------------------------------------------------------------------------------------------------#
+def write_tracer_plate(root,n_cells,seed=0,max_chains=2):
+    """ Writes the TraCeR output of a synthetic plate.
+
+        About 5% of the cells have an empty AB folder (as TraCeR leaves for cells without
+        TCRs), and about 90% of the rest also have GD output, most of it without chains.
+
+        Parameters
+        ----------
+        root : string
+            Folder where the AB and GD folders are written. Must not exist.
+        n_cells : int
+            Number of cells.
+        seed : int, optional
+            Seed of the random generator. Default is 0.
+        max_chains : int, optional
+            Maximum number of chains of each locus. Default is 2.
+
+        Returns
+        -------
+        list of strings
+            Names of the cells.
+    """
+    rng = random.Random(seed)
+    pool = ['TGT' + ''.join(rng.choice('ACGT') for _ in range(12)) for _ in range(40)]
+    os.makedirs(root)
+    cells = []
+    for i in range(n_cells):
+        cell = 'P1-T-{}{}'.format('ABCDEFGH'[i%8],i)
+        cells.append(cell)
+        if rng.random()<0.05:
+            os.makedirs(os.path.join(root,'AB',cell))
+            continue
+        _write_cell(rng,root,'AB',cell,[rng.randint(0,max_chains) for _ in 'AB'],pool)
+        if rng.random()<0.9:
+            counts = [rng.randint(0,max_chains) for _ in 'GD'] if rng.random()<0.4 else [0,0]
+            _write_cell(rng,root,'GD',cell,counts,pool)
+    return cells
+#---------------------------------------------------------------------------------------------------#
+def clone_dataframe(n_cells,n_seqs=None,missing=0.5,seed=0,cols=('A_1','A_2','B_1','B_2')):
+    """ Dataset of CDR3 sequences of cells, drawn from a pool so that cells share clones.
+
+        Parameters
+        ----------
+        n_cells : int
+            Number of cells.
+        n_seqs : int, optional
+            Number of different sequences. Default is None, meaning a third of the cells.
+        missing : float, optional
+            Fraction of missing sequences (NaN). Default is 0.5.
+        seed : int, optional
+            Seed of the random generator. Default is 0.
+        cols : tuple of strings, optional
+            Names of the columns. Default is ('A_1','A_2','B_1','B_2').
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataset with a column of sequences for each element of 'cols'.
+    """
+    rng = np.random.default_rng(seed)
+    n_seqs = max(1,n_cells//3) if n_seqs is None else n_seqs
+    seqs = np.array(['CAS{}F'.format(i) for i in range(n_seqs)],dtype=object)
+    values = rng.choice(seqs,size=(n_cells,len(cols)))
+    values[rng.random(values.shape)<missing] = np.nan
+    return pd.DataFrame(values,columns=list(cols))
+#---------------------------------------------------------------------------------------------------#
+def _mutate(rng,seq,kind):
+    """ Internal function. Changes a random base of 'seq' ('substitution'), removes one
+        ('deletion') or adds one ('insertion')."""
+    i = rng.randrange(len(seq))
+    if kind=='substitution':
+        return seq[:i] + rng.choice([b for b in 'ACGT' if b!=seq[i]]) + seq[i+1:]
+    if kind=='deletion':
+        return seq[:i] + seq[i+1:]
+    return seq[:i] + rng.choice('ACGT') + seq[i:]
+#---------------------------------------------------------------------------------------------------#
+def write_fastq_pair(fastq_files,n_pairs,seed=0,read_length=150,adapter='AGATCGGAAGAGC',
+                     adapter_rate=0.3,error_rate=0.1,low_quality_rate=0.2):
+    """ Writes the paired fastq files of a synthetic cell.
+
+        A fraction 'adapter_rate' of the pairs have an insert shorter than the reads, so that both
+        mates read through into the adapter, followed by random bases. A fraction 'error_rate' of
+        those adapters have a substitution, and the same fraction have an insertion or deletion.
+        A fraction 'low_quality_rate' of the reads end with bases of quality 2.
+
+        Parameters
+        ----------
+        fastq_files : tuple of strings
+            Paths to the R1 and R2 files, compressed with gzip if they end in '.gz'.
+        n_pairs : int
+            Number of read pairs.
+        seed : int, optional
+            Seed of the random generator. Default is 0.
+        read_length : int, optional
+            Length of the reads. Default is 150.
+        adapter : string, optional
+            Sequence of the adapter. Default is 'AGATCGGAAGAGC' (Illumina).
+        adapter_rate : float, optional
+            Fraction of the pairs with adapter. Default is 0.3.
+        error_rate : float, optional
+            Fraction of the adapters with a substitution, and with an insertion or deletion.
+            Default is 0.1.
+        low_quality_rate : float, optional
+            Fraction of the reads with a low quality 3' end. Default is 0.2.
+
+        Returns
+        -------
+        set of strings
+            Names of the read pairs with an insertion or deletion in the adapter of a mate.
+    """
+    rng = random.Random(seed)
+    indels = set()
+    opener = [gzip.open if f.endswith('.gz') else open for f in fastq_files]
+    with opener[0](fastq_files[0],'wt') as out1, opener[1](fastq_files[1],'wt') as out2:
+        for i in range(n_pairs):
+            name = 'read{}'.format(i)
+            insert = rng.randint(10,read_length-1) if rng.random()<adapter_rate else read_length
+            for out in (out1,out2):
+                seq = ''.join(rng.choice('ACGT') for _ in range(insert))
+                if insert<read_length:
+                    kind = rng.random()
+                    if kind<error_rate:
+                        seq += _mutate(rng,adapter,'substitution')
+                    elif kind<2*error_rate:
+                        seq += _mutate(rng,adapter,rng.choice(['insertion','deletion']))
+                        indels.add(name)
+                    else:
+                        seq += adapter
+                    seq = (seq + ''.join(rng.choice('ACGT') for _ in range(read_length)))[:read_length]
+                qual = ['I']*read_length
+                if rng.random()<low_quality_rate:
+                    n_low = rng.randint(1,30)
+                    qual[read_length-n_low:] = ['#']*n_low
+                out.write('@{}\n{}\n+\n{}\n'.format(name,seq,''.join(qual)))
+    return indels
+#---------------------------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Writes the TraCeR output of a synthetic plate.")
+    parser.add_argument('root',type=str,help="Folder where the AB and GD folders are written.")
+    parser.add_argument('n_cells',type=int,help="Number of cells.")
+    parser.add_argument('--seed',type=int,default=0,help="Seed of the random generator. Defaults to 0.")
+    parser.add_argument('--max_chains',type=int,default=2,help="Maximum number of chains of each locus. Defaults to 2.")
+    o = parser.parse_args()
+    write_tracer_plate(o.root,o.n_cells,o.seed,o.max_chains)
@@ -0,0 +1,737 @@
+""" Functions for demultiplexing zUMIs .bam files into cells.
+
+        * read_condition_file
+        * barcode_neighbours
+        * barcode_report
+        * split_bam
+        * split_bam_to_fastq
+        * BamWriterPool
+        * FastqWriterPool
+        * BarcodeIndex
+
+    Authors: Daniel Ramsköld
+             Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import gzip
+import json
+import time
+import struct
+import warnings
+from array import array
+from collections import OrderedDict, defaultdict
+from itertools import combinations, product
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+import pandas
+import pysam
+import tqdm
+#---------------------------------------------------------------------------------------------------#
+def read_condition_file(condition_csv,tag_col='Barcode',name_col='Name',name_part_filter=None):
+    """ Reads the mapping between barcodes and cell names from the condition file.
+
+        Parameters
+        ----------
+        condition_csv : string
+            Path to the .csv file containing the mapping between the barcodes and the name of
+            the cells.
+        tag_col : string, optional
+            Name of the column containing the barcodes in 'condition_csv'. Default is 'Barcode'.
+        name_col : string, optional
+            Name of the column containing the cell name in 'condition_csv'. Default is 'Name'.
+        name_part_filter : string, optional
+            Substring that the cell names have to contain to be kept. Default is None.
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each barcode to the name of its cell.
+    """
+    CT = pandas.read_csv(condition_csv)
+    if name_part_filter is not None:
+        CT = CT.loc[CT[name_col].str.contains(name_part_filter),:]
+    return dict(zip(CT.loc[:,tag_col], CT.loc[:,name_col].astype(str)))
+#---------------------------------------------------------------------------------------------------#
+def barcode_neighbours(barcodes,max_mismatches=1,alphabet='ACGTN'):
+    """ Maps the sequences within a Hamming distance of the valid barcodes to their barcode.
+
+        Each sequence with at most 'max_mismatches' substitutions from a valid barcode is mapped
+        to the closest one. Sequences at the same, smallest distance of several barcodes are
+        ambiguous and are not corrected. The valid barcodes are mapped to themselves, so that
+        looking up the barcode of a read is a single dictionary access. All the barcodes of the
+        plate have to be given, and not only the selected ones, so that the reads of a cell are
+        never corrected into another.
+
+        Parameters
+        ----------
+        barcodes : iterable of strings
+            Valid barcodes.
+        max_mismatches : int, optional
+            Maximum number of substitutions corrected. Default is 1.
+        alphabet : string, optional
+            Letters of the sequenced barcodes. Default is 'ACGTN'.
+
+        Returns
+        -------
+        corrections : dict
+            Dictionary mapping each valid barcode and each correctable sequence to its barcode.
+        ambiguous : dict
+            Dictionary mapping each ambiguous sequence to the sorted tuple of its closest
+            barcodes.
+    """
+    barcodes = list(dict.fromkeys(barcodes))
+    corrections = {bc:bc for bc in barcodes}
+    ambiguous = {}
+    for distance in range(1,max_mismatches+1):
+        found = defaultdict(set) # Sequences at exactly 'distance' of each barcode
+        for bc in barcodes:
+            for positions in combinations(range(len(bc)),distance):
+                options = [[c for c in alphabet if c!=bc[p]] for p in positions]
+                for letters in product(*options):
+                    seq = list(bc)
+                    for p,c in zip(positions,letters):
+                        seq[p] = c
+                    found[''.join(seq)].add(bc)
+        for seq,bcs in found.items():
+            if seq in corrections or seq in ambiguous: # Closer to some barcode
+                continue
+            if len(bcs)==1:
+                corrections[seq] = next(iter(bcs))
+            else:
+                ambiguous[seq] = tuple(sorted(bcs))
+    return corrections, ambiguous
+#---------------------------------------------------------------------------------------------------#
+def barcode_report(barcode_counts,tag_to_name,corrections,ambiguous):
+    """ Counts the exact, corrected and discarded reads of each cell.
+
+        Parameters
+        ----------
+        barcode_counts : dict
+            Number of reads of each barcode value, as given by 'split_bam'.
+        tag_to_name : dict
+            Dictionary mapping the barcode of each selected cell to its name.
+        corrections : dict
+            Dictionary mapping the correctable sequences to their barcode, as given by
+            'barcode_neighbours'.
+        ambiguous : dict
+            Dictionary mapping the ambiguous sequences to their closest barcodes.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Table with the 'cell', its 'barcode' and its numbers of 'exact', 'corrected' and
+            'discarded' reads, the latter being the reads with a sequence ambiguous between the
+            cell and another one. The last row, with cell '*', has the reads whose barcode is not
+            close to any valid barcode, and all the ambiguous reads as discarded.
+    """
+    cells = {bc:[name,bc,0,0,0] for bc,name in tag_to_name.items()}
+    unassigned = ['*','*',0,0,0]
+    for seq,n in barcode_counts.items():
+        bc = corrections.get(seq)
+        if bc is not None:
+            if bc in cells:
+                cells[bc][2 if seq==bc else 3] += n
+            continue
+        unassigned[4] += n
+        for bc in ambiguous.get(seq,()):
+            if bc in cells:
+                cells[bc][4] += n
+    return pandas.DataFrame(sorted(cells.values()) + [unassigned],
+                            columns=['cell','barcode','exact','corrected','discarded'])
+#---------------------------------------------------------------------------------------------------#
+def split_bam(bam_in,bam_out,tag_to_name,bam_tag_flag='BC',threads=1,position=0,max_open=128,
+              barcode_index=False,count_barcodes=False):
+    """ Splits a multiplexed .bam file into one .bam file per cell.
+
+        Reads the records of 'bam_in' in order and writes each of them into the .bam file of the
+        cell given by its barcode in the tag 'bam_tag_flag'. Records with barcodes not present in
+        'tag_to_name' are discarded. The output files are handled by a BamWriterPool, so that at
+        most 'max_open' of them are open at the same time. The decompression of 'bam_in' uses
+        'threads' htslib threads. With 'barcode_index', only the records of the barcodes in
+        'tag_to_name' are read, seeking to them with the BarcodeIndex of 'bam_in', which is built
+        first if it is missing or outdated. With 'count_barcodes', the records read of each
+        barcode value are counted, e.g. for 'barcode_report'. Prints the throughput once the file
+        has been read.
+
+        Parameters
+        ----------
+        bam_in : string
+            Path to the multiplexed .bam file.
+        bam_out : string
+            Prefix (usually a folder ending in '/') of the output .bam files per cell.
+        tag_to_name : dict
+            Dictionary mapping each barcode to the name of its cell.
+        bam_tag_flag : string, optional
+            The tag in the bam file that contains the sample barcode. Default is 'BC'.
+        threads : int, optional
+            Number of htslib threads to decompress 'bam_in'. Default is 1.
+        position : int, optional
+            Line of the progress bar, to display several splits in parallel. Default is 0.
+        max_open : int, optional
+            Maximum number of output files open at the same time. Default is 128.
+        barcode_index : bool, optional
+            Whether to read only the records of the cells through the barcode index of 'bam_in'.
+            Default is False.
+        count_barcodes : bool, optional
+            Whether to count the records of each barcode value. Default is False.
+
+        Returns
+        -------
+        tuple
+            Number of records read, number of records written, elapsed seconds and the number of
+            records of each barcode value (None if not 'count_barcodes').
+    """
+    start = time.time()
+    n_reads = 0
+    n_written = 0
+    barcode_counts = defaultdict(int) if count_barcodes else None
+    names = set(tag_to_name.values())
+    with pysam.AlignmentFile(bam_in,"rb",check_sq=False,threads=threads) as bam, \
+         BamWriterPool(bam_out,bam,tag_to_name,bam_tag_flag,max_open) as pool:
+        for aln in _records(bam,bam_in,tag_to_name,bam_tag_flag,threads,barcode_index,position):
+            n_reads += 1
+            barcode = aln.get_tag(bam_tag_flag)
+            if barcode_counts is not None:
+                barcode_counts[barcode] += 1
+            name = tag_to_name.get(barcode)
+            if name is not None:
+                pool.write(name,aln)
+                n_written += 1
+    elapsed = time.time() - start
+    print("{}: {} reads in {:.1f} s ({:.0f} reads/s), {} written to {} cells".format(
+          bam_in,n_reads,elapsed,n_reads/max(elapsed,1e-9),n_written,len(names)))
+    return n_reads, n_written, elapsed, barcode_counts
+#---------------------------------------------------------------------------------------------------#
+def split_bam_to_fastq(bam_ins,fastq_out,tag_to_name,bam_tag_flag='BC',threads=1,max_pending=1000000,
+                       compress_level=6,compress_threads=1,barcode_index=False,count_barcodes=False):
+    """ Splits multiplexed .bam files directly into paired fastq.gz files per cell.
+
+        Reads the .bam files in 'bam_ins' one after the other and writes the read pairs of each
+        cell, given by the barcode in the tag 'bam_tag_flag', into '<fastq_out><name>/<name>_R1
+        .fastq.gz' and '<name>_R2.fastq.gz'. The reads of each file are appended after those of
+        the previous one, like the concatenation of the Aligned and unmapped fastq files in
+        '02_bam2fastq.sh'. Equivalent to 'samtools sort -n | samtools fastq' with singletons and
+        reads not flagged as READ1 or READ2 discarded, except that the pairs are written in
+        the order of the input and not sorted by name.
+
+        The mates are paired by read name in a buffer holding at most 'max_pending' reads waiting
+        for their mate. When the buffer is full, the oldest read is discarded as a singleton, so
+        mates further apart than 'max_pending' reads in the input are lost. These evicted reads
+        are counted apart from the singletons left at the end of each file, and a warning is
+        issued if there are any, since their pairs are lost only because of the buffer size.
+
+        Secondary and supplementary alignments are skipped. With 'barcode_index', only the
+        records of the barcodes in 'tag_to_name' are read, as in 'split_bam'. With
+        'count_barcodes', the reads of each barcode value are counted, after skipping secondary,
+        supplementary and unpaired alignments. Prints the throughput of each file once it has
+        been read.
+
+        Parameters
+        ----------
+        bam_ins : list of strings
+            Paths to the multiplexed .bam files, in the order their reads are written.
+        fastq_out : string
+            Prefix (usually a folder ending in '/') of the output folders per cell.
+        tag_to_name : dict
+            Dictionary mapping each barcode to the name of its cell.
+        bam_tag_flag : string, optional
+            The tag in the bam file that contains the sample barcode. Default is 'BC'.
+        threads : int, optional
+            Number of htslib threads to decompress the input files. Default is 1.
+        max_pending : int, optional
+            Maximum number of reads waiting for their mate. Default is 1000000.
+        compress_level : int, optional
+            Gzip compression level of the fastq files, from 0 (stored, not compressed) to 9.
+            Default is 6.
+        compress_threads : int, optional
+            Number of threads compressing the fastq files. Default is 1.
+        barcode_index : bool, optional
+            Whether to read only the records of the cells through the barcode index of each
+            file. Default is False.
+        count_barcodes : bool, optional
+            Whether to count the reads of each barcode value. Default is False.
+
+        Returns
+        -------
+        tuple
+            Number of records read, number of read pairs written, elapsed seconds and the number
+            of reads of each barcode value (None if not 'count_barcodes').
+    """
+    start = time.time()
+    n_reads = 0
+    n_pairs = 0
+    barcode_counts = defaultdict(int) if count_barcodes else None
+    with FastqWriterPool(fastq_out,set(tag_to_name.values()),level=compress_level,
+                         threads=compress_threads) as pool:
+        for bam_in in bam_ins:
+            file_start = time.time()
+            file_reads = 0
+            evicted = 0
+            pending = OrderedDict() # Reads waiting for their mate, by name
+            with pysam.AlignmentFile(bam_in,"rb",check_sq=False,threads=threads) as bam:
+                for aln in _records(bam,bam_in,tag_to_name,bam_tag_flag,threads,barcode_index):
+                    file_reads += 1
+                    if aln.flag & 0x900: # Secondary or supplementary
+                        continue
+                    mate = aln.flag & 0xC0 # READ1 (0x40) or READ2 (0x80)
+                    if mate not in (0x40,0x80):
+                        continue
+                    barcode = aln.get_tag(bam_tag_flag)
+                    if barcode_counts is not None:
+                        barcode_counts[barcode] += 1
+                    name = tag_to_name.get(barcode)
+                    if name is None:
+                        continue
+                    # Reads in different files have no suffix, as in samtools fastq -1 -2
+                    record = _fastq_record(aln)
+                    other = pending.pop(aln.query_name,None)
+                    if other is not None and other[0]!=mate:
+                        r1,r2 = (record,other[1]) if mate==0x40 else (other[1],record)
+                        pool.write(name,r1,r2)
+                        n_pairs += 1
+                    else:
+                        pending[aln.query_name] = (mate,record)
+                        if len(pending)>max_pending:
+                            pending.popitem(last=False)
+                            evicted += 1
+            n_reads += file_reads
+            elapsed = time.time() - file_start
+            print("{}: {} reads in {:.1f} s ({:.0f} reads/s), {} singletons discarded, {} reads "
+                  "evicted from the mate buffer".format(bam_in,file_reads,elapsed,
+                  file_reads/max(elapsed,1e-9),len(pending),evicted))
+            if evicted:
+                warnings.warn("{} reads of {} were discarded because their mate was more than {} "
+                              "reads away. Increase max_pending to keep them.".format(
+                              evicted,bam_in,max_pending),RuntimeWarning)
+    elapsed = time.time() - start
+    print("{} read pairs written to {}".format(n_pairs,fastq_out))
+    return n_reads, n_pairs, elapsed, barcode_counts
+#---------------------------------------------------------------------------------------------------#
+def _records(bam,bam_in,tag_to_name,bam_tag_flag,threads,barcode_index,position=0):
+    """ Internal function. Iterates with a progress bar over all the records of 'bam', or only
+        over those of the barcodes in 'tag_to_name' if 'barcode_index'."""
+    if not barcode_index:
+        return tqdm.tqdm(bam.fetch(until_eof=True),desc=bam_in,position=position)
+    index = BarcodeIndex.load(bam_in,bam_tag_flag)
+    if index is None:
+        index = BarcodeIndex.build(bam_in,bam_tag_flag,threads)
+    return tqdm.tqdm(index.fetch(bam,tag_to_name.keys()),desc=bam_in,position=position,
+                     total=index.n_selected(tag_to_name.keys()))
+#---------------------------------------------------------------------------------------------------#
+def _fastq_record(aln):
+    """ Internal function. Returns the fastq entry of a read in its original orientation."""
+    qual = aln.get_forward_qualities()
+    qual = pysam.qualities_to_qualitystring(qual) if qual is not None else ''
+    return '@{}\n{}\n+\n{}\n'.format(aln.query_name,aln.get_forward_sequence(),qual).encode()
+#---------------------------------------------------------------------------------------------------#
+class BamWriterPool:
+    """ Pool of per-cell .bam writers with a bounded number of open files.
+
+        If there are at most 'max_open' cells, each cell is written directly to its own file.
+        Otherwise, the cells are distributed over 'max_open' temporary bucket files, written in
+        the order the records arrive, and on closing the pool each bucket is split into the files
+        of its cells, which are at most ceil(len(names)/max_open). Since the records of a zUMIs .bam
+        file come in sequencing order and not by barcode, this bounds the number of open files
+        without reopening writers for almost every record. Cells without records get a .bam file
+        with the header only.
+
+        Attributes
+        ----------
+        bam_out : str
+            Prefix (usually a folder ending in '/') of the output .bam files per cell.
+        template : pysam.AlignmentFile
+            File whose header is copied to the output files.
+        tag_to_name : dict
+            Dictionary mapping each barcode to the name of its cell.
+        bam_tag_flag : str
+            The tag in the bam file that contains the sample barcode.
+        names : list
+            Sorted names of all the cells that get an output file.
+        max_open : int
+            Maximum number of writers open at the same time.
+        buckets : list
+            Lists of cell names written together to each temporary bucket file. Empty if the
+            cells are written directly to their files.
+
+        Methods
+        -------
+        __init__(bam_out,template,tag_to_name,bam_tag_flag='BC',max_open=128)
+            Creates the pool, assigning the cells to the buckets if needed.
+        write(name,aln)
+            Writes the record 'aln' into the file (or bucket) of cell 'name', opening it if needed.
+        close()
+            Closes all writers and splits the buckets into the files of their cells.
+        _bucket_path(i)
+            Internal function. Path of the i-th temporary bucket file.
+    """
+    def __init__(self,bam_out,template,tag_to_name,bam_tag_flag='BC',max_open=128):
+        self.bam_out = bam_out
+        self.template = template
+        self.tag_to_name = tag_to_name
+        self.bam_tag_flag = bam_tag_flag
+        self.names = sorted(set(tag_to_name.values()))
+        self.max_open = max_open
+        if max_open<1:
+            raise ValueError("The pool has to allow at least one open file.")
+        if len(self.names)<=max_open:
+            self.buckets = []
+            self._targets = {name:self.bam_out + name + '.bam' for name in self.names}
+        else:
+            n_buckets = max_open
+            if -(-len(self.names)//n_buckets)>max_open:
+                raise ValueError("Too many cells ({}) for {} open files.".format(len(self.names),
+                                                                              max_open))
+            self.buckets = [self.names[i::n_buckets] for i in range(n_buckets)]
+            self._targets = {name:self._bucket_path(i) \
+                             for i,bucket in enumerate(self.buckets) for name in bucket}
+        self._writers = {} # Open writers by target path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def _bucket_path(self,i):
+        return self.bam_out + '__bucket_{}__.bam.tmp'.format(i)
+
+    def write(self,name,aln):
+        target = self._targets[name]
+        writer = self._writers.get(target)
+        if writer is None:
+            writer = pysam.AlignmentFile(target,"wb",template=self.template)
+            self._writers[target] = writer
+        writer.write(aln)
+
+    def close(self):
+        opened = set(self._writers.keys())
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        for i,bucket in enumerate(self.buckets):
+            path = self._bucket_path(i)
+            cell_writers = {name:pysam.AlignmentFile(self.bam_out + name + '.bam',"wb",
+                                                     template=self.template) for name in bucket}
+            if path in opened:
+                with pysam.AlignmentFile(path,"rb",check_sq=False) as bam:
+                    for aln in bam.fetch(until_eof=True):
+                        cell_writers[self.tag_to_name[aln.get_tag(self.bam_tag_flag)]].write(aln)
+                os.remove(path)
+            for writer in cell_writers.values():
+                writer.close()
+        if not self.buckets:
+            # Cells without any record
+            for name in self.names:
+                if self._targets[name] not in opened:
+                    pysam.AlignmentFile(self._targets[name],"wb",template=self.template).close()
+#---------------------------------------------------------------------------------------------------#
+class FastqWriterPool:
+    """ Buffered paired fastq.gz writers per cell with bounded memory and open files.
+
+        The fastq entries of each cell are kept in memory until the buffers of all cells add up to
+        'buffer_size' bytes. Then, the largest buffer is compressed and appended to the files of
+        its cell, which are opened only for that. The buffers are cut in blocks of 'block_size'
+        bytes, compressed as independent gzip members by 'threads' threads and written in order.
+        The concatenation of gzip members is itself a valid gzip file, so the output can be read
+        as usual. Level 0 stores the data without compression in valid gzip members, which is
+        the cheapest option for intermediate files deleted soon after. Every cell gets its pair
+        of files, even if it has no reads.
+
+        Attributes
+        ----------
+        fastq_out : str
+            Prefix (usually a folder ending in '/') of the output folders per cell.
+        names : set
+            Names of all the cells that get output files.
+        buffer_size : int
+            Maximum number of bytes held in the buffers.
+        level : int
+            Gzip compression level, from 0 (stored) to 9.
+        threads : int
+            Number of threads compressing the blocks.
+        block_size : int
+            Size in bytes of the blocks compressed independently.
+
+        Methods
+        -------
+        __init__(fastq_out,names,buffer_size=2**28,level=6,threads=1,block_size=2**20)
+            Creates the output folders and empties the output files of all cells.
+        write(name,r1,r2)
+            Adds the fastq entries 'r1' and 'r2' (bytes) to the buffers of cell 'name', flushing
+            the largest buffer if the total size exceeds 'buffer_size'.
+        close()
+            Flushes all buffers and stops the compression threads.
+        paths(name)
+            Paths of the R1 and R2 files of cell 'name'.
+        _flush(names)
+            Internal function. Compresses and appends the buffers of the cells in 'names' to
+            their files.
+    """
+    def __init__(self,fastq_out,names,buffer_size=2**28,level=6,threads=1,block_size=2**20):
+        if level not in range(10):
+            raise ValueError("The compression level has to be an integer between 0 and 9.")
+        self.fastq_out = fastq_out
+        self.names = names
+        self.buffer_size = buffer_size
+        self.level = level
+        self.threads = threads
+        self.block_size = block_size
+        self._executor = ThreadPoolExecutor(threads) if threads>1 else None
+        self._buffers = {name:([],[]) for name in names}
+        self._sizes = {name:0 for name in names}
+        self._total = 0
+        self._written = set() # Cells with data in their files
+        for name in names:
+            os.makedirs(self.fastq_out + name,exist_ok=True)
+            for path in self.paths(name):
+                open(path,'wb').close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def paths(self,name):
+        prefix = os.path.join(self.fastq_out + name,name)
+        return prefix + '_R1.fastq.gz', prefix + '_R2.fastq.gz'
+
+    def write(self,name,r1,r2):
+        buffers = self._buffers[name]
+        buffers[0].append(r1)
+        buffers[1].append(r2)
+        size = len(r1) + len(r2)
+        self._sizes[name] += size
+        self._total += size
+        if self._total>self.buffer_size:
+            self._flush([max(self._sizes,key=self._sizes.get)])
+
+    def _compress(self,block):
+        return gzip.compress(block,compresslevel=self.level)
+
+    def _flush(self,names):
+        paths = []
+        blocks = []
+        for name in names:
+            for path,buffer in zip(self.paths(name),self._buffers[name]):
+                data = b''.join(buffer)
+                buffer.clear()
+                # At least one (maybe empty) member, so that empty files are valid gzip files
+                for start in range(0,max(len(data),1),self.block_size):
+                    paths.append(path)
+                    blocks.append(data[start:start+self.block_size])
+            self._total -= self._sizes[name]
+            self._sizes[name] = 0
+            self._written.add(name)
+        # Blocks are compressed in parallel (zlib releases the GIL) and written in order
+        if self._executor is None:
+            members = map(self._compress,blocks)
+        else:
+            members = self._executor.map(self._compress,blocks)
+        f = None
+        for path,member in zip(paths,members):
+            if f is None or f.name!=path:
+                if f is not None:
+                    f.close()
+                f = open(path,'ab')
+            f.write(member)
+        if f is not None:
+            f.close()
+
+    def close(self):
+        self._flush([name for name in self.names if self._sizes[name]>0 or name not in self._written])
+        if self._executor is not None:
+            self._executor.shutdown()
+#---------------------------------------------------------------------------------------------------#
+class BarcodeIndex:
+    """ Sidecar index of the records of a multiplexed .bam file by barcode.
+
+        Maps each value of the tag 'bam_tag_flag' to the BGZF virtual offsets of its records, so
+        that the records of a few cells are read by seeking to them instead of decompressing the
+        whole file. Consecutive records with the same barcode (e.g. the two mates of a pair) are
+        stored as one run, with the offset of its first record and its number of records. The
+        index is built with one pass over the file and saved next to it as '<bam_in>.bci'. It
+        keeps the size and modification time of the .bam file and is not loaded if they have
+        changed. Records without the tag are not indexed.
+
+        The file has a JSON header after the magic bytes and its length, followed by the offsets
+        (int64) and the number of records (uint32) of the runs sorted by barcode and offset,
+        which are memory-mapped when loading.
+
+        Attributes
+        ----------
+        bam_in : str
+            Path to the indexed .bam file.
+        bam_tag_flag : str
+            The tag in the bam file that contains the sample barcode.
+        barcodes : list
+            Sorted barcodes found in the file.
+        bounds : numpy.ndarray
+            Position of the first run of each barcode, and the number of runs at the end. The
+            runs of barcodes[i] are bounds[i]:bounds[i+1].
+        offsets : numpy.ndarray
+            Virtual offset of the first record of each run.
+        counts : numpy.ndarray
+            Number of records of each run.
+        n_records : int
+            Number of records of the file, with or without the tag.
+
+        Methods
+        -------
+        build(bam_in,bam_tag_flag='BC',threads=1)
+            Reads the whole .bam file, saves its index and returns it.
+        load(bam_in,bam_tag_flag='BC')
+            Reads the index of a .bam file, or returns None if it is missing or outdated.
+        path(bam_in)
+            Path of the index of a .bam file.
+        save()
+            Writes the index. The file is replaced atomically.
+        n_selected(barcodes)
+            Number of records with the barcodes in 'barcodes'.
+        fetch(bam,barcodes)
+            Iterates over the records of 'bam' with the barcodes in 'barcodes', in file order.
+    """
+    MAGIC = b'BCI\x01'
+    max_skip = 2**15 # Compressed bytes read through instead of seeking
+
+    def __init__(self,bam_in,bam_tag_flag,barcodes,bounds,offsets,counts,n_records):
+        self.bam_in = bam_in
+        self.bam_tag_flag = bam_tag_flag
+        self.barcodes = barcodes
+        self.bounds = bounds
+        self.offsets = offsets
+        self.counts = counts
+        self.n_records = n_records
+        self._positions = {bc:i for i,bc in enumerate(barcodes)}
+
+    @staticmethod
+    def path(bam_in):
+        """ Path of the index of a .bam file."""
+        return bam_in + '.bci'
+
+    @staticmethod
+    def _bam_signature(bam_in):
+        stat = os.stat(bam_in)
+        return {'bam_size':stat.st_size,'bam_mtime_ns':stat.st_mtime_ns}
+
+    @classmethod
+    def build(cls,bam_in,bam_tag_flag='BC',threads=1):
+        """ Reads the whole .bam file with 'threads' htslib threads, saves its index and
+            returns it."""
+        start = time.time()
+        codes = {} # Barcode -> code in order of appearance
+        offsets = array('q')
+        run_codes = array('q')
+        counts = array('I')
+        last = None
+        n_records = 0
+        with pysam.AlignmentFile(bam_in,"rb",check_sq=False,threads=threads) as bam:
+            offset = bam.tell()
+            for aln in tqdm.tqdm(bam,desc='Indexing ' + bam_in):
+                n_records += 1
+                if aln.has_tag(bam_tag_flag):
+                    code = codes.setdefault(aln.get_tag(bam_tag_flag),len(codes))
+                    if code==last:
+                        counts[-1] += 1
+                    else:
+                        offsets.append(offset)
+                        run_codes.append(code)
+                        counts.append(1)
+                    last = code
+                else:
+                    last = None
+                offset = bam.tell()
+        barcodes = sorted(codes)
+        ranks = numpy.empty(len(barcodes),dtype=numpy.int64)
+        ranks[[codes[bc] for bc in barcodes]] = numpy.arange(len(barcodes))
+        keys = ranks[numpy.frombuffer(run_codes,dtype=numpy.int64)] if len(run_codes) else \
+               numpy.zeros(0,dtype=numpy.int64)
+        order = numpy.argsort(keys,kind='stable')
+        bounds = numpy.concatenate([[0],numpy.cumsum(numpy.bincount(keys,minlength=len(barcodes)))])
+        index = cls(bam_in,bam_tag_flag,barcodes,bounds,
+                    numpy.array(offsets,dtype=numpy.int64)[order],
+                    numpy.array(counts,dtype=numpy.uint32)[order],n_records)
+        index.save()
+        print("{}: indexed {} reads of {} barcodes in {} runs in {:.1f} s".format(
+              bam_in,n_records,len(barcodes),len(order),time.time()-start))
+        return index
+
+    def save(self):
+        """ Writes the index next to the .bam file. The file is replaced atomically."""
+        header = dict(self._bam_signature(self.bam_in),tag=self.bam_tag_flag,
+                      n_records=self.n_records,n_runs=len(self.offsets),barcodes=self.barcodes,
+                      bounds=[int(b) for b in self.bounds])
+        header = json.dumps(header).encode()
+        header += b' '*(-(len(self.MAGIC)+8+len(header))%8) # Aligns the arrays to 8 bytes
+        path = self.path(self.bam_in)
+        with open(path + '.tmp','wb') as f:
+            f.write(self.MAGIC + struct.pack('<Q',len(header)) + header)
+            f.write(numpy.ascontiguousarray(self.offsets,dtype='<i8').tobytes())
+            f.write(numpy.ascontiguousarray(self.counts,dtype='<u4').tobytes())
+        os.replace(path + '.tmp',path)
+
+    @classmethod
+    def load(cls,bam_in,bam_tag_flag='BC'):
+        """ Reads the index of a .bam file. Returns None if it is missing, was built for
+            another tag or the .bam file has changed since."""
+        path = cls.path(bam_in)
+        if not os.path.isfile(path):
+            return None
+        with open(path,'rb') as f:
+            if f.read(len(cls.MAGIC))!=cls.MAGIC:
+                return None
+            length, = struct.unpack('<Q',f.read(8))
+            header = json.loads(f.read(length))
+        signature = cls._bam_signature(bam_in)
+        if header['tag']!=bam_tag_flag or any(header[k]!=v for k,v in signature.items()):
+            return None
+        start = len(cls.MAGIC) + 8 + length
+        n_runs = header['n_runs']
+        if n_runs==0:
+            offsets = numpy.zeros(0,dtype='<i8')
+            counts = numpy.zeros(0,dtype='<u4')
+        else:
+            offsets = numpy.memmap(path,dtype='<i8',mode='r',offset=start,shape=(n_runs,))
+            counts = numpy.memmap(path,dtype='<u4',mode='r',offset=start+8*n_runs,shape=(n_runs,))
+        return cls(bam_in,bam_tag_flag,header['barcodes'],numpy.array(header['bounds']),
+                   offsets,counts,header['n_records'])
+
+    def _runs(self,barcodes):
+        """ Internal function. Offsets and number of records of the runs of 'barcodes', sorted
+            by offset."""
+        slices = [slice(self.bounds[i],self.bounds[i+1]) for i in
+                  sorted(self._positions[bc] for bc in set(barcodes) if bc in self._positions)]
+        if not slices:
+            return numpy.zeros(0,dtype=numpy.int64), numpy.zeros(0,dtype=numpy.uint32)
+        offsets = numpy.concatenate([self.offsets[s] for s in slices])
+        counts = numpy.concatenate([self.counts[s] for s in slices])
+        order = numpy.argsort(offsets,kind='stable')
+        return offsets[order], counts[order]
+
+    def n_selected(self,barcodes):
+        """ Number of records with the barcodes in 'barcodes'."""
+        return int(self._runs(barcodes)[1].sum())
+
+    def fetch(self,bam,barcodes):
+        """ Iterates over the records of 'bam' (opened from 'bam_in') with the barcodes in
+            'barcodes', in the order of the file.
+
+            Each run is reached with a seek, except when it starts less than 'max_skip'
+            compressed bytes after the current position. Then the records in between are read
+            and skipped, so that a BGZF block holding several runs is decompressed only once and
+            the read-ahead of the htslib threads is not interrupted.
+        """
+        position = -1
+        for offset,count in zip(*(a.tolist() for a in self._runs(barcodes))):
+            if position<=offset and (offset>>16)-(position>>16)<=self.max_skip:
+                while position<offset:
+                    next(bam)
+                    position = bam.tell()
+            if position!=offset:
+                bam.seek(offset)
+            for _ in range(count):
+                yield next(bam)
+            position = bam.tell()
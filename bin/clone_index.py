@@ -0,0 +1,169 @@
+""" Persistent index of the clones of a cohort, to update its clonality incrementally.
+
+        * CloneIndex
+
+    For each TCR column (e.g. 'TCR_AB_nt'), the index keeps the group number given to each clone
+    key and its total count in the cohort, together with the counts contributed by each dataset
+    (one per plate). Adding a dataset adds its counts and numbers the clones never seen before
+    after the existing ones, so the group numbers already given do not change. Replacing or
+    removing a dataset subtracts its previous counts. The group numbers of an index built at once
+    from all datasets are the same as the ones given by 'group_multiple_with_freq'.
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+#---------------------------------------------------------------------------------------------------#
+class CloneIndex:
+    """ Store of the group number and count of each clone key of a cohort.
+
+        Attributes
+        ----------
+        cols : list of strings
+            Names of the columns with the clone keys, e.g. 'TCR_AB_nt'.
+        groups : dictionary
+            Dictionary mapping each column to a dictionary of clone key -> group number. Keys
+            are never removed, so that a clone that disappears and comes back keeps its number.
+        totals : dictionary
+            Dictionary mapping each column to a dictionary of clone key -> count in the cohort.
+        datasets : dictionary
+            Dictionary mapping the name of each dataset to its 'signature' (e.g. the one given
+            by tracker.signature) and its 'counts', a dictionary of column -> clone key -> count.
+    """
+    def __init__(self,cols):
+        self.cols = list(cols)
+        self.groups = {col:{} for col in self.cols}
+        self.totals = {col:{} for col in self.cols}
+        self.datasets = {}
+
+    @classmethod
+    def load(cls,path):
+        """ Reads an index saved with 'save'."""
+        with open(path) as f:
+            data = json.load(f)
+        index = cls(data['cols'])
+        index.groups = data['groups']
+        index.totals = data['totals']
+        index.datasets = data['datasets']
+        return index
+
+    def save(self,path):
+        """ Saves the index as JSON. The file is replaced atomically."""
+        os.makedirs(os.path.dirname(path) or '.',exist_ok=True)
+        data = {'updated':time.strftime('%Y-%m-%d %H:%M:%S'),'cols':self.cols,
+                'groups':self.groups,'totals':self.totals,'datasets':self.datasets}
+        with open(path + '.tmp','w') as f:
+            json.dump(data,f)
+        os.replace(path + '.tmp',path)
+
+    def remove(self,name):
+        """ Subtracts the counts of the dataset 'name' and forgets it."""
+        for col,counts in self.datasets.pop(name)['counts'].items():
+            totals = self.totals[col]
+            for key,n in counts.items():
+                totals[key] -= n
+                if totals[key]==0:
+                    del totals[key]
+
+    def add(self,name,counts,signature=None):
+        """ Adds the counts of a dataset, replacing its previous counts if it was already added.
+
+            Parameters
+            ----------
+            name : string
+                Name of the dataset, e.g. '<plate>/<file>'.
+            counts : dictionary
+                Counts of the clone keys of each column, as given by 'count_values'.
+            signature : dictionary, optional
+                Signature of the files of the dataset, to know later if it has changed.
+        """
+        if name in self.datasets:
+            self.remove(name)
+        counts = {col:{key:int(n) for key,n in counts[col].items() if n>0} for col in self.cols}
+        for col in self.cols:
+            totals = self.totals[col]
+            for key,n in counts[col].items():
+                totals[key] = totals.get(key,0) + n
+        self.datasets[name] = {'signature':signature,'counts':counts}
+
+    def number_new(self):
+        """ Gives group numbers to the clones without one, after the existing numbers and by
+            decreasing count and key.
+
+            Returns
+            -------
+            dictionary
+                Dictionary mapping each column to the number of new groups.
+        """
+        n_new = {}
+        for col in self.cols:
+            groups = self.groups[col]
+            new = pd.Series({key:n for key,n in self.totals[col].items() if key not in groups},
+                            dtype=int)
+            new = pd.DataFrame({'freq':new.values,'value':new.index}).sort_values(
+                                                        by=['freq','value'],ascending=False)
+            groups.update(zip(new['value'],range(len(groups),len(groups)+len(new))))
+            n_new[col] = len(new)
+        return n_new
+
+    def group(self,df,new_names=None):
+        """ Adds the cohort frequency and group number of the clones of a dataframe.
+
+            Equivalent to 'group_multiple_with_freq' with the counts and group numbers of the
+            index. Adds the columns 'freq_'+name and 'group_'+name for each column of the index
+            and sorts the dataframe by group number, with the last column as the main key.
+
+            Parameters
+            ----------
+            df : pd.DataFrame
+                Dataframe with the clone key columns of the index.
+            new_names : list of strings, optional
+                Suffixes of the names of the new columns, instead of using the names of the
+                columns of the index. Default is None.
+
+            Raises
+            ------
+            ValueError
+                If 'new_names' and the columns have different lengths, or if the index lacks
+                clone keys of 'df'.
+
+            Returns
+            -------
+            pd.DataFrame
+                Dataframe with additional columns for group number and frequency of each column.
+        """
+        if new_names is None:
+            new_names = self.cols
+        elif len(new_names)!=len(self.cols):
+            raise ValueError("'new_names' has to have the same length as the index columns.")
+        new_cols = {}
+        ranks = []
+        for col,name in zip(self.cols,new_names):
+            keys = pd.Index(list(self.totals[col]))
+            codes = keys.get_indexer(df[col])
+            na = codes<0
+            if np.any(na & df[col].notna().to_numpy()):
+                raise ValueError("The index lacks clone keys of column '{}'.".format(col))
+            freq_values = np.append(np.fromiter(self.totals[col].values(),dtype=int,
+                                                count=len(keys)),0)[codes]
+            group = np.append(np.fromiter((self.groups[col][key] for key in keys),dtype=int,
+                                          count=len(keys)),len(self.groups[col]))[codes]
+            ranks.append(group.copy()) # NaNs are sorted last
+            freq = pd.array(freq_values,dtype=pd.Int64Dtype())
+            if np.any(na):
+                freq[na] = pd.NA
+                group = pd.array(group,dtype=pd.Int64Dtype())
+                group[na] = pd.NA
+            new_cols['freq_'+name] = freq
+            new_cols['group_'+name] = group
+        order = np.lexsort(ranks)
+        DF = df.take(order)
+        for name,values in new_cols.items():
+            DF[name] = values[order]
+        return DF
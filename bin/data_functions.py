@@ -1,8 +1,15 @@
 """ Specific functions for TCR dataset treatment in pandas.
 
         * read_dataframe
+        * export_dataframe
+        * locus_summary
         * group_with_freq
+        * group_multiple_with_freq
+        * count_values
+        * merge_counts
         * generate_clone_sets
+        * generate_clone_keys
+        * group_fuzzy_clones
         * group_sets
         * concat_seqs_in_set
 
@@ -14,18 +21,23 @@
 import numpy as np
 import pandas as pd
 from collections import defaultdict
-from itertools import product
+from itertools import product, permutations
 #---------------------------------------------------------------------------------------------------#
-def read_dataframe(in_file):
+def read_dataframe(in_file,columns=None):
     """ Generalizes imports in pandas, independent of the input's type or extension.
 
         A wrapper function to import a generalized tabular dataset to pandas without
-        the need to specify its type. It accepts `.tsv`, `.csv` and `.xlsx` formats.
+        the need to specify its type. It accepts `.tsv`, `.csv` and `.xlsx` formats, as well as
+        the binary columnar formats `.parquet` and `.feather` (Arrow IPC, also `.arrow`), that
+        keep the dtypes of the columns. Feather files are memory-mapped, so that reading them
+        without compression is close to zero-copy.
 
         Parameters
         ----------
         in_file : string
-            Path to the dataset in `.tsv`, `.csv` or `.xlsx` formats.
+            Path to the dataset in `.tsv`, `.csv`, `.xlsx`, `.parquet` or `.feather` formats.
+        columns : list of strings, optional
+            Columns to read, besides the index. Default is None, meaning all columns.
 
         Returns
 
@@ -34,14 +46,120 @@ def read_dataframe(in_file):
             Imported dataframe.
     """
     file_type = in_file.split('.')[-1]
+    if file_type in ['tsv','csv','xlsx']:
+        if file_type == 'xlsx':
+            read, kwargs = pd.read_excel, {}
+        else:
+            read, kwargs = pd.read_csv, {'sep':'\t' if file_type=='tsv' else ','}
+        if columns is not None:
+            index = read(in_file,nrows=0,**kwargs).columns[0]
+            kwargs['usecols'] = [index] + list(columns)
+        return read(in_file,index_col=0,**kwargs)
+    elif file_type == 'parquet':
+        return pd.read_parquet(in_file,columns=columns)
+    elif file_type in ['feather','arrow']:
+        import pyarrow as pa
+        from pyarrow import feather
+        if columns is not None:
+            with pa.memory_map(in_file) as source:
+                index = pa.ipc.open_file(source).schema.pandas_metadata['index_columns']
+            columns = [c for c in index if isinstance(c,str)] + list(columns)
+        return feather.read_table(in_file,columns=columns,memory_map=True).to_pandas()
+    else:
+        raise NameError("Invalid input format. Has to be either .tsv, .csv, .xlsx, .parquet or .feather.")
+#---------------------------------------------------------------------------------------------------#
+def export_dataframe(df,out_file):
+    """ Generalizes exports in pandas, choosing the format from the extension of the file.
+
+        It accepts `.tsv`, `.csv` and `.xlsx` formats, as well as the binary columnar formats
+        `.parquet` and `.feather` (Arrow IPC, also `.arrow`), that keep the dtypes of the
+        columns (e.g. categorical V and J usages) and the index. Feather files are written
+        without compression, so that they can be memory-mapped by read_dataframe().
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Dataframe to export.
+        out_file : string
+            Path to the output file in `.tsv`, `.csv`, `.xlsx`, `.parquet` or `.feather` formats.
+    """
+    file_type = out_file.split('.')[-1]
     if file_type == 'tsv':
-        return pd.read_csv(in_file,sep='\t',index_col=0)
+        df.to_csv(out_file,sep='\t')
     elif file_type == 'xlsx':
-        return pd.read_excel(in_file,index_col=0)
+        df.to_excel(out_file)
     elif file_type == 'csv':
-        return pd.read_csv(in_file,sep=',',index_col=0)
+        df.to_csv(out_file,sep=',')
+    elif file_type == 'parquet':
+        df.to_parquet(out_file)
+    elif file_type in ['feather','arrow']:
+        import pyarrow as pa
+        from pyarrow import feather
+        feather.write_feather(pa.Table.from_pandas(df,preserve_index=True),out_file,
+                              compression='uncompressed')
     else:
-        raise NameError("Invalid input format. Has to be either .tsv, .csv or .xlsx.")
+        raise NameError("Invalid output format. Has to be either .tsv, .csv, .xlsx, .parquet or .feather.")
+#---------------------------------------------------------------------------------------------------#
+ALLELES = ['A_1','A_2','B_1','B_2','G_1','G_2','D_1','D_2']
+FLAGS = ['productive','stop_codon','in_frame']
+def locus_summary(df,alleles=ALLELES):
+    """ Calculates the productive chains per locus and masks the unproductive CDR3 sequences.
+
+        Reshapes the flag columns ('<allele>_productive', '_stop_codon' and '_in_frame') and the
+        CDR3 columns ('<allele>_CDR3nt' and '_CDR3aa') of all alleles into arrays of shape
+        (cells × alleles × fields), so that the flags are converted, the productive chains
+        counted and the sequences masked at once for all alleles. Columns of alleles missing in
+        'df' are taken as empty.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            TCR dataset with one row per cell and the columns of the chain alleles.
+        alleles : list of strings, optional
+            Alleles to summarize. Default is ALLELES, the 2 alleles of the A, B, G and D loci.
+
+        Returns
+        -------
+        flags : pd.DataFrame
+            Flags of each allele as integers, with missing values as 0.
+        counts : pd.DataFrame
+            Number of productive chains of each locus ('A_productive', 'B_productive',
+            'G_productive' and 'D_productive') and pair of loci ('AB_productive' and
+            'GD_productive').
+        masked : dictionary
+            Dictionary with the CDR3 columns of the alleles of each pair of loci and sequence
+            type, with NaNs for the unproductive chains. The keys are 'ABnt', 'ABaa', 'GDnt' and
+            'GDaa'.
+    """
+    n = len(df)
+    alleles = np.array(alleles)
+    loci = np.array([a[0] for a in alleles])
+    flag_cols = [a + '_' + f for a in alleles for f in FLAGS]
+    flags = df.reindex(columns=flag_cols).to_numpy(dtype=float,na_value=0).astype(int)
+    productive = flags.reshape(n,len(alleles),len(FLAGS))[:,:,0]
+    flags = pd.DataFrame(flags,index=df.index,columns=flag_cols)
+    # Productive chains per locus and pair of loci
+    counts = {}
+    for l in ['A','B','G','D']:
+        counts[l + '_productive'] = productive[:,loci==l].sum(axis=1)
+    for pair in ['AB','GD']:
+        counts[pair + '_productive'] = productive[:,np.isin(loci,list(pair))].sum(axis=1)
+    counts = pd.DataFrame(counts,index=df.index)
+    # CDR3 sequences of unproductive chains are masked
+    seq_cols = [a + '_CDR3' + s for a in alleles for s in ['nt','aa']]
+    seqs = np.full((n,len(seq_cols)),np.nan,dtype=object)
+    for i,col in enumerate(seq_cols):
+        if col in df.columns:
+            seqs[:,i] = df[col].to_numpy(dtype=object,na_value=np.nan)
+    seqs[np.repeat(productive==0,2,axis=1)] = np.nan
+    seqs = seqs.reshape(n,len(alleles),2)
+    masked = {}
+    for pair in ['AB','GD']:
+        in_pair = np.isin(loci,list(pair))
+        for i,s in enumerate(['nt','aa']):
+            masked[pair + s] = pd.DataFrame(seqs[:,in_pair,i],index=df.index,dtype=object,
+                                            columns=[a + '_CDR3' + s for a in alleles[in_pair]])
+    return flags, counts, masked
 #---------------------------------------------------------------------------------------------------#
 def group_with_freq(df,col,group_unique=False,new_name=None):
     """ Groups identical values and calculates their frequency, returning an updated dataframe.
@@ -71,27 +189,130 @@ def group_with_freq(df,col,group_unique=False,new_name=None):
         pd.DataFrame
             Dataframe with additional columns for group number and frequency.
     """
-    DF = df.copy()
-    freq_col_name = 'freq_' + col if new_name is None else 'freq_' + new_name
-    group_col_name = 'group_'+col if new_name is None else 'group_' + new_name
-
-    DF[freq_col_name] = DF[col].map(DF[col].value_counts()).astype(pd.Int64Dtype())
-    DF.sort_values(by=[freq_col_name,col],ascending=False,inplace=True)
-    if group_unique:
-        # Default dict for cluster numbers. Return -1 if unseen instance
-        seq2idx = defaultdict(lambda : -1)
-        n_rep = len(DF.loc[DF[freq_col_name]!=1])
-        seqs = DF.loc[:,col].iloc[:n_rep].unique()
-    else:
-        seq2idx = {}
-        seqs = DF[col].unique()
-
-    for n,g in enumerate(seqs):
-        seq2idx[g]= n
-    # Array with cluster numbers for each sequence
-    group = np.array([seq2idx[i[col]] if not isinstance(i[col], float) \
-                      else pd.NA for _,i in DF.iterrows()])
-    DF[group_col_name]=group # Add cluster number to df
+    new_names = None if new_name is None else [new_name]
+    return group_multiple_with_freq(df,[col],group_unique=group_unique,new_names=new_names)
+#---------------------------------------------------------------------------------------------------#
+def count_values(df,cols):
+    """ Counts the values of several columns of a dataframe, ignoring NaNs.
+
+        Map step of 'group_multiple_with_freq' when the dataset is split in parts (e.g. plates).
+        The counts of the parts are added with 'merge_counts' and passed to
+        'group_multiple_with_freq' to group each part with the frequencies of the whole dataset.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Dataframe with the columns of values to count.
+        cols : list of strings
+            Names of the columns holding the values to count.
+
+        Returns
+        -------
+        dictionary
+            Dictionary mapping each column to a pd.Series with the count of each value.
+    """
+    return {col:df[col].value_counts(sort=False) for col in cols}
+#---------------------------------------------------------------------------------------------------#
+def merge_counts(counts_list):
+    """ Adds the value counts of several parts of a dataset, given by 'count_values'.
+
+        Reduce step of 'group_multiple_with_freq' when the dataset is split in parts.
+
+        Parameters
+        ----------
+        counts_list : list of dictionaries
+            Dictionaries returned by 'count_values' for each part, with the same columns.
+
+        Returns
+        -------
+        dictionary
+            Dictionary mapping each column to a pd.Series with the total count of each value.
+    """
+    return {col:pd.concat([counts[col] for counts in counts_list]).groupby(level=0,sort=False).sum()
+            for col in counts_list[0]}
+#---------------------------------------------------------------------------------------------------#
+def group_multiple_with_freq(df,cols,group_unique=False,new_names=None,counts=None):
+    """ Groups identical values and calculates their frequency for several columns at once.
+
+        Batched version of 'group_with_freq'. For each column in 'cols', calculates the frequency
+        of each value, adding it into a column named 'freq_'+col, and assigns a group number to
+        each unique value in a column named 'group_'+col. Group numbers are given by decreasing
+        frequency and value. NaNs have no frequency nor group. If the parameter 'group_unique' is
+        True, values that appear only once are grouped in one group labelled as -1. The suffixes
+        of the new columns can be changed giving a list of strings as 'new_names' parameter.
+
+        The values are factorized and counted column-wise, without iterating over the rows. The
+        dataframe is copied and sorted only once, in the same order as consecutive calls of
+        'group_with_freq' for each column in 'cols' would produce, that is, with the last column
+        as the main sorting key.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Dataframe with the columns of values to group
+        cols : list of strings
+            Names of the columns holding the values to analyze.
+        group_unique : bool, optional
+            Wether to group samples that only appear once in a group labelled '-1' or mantain each
+            unique element as a separate group. Default is False.
+        new_names : list of strings, optional
+            Suffixes of the names of the new columns, instead of using the names of the old
+            columns. Has to have the same length as 'cols'. Default is None.
+        counts : dictionary, optional
+            Counts of the values of each column, as given by 'count_values' or 'merge_counts',
+            to use instead of the counts in 'df', e.g. the counts of a larger dataset that 'df'
+            is part of. Default is None.
+
+        Raises
+        ------
+        ValueError
+            If 'new_names' and 'cols' have different lengths, or if 'counts' lacks values of 'df'.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe with additional columns for group number and frequency of each column.
+    """
+    if new_names is None:
+        new_names = cols
+    elif len(new_names)!=len(cols):
+        raise ValueError("'new_names' has to have the same length as 'cols'.")
+    if counts is None:
+        counts = count_values(df,cols)
+    new_cols = {}
+    ranks = [] # Sorting keys, the last column being the main one
+    for col,name in zip(cols,new_names):
+        uniques = counts[col].index
+        codes = uniques.get_indexer(df[col]) # NaNs are coded as -1
+        na = codes<0
+        if np.any(na & df[col].notna().to_numpy()):
+            raise ValueError("'counts' lacks values of column '{}'.".format(col))
+        counts_col = counts[col].to_numpy()
+        # Rank of each unique value by decreasing frequency and value
+        order = pd.DataFrame({'freq':counts_col,'value':uniques}).sort_values(by=['freq','value'],
+                                                                               ascending=False).index
+        rank = np.empty(len(uniques)+1,dtype=int)
+        rank[order] = np.arange(len(uniques))
+        rank[-1] = len(uniques) # NaNs are sorted last
+        rank = rank[codes]
+        ranks.append(rank)
+        # Frequency and cluster number for each value
+        freq_values = np.append(counts_col,0)[codes]
+        freq = pd.array(freq_values,dtype=pd.Int64Dtype())
+        group = rank.copy()
+        if group_unique:
+            group[freq_values==1] = -1
+        if np.any(na):
+            freq[na] = pd.NA
+            group = pd.array(group,dtype=pd.Int64Dtype())
+            group[na] = pd.NA
+        new_cols['freq_'+name] = freq
+        new_cols['group_'+name] = group
+    # Sort once and add the new columns
+    order = np.lexsort(ranks)
+    DF = df.take(order)
+    for name,values in new_cols.items():
+        DF[name] = values[order]
     return DF
 #---------------------------------------------------------------------------------------------------#
 def generate_clone_sets(df,cols):
@@ -129,25 +350,244 @@ def generate_clone_sets(df,cols):
         raise ValueError("Incomplete column list. It has to have 4 loci.")
     elif len(cols)>4:
         raise ValueError("Too many loci columns given. It has to have 4 loci.")
-    seq_set = []
-    for i in df.iterrows():
-        set_as_list = []
-        for s in i[1][cols].values:
-            if not pd.isna(s):
-                set_as_list.append(s)
-        set_entry = set(set_as_list)
-        seq_set.append(set(set_entry))
+    seqs = df[cols].to_numpy(dtype=object)
+    seq_set = [set(s for s in row if not pd.isna(s)) for row in seqs]
     return seq_set
 #---------------------------------------------------------------------------------------------------#
+def generate_clone_keys(df,clone_cols):
+    """ Returns the clones of several clone definitions as canonical concatenated sequences.
+
+        Columnar alternative to 'concat_seqs_in_set(generate_clone_sets(df,cols))' for several
+        clone definitions at once. The sequences of each definition are sorted and deduplicated
+        for every cell in a single call over all the columns, and then concatenated in that order.
+        The key is therefore deterministic and identical for cells with equal sets of sequences,
+        regardless of the allele where each sequence comes from. Cells without sequences have an
+        empty string ('') as key.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            T-cell dataset containing the CDR3 sequences on interest for each cell.
+        clone_cols : dict
+            Dictionary mapping the name of each clone definition to the list of 4 columns in 'df'
+            where its sequences are. E.g. {'TCR_AB_nt':['A_1_CDR3nt','A_2_CDR3nt','B_1_CDR3nt',
+            'B_2_CDR3nt']}.
+
+        Raises
+        ------
+        ValueError
+            If any of the column lists has not exactly 4 entries.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe with the same index as 'df' and a column of clone keys per clone definition.
+    """
+    for cols in clone_cols.values():
+        if len(cols)<4:
+            raise ValueError("Incomplete column list. It has to have 4 loci.")
+        elif len(cols)>4:
+            raise ValueError("Too many loci columns given. It has to have 4 loci.")
+    all_cols = [c for cols in clone_cols.values() for c in cols]
+    seqs = df[all_cols].to_numpy(dtype=object,na_value='')
+    seqs = _canonical_clone_array(seqs.reshape(len(df),len(clone_cols),4))
+    # Concatenate the sorted sequences, column by column for all cells at once
+    keys = seqs[:,:,0]
+    for i in range(1,4):
+        keys = keys + seqs[:,:,i]
+    return pd.DataFrame(keys,index=df.index,columns=list(clone_cols.keys()))
+#---------------------------------------------------------------------------------------------------#
+def group_fuzzy_clones(df,clone_cols,k=1,new_names=None):
+    """ Groups the clones whose sequences differ in at most 'k' edits and calculates their frequency.
+
+        Near-match version of grouping the clones given by 'generate_clone_keys', to keep
+        together cells of the same clone whose CDR3 differ because of sequencing errors. Two
+        clones are neighbours if they have the same number of sequences and these can be paired
+        with at most 'k' edits (Levenshtein distance) in total. Fuzzy clones are the connected
+        components of neighbour clones, so a fuzzy clone can contain sequences that differ in
+        more than 'k' edits through intermediate clones.
+
+        The pairs of close sequences are found without comparing all of them, with a hash index
+        of the sequences obtained deleting up to 'k' characters of each (deletion neighbourhood).
+        Two sequences within 'k' edits share at least one of these. The sequences are indexed by
+        length, one length at a time, and only queried with the sequences up to 'k' characters
+        longer, so that the index holds a single length bucket. The size of the neighbourhood of
+        each sequence grows as its length to the power of 'k', which makes 'k' above 2 slow for
+        nucleotide sequences.
+
+        Frequencies are the number of cells of each fuzzy clone. Group numbers are given by
+        decreasing frequency and, for equal frequencies, by decreasing key of the most frequent
+        clone of each fuzzy clone. With 'k'=0 they are the same as the groups of exact clones.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            T-cell dataset containing the CDR3 sequences on interest for each cell, masked as
+            for 'generate_clone_keys'.
+        clone_cols : dict
+            Dictionary mapping the name of each clone definition to the list of 4 columns in 'df'
+            where its sequences are. E.g. {'TCR_AB_nt':['A_1_CDR3nt','A_2_CDR3nt','B_1_CDR3nt',
+            'B_2_CDR3nt']}.
+        k : int, optional
+            Maximum number of edits between neighbour clones. Default is 1.
+        new_names : list of strings, optional
+            Suffixes of the names of the new columns, instead of using the names of the clone
+            definitions. Has to have the same length as 'clone_cols'. Default is None.
+
+        Raises
+        ------
+        ValueError
+            If any of the column lists has not exactly 4 entries, or if 'new_names' and
+            'clone_cols' have different lengths.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe with the same index as 'df' and the columns 'freq_fuzzy_'+name and
+            'group_fuzzy_'+name for each clone definition.
+    """
+    if new_names is None:
+        new_names = list(clone_cols.keys())
+    elif len(new_names)!=len(clone_cols):
+        raise ValueError("'new_names' has to have the same length as 'clone_cols'.")
+    for cols in clone_cols.values():
+        if len(cols)!=4:
+            raise ValueError("The column lists have to have 4 loci.")
+    all_cols = [c for cols in clone_cols.values() for c in cols]
+    seqs = df[all_cols].to_numpy(dtype=object,na_value='')
+    seqs = _canonical_clone_array(seqs.reshape(len(df),len(clone_cols),4))
+    out = pd.DataFrame(index=df.index)
+    for d,name in enumerate(new_names):
+        # Unique clones and their counts
+        sep_keys = seqs[:,d,0]
+        for i in range(1,4):
+            sep_keys = sep_keys + '\t' + seqs[:,d,i]
+        codes,uniques = pd.factorize(sep_keys)
+        counts = np.bincount(codes,minlength=len(uniques))
+        clones = [tuple(s for s in u.split('\t') if s) for u in uniques]
+        # Close pairs of sequences
+        seq_ids = {}
+        for clone in clones:
+            for s in clone:
+                seq_ids.setdefault(s,len(seq_ids))
+        pairs = _close_sequence_pairs(list(seq_ids),k)
+        neighbours = defaultdict(list)
+        for i,j in pairs:
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+        dist = lambda i,j: 0 if i==j else pairs.get((min(i,j),max(i,j)),k+1)
+        # Clones containing each sequence
+        containing = defaultdict(list)
+        ids = [tuple(seq_ids[s] for s in clone) for clone in clones]
+        for c,clone in enumerate(ids):
+            for i in clone:
+                containing[i].append(c)
+        # Connected components of neighbour clones
+        parent = list(range(len(ids)))
+        def find(c):
+            while parent[c]!=c:
+                parent[c] = parent[parent[c]]
+                c = parent[c]
+            return c
+        for c,clone in enumerate(ids):
+            if not clone:
+                continue
+            candidates = {o for i in [clone[0]] + neighbours[clone[0]] for o in containing[i]
+                          if o>c and len(ids[o])==len(clone)}
+            for o in candidates:
+                if min(sum(dist(i,j) for i,j in zip(clone,perm))
+                       for perm in permutations(ids[o]))<=k:
+                    parent[find(o)] = find(c)
+        roots = [find(c) for c in range(len(ids))]
+        # Rank the fuzzy clones by frequency and key of their most frequent clone
+        table = pd.DataFrame({'root':roots,'count':counts,'key':[''.join(c) for c in clones]})
+        table['freq'] = table.groupby('root')['count'].transform('sum')
+        rep = table.sort_values(by=['count','key'],ascending=False).drop_duplicates('root')
+        rep = rep.sort_values(by=['freq','key'],ascending=False)
+        rank = pd.Series(np.arange(len(rep)),index=rep['root'].to_numpy())
+        out['freq_fuzzy_'+name] = table['freq'].to_numpy()[codes]
+        out['group_fuzzy_'+name] = rank[table['root']].to_numpy()[codes]
+    return out
+#---------------------------------------------------------------------------------------------------#
+def _deletion_neighborhood(seq,k):
+    """ Internal function. Returns the strings obtained deleting up to 'k' characters of 'seq'."""
+    variants = {seq}
+    level = {seq}
+    for _ in range(k):
+        level = {s[:i] + s[i+1:] for s in level for i in range(len(s))}
+        variants |= level
+    return variants
+#---------------------------------------------------------------------------------------------------#
+def _edit_distance(a,b,k):
+    """ Internal function. Returns the Levenshtein distance between 'a' and 'b', or k+1 if it is
+        larger than 'k'. Only the diagonal band of width 2k+1 of the distance matrix is filled.
+    """
+    if len(a)>len(b):
+        a,b = b,a
+    if len(b)-len(a)>k:
+        return k+1
+    big = k+1
+    prev = [j if j<=k else big for j in range(len(b)+1)]
+    for i in range(1,len(a)+1):
+        lo,hi = max(1,i-k),min(len(b),i+k)
+        cur = [big]*(len(b)+1)
+        cur[lo-1] = i if lo==1 and i<=k else big
+        ca = a[i-1]
+        for j in range(lo,hi+1):
+            cur[j] = min(prev[j]+1,cur[j-1]+1,prev[j-1]+(ca!=b[j-1]),big)
+        if min(cur[lo-1:hi+1])>k:
+            return big
+        prev = cur
+    return prev[len(b)]
+#---------------------------------------------------------------------------------------------------#
+def _close_sequence_pairs(seqs,k):
+    """ Internal function. Finds the pairs of sequences within 'k' edits.
+
+        Parameters
+        ----------
+        seqs : list of strings
+            Unique sequences.
+        k : int
+            Maximum Levenshtein distance.
+
+        Returns
+        -------
+        dictionary
+            Dictionary mapping the positions (i,j) in 'seqs' of each close pair, with i<j, to
+            their distance.
+    """
+    by_length = defaultdict(list)
+    for i,s in enumerate(seqs):
+        by_length[len(s)].append(i)
+    pairs = {}
+    if k<1:
+        return pairs
+    for length in sorted(by_length):
+        # Index of the sequences of this length, queried with the ones up to k longer
+        index = defaultdict(list)
+        for i in by_length[length]:
+            for v in _deletion_neighborhood(seqs[i],k):
+                index[v].append(i)
+        for query in range(length,length+k+1):
+            for j in by_length.get(query,()):
+                candidates = set()
+                for v in _deletion_neighborhood(seqs[j],k):
+                    candidates.update(index.get(v,()))
+                for i in candidates:
+                    if query==length and i>=j:
+                        continue
+                    d = _edit_distance(seqs[i],seqs[j],k)
+                    if d<=k:
+                        pairs[(min(i,j),max(i,j))] = d
+    return pairs
+#---------------------------------------------------------------------------------------------------#
 def group_sets(set_list):
     """ Groups identical sets and returns a list with each set's group number.
 
-        Iterates over a list of sets making one-by-one comparisons between elements
-        to determine equality. The method uses 2 nested for loops, having a complexity of
-        at most N^2, this due to the unhashable nature of python sets. A preliminar if
-        statement determining if a set has or has not been evaluated before, reducing
-        complexity and improving efficiently *slightly*. Identical sets are grouped
-        together and assigned a group number, which is appended to a list which is returned.
+        Iterates once over a list of sets, hashing each set as a frozenset in a dictionary
+        that maps it to the position of its first appearance. Identical sets are grouped
+        together and assigned that position as group number, which is appended to a list
+        which is returned. Empty sets are assigned the group number -1.
 
         Parameters
         ----------
@@ -161,26 +601,46 @@ def group_sets(set_list):
     """
     l = len(set_list)
     group = np.zeros([l],dtype=int)
+    set2idx = {} # Position of the first appearance of each set
     for i in range(l):
-        # Skips the rest of the loop for already assigned sets
-        if group[i]!=0:
-            continue
-        t = [] # List of equality booleans
-        for j in range(l):
-            t.append(set_list[i]==set_list[j])
-        idx = np.where(t)[0] # Array on indices where there is equality
         if set_list[i]: # For not empty sets
-            group[idx]=i
+            group[i] = set2idx.setdefault(frozenset(set_list[i]),i)
         else: # For empty sets
-            group[idx]=-1
+            group[i] = -1
     return group
 #---------------------------------------------------------------------------------------------------#
+def _canonical_clone_array(seqs):
+    """ Internal function. Returns the sequences of each cell in canonical order.
+
+        Sorts the sequences of 'seqs' along its last axis and replaces repeated sequences
+        with empty strings, that are moved to the beginning. Two cells have identical
+        rows if and only if their sets of sequences are equal.
+
+        Parameters
+        ----------
+        seqs : np.array
+            Object array of strings with the sequences of each cell along the last axis.
+            Missing sequences have to be given as empty strings ('').
+
+        Returns
+        -------
+        np.array
+            Object array of the same shape as 'seqs' with the sorted sequences of each cell.
+    """
+    seqs = np.sort(seqs,axis=-1)
+    # Blank out sequences identical to the previous one in the row
+    repeated = np.zeros(seqs.shape,dtype=bool)
+    repeated[...,1:] = seqs[...,1:]==seqs[...,:-1]
+    seqs[repeated] = ''
+    return np.sort(seqs,axis=-1)
+#---------------------------------------------------------------------------------------------------#
 def concat_seqs_in_set(set_list):
     """ Concatenates the elements of the sets of a list of sets.
 
-        Iterates over a list of sets 'set_list', concatenating its elements
-        provided that they are strings and returns the concatenated sequences as
-        entries of a list.
+        Iterates over a list of sets 'set_list', concatenating its elements in
+        alphabetical order provided that they are strings, and returns the concatenated
+        sequences as entries of a list. The order makes the output independent of the
+        iteration order of the sets.
 
         Parameters
         ----------
@@ -201,10 +661,8 @@ def concat_seqs_in_set(set_list):
     """
     clones = []
     for s in set_list:
-        clone = ''
         for seq in s:
             if type(seq) is not str:
                 raise ValueError("The elements of the set have to be strings")
-            clone = clone+seq
-        clones.append(clone)
+        clones.append(''.join(sorted(s)))
     return clones
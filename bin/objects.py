@@ -1,6 +1,15 @@
+import os
+import sys
+import tqdm
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 class Cell:
     """ Class describing a T-cell with A, B, G and D chains.
 
+        The attributes are stored in __slots__ instead of a per-object dictionary, to keep the
+        memory of many cells (e.g. several plates collected in one process) low.
+
         Attributes
         ----------
         name : str
@@ -17,10 +26,10 @@ class Cell:
             Name of the sequencing batch.
         AB_chain_names : list
             List with strings representing the locus and alleles of AB chains.
-            E.g. ['A_1','B_1']
+            E.g. ['A_1','B_1']. Created from n_A and n_B when accessed.
         GD_chain_names : list
             List with strings representing the locus and alleles of AB chains.
-            E.g. ['G_1','D_1']
+            E.g. ['G_1','D_1']. Created from n_G and n_D when accessed.
         A_chains : list
             Placeholder. List containing the A chains of the cell. Initialized with Nones
             and reeplaced with chain object when calling add_chain().
@@ -41,38 +50,19 @@ class Cell:
             parameter. Calls functions to create chain placeholders.
         reset_AB(n_A=0,n_B=0)
             Initializes the attributes self.n_A and self.n_B and creates A, B chain placeholder
-            lists. Then, calls internal function to initialize A, B chain names.
+            lists.
         reset_GD(n_G=0,n_D=0)
             Initializes the attributes self.n_G and self.n_D and creates A, B chain placeholder
-            lists. Then, calls internal function to initialize G, D chain names.
+            lists.
         add_chain(chain)
-            Wrapper. Tests for chain locus value and calls the locus-specific chain-adding
-            function.
-        _add_A_chain(chain)
-            Internal function. Checks for a correct initialization of the A chain placeholder
-            and adds the A chain in the first available position. If there are not availiable
-            positions raises IndexError.
-        _add_B_chain(chain)
-            Internal function. Checks for a correct initialization of the B chain placeholder
-            and adds the B chain in the first available position. If there are not availiable
-            positions raises IndexError.
-        _add_G_chain(chain)
-            Internal function. Checks for a correct initialization of the G chain placeholder
-            and adds the G chain in the first available position. If there are not availiable
-            positions raises IndexError.
-        _add_D_chain(chain)
-            Internal function. Checks for a correct initialization of the D chain placeholder
-            and adds the D chain in the first available position. If there are not availiable
-            positions raises IndexError.
-        _create_AB_chain_names()
-            Internal function. Create name list for the AB chains based on the (previously
-            initialized) chain list.
-        _create_GD_chain_names()
-            Internal function. Create name list for the GD chains based on the (previously
-            initialized) chain list.
+            Checks for a correct initialization of the placeholder of the chain locus and adds
+            the chain in the first available position. If there are not availiable positions
+            raises IndexError.
         add_batch(batch)
             Initialize the attribute self.batch with the given parameter.
     """
+    __slots__ = ('name','n_A','n_B','n_G','n_D','batch','A_chains','B_chains','G_chains',
+                 'D_chains')
     def __init__(self, name=None,n_A=0,n_B=0,n_G=0,n_D=0):
         self.name = name
         self.reset_AB(n_A,n_B)
@@ -83,95 +73,54 @@ class Cell:
         self.n_B = n_B
         self.A_chains = n_A*[None]
         self.B_chains = n_B*[None]
-        self._create_AB_chain_names()
     def reset_GD(self,n_G=0,n_D=0):
         self.n_G = n_G
         self.n_D = n_D
         self.G_chains = n_G*[None]
         self.D_chains = n_D*[None]
-        self._create_GD_chain_names()
 
     def add_chain(self,chain):
-        if chain.locus=='A':
-            self._add_A_chain(chain)
-        elif chain.locus=='B':
-            self._add_B_chain(chain)
-        elif chain.locus=='G':
-            self._add_G_chain(chain)
-        elif chain.locus=='D':
-            self._add_D_chain(chain)
-        else:
+        if chain.locus not in ['A','B','G','D']:
             raise ValueError\
             ("The chain has a invalid locus value. Has to be in ['A','B','C','D']")
-
-    def _add_A_chain(self,chain):
-        if len(self.A_chains)==0:
-            raise AssertionError\
-            ("No number of A chains specified. Run reset_A with non-zero parameters")
-        for i in range(len(self.A_chains)):
-            if self.A_chains[i] is None:
-                self.A_chains[i] = chain
-                break
-            else:
-                if i==len(self.A_chains)-1:
-                    raise IndexError('This cell does not fit more A chains')
-                else:
-                    continue
-    def _add_B_chain(self,chain):
-        if len(self.B_chains)==0:
+        chains = getattr(self,chain.locus + '_chains')
+        if len(chains)==0:
             raise AssertionError\
-            ("No number of B chains specified. Run reset_B with non-zero parameters")
-        for i in range(len(self.B_chains)):
-            if self.B_chains[i] is None:
-                self.B_chains[i] = chain
-                break
-            else:
-                if i==len(self.B_chains)-1:
-                    raise IndexError('This cell does not fit more B chains')
-                else:
-                    continue
-    def _add_G_chain(self,chain):
-        if len(self.G_chains)==0:
-            raise AssertionError\
-            ("No number of G chains specified. Run reset_G with non-zero parameters")
-        for i in range(len(self.G_chains)):
-            if self.G_chains[i] is None:
-                self.G_chains[i] = chain
-                break
-            else:
-                if i==len(self.G_chains)-1:
-                    raise IndexError('This cell does not fit more G chains')
-                else:
-                    continue
-    def _add_D_chain(self,chain):
-        if len(self.D_chains)==0:
-            raise AssertionError\
-            ("No number of D chains specified. Run reset_D with non-zero parameters")
-        for i in range(len(self.D_chains)):
-            if self.D_chains[i] is None:
-                self.D_chains[i] = chain
-                break
-            else:
-                if i==len(self.D_chains)-1:
-                    raise IndexError('This cell does not fit more D chains')
-                else:
-                    continue
-    def _create_AB_chain_names(self):
+            ("No number of {0} chains specified. Run reset_{0} with non-zero parameters"\
+             .format(chain.locus))
+        try:
+            chains[chains.index(None)] = chain
+        except ValueError:
+            raise IndexError('This cell does not fit more {} chains'.format(chain.locus)) from None
+
+    @property
+    def AB_chain_names(self):
         A_names = ['A_' + str(i) for i in list(range(1,self.n_A+1))]
         B_names = ['B_' + str(i) for i in list(range(1,self.n_B+1))]
-        self.AB_chain_names = A_names + B_names
-
-    def _create_GD_chain_names(self):
+        return A_names + B_names
+    @property
+    def GD_chain_names(self):
         G_names = ['G_' + str(i) for i in list(range(1,self.n_G+1))]
         D_names = ['D_' + str(i) for i in list(range(1,self.n_D+1))]
-        self.GD_chain_names = G_names + D_names
+        return G_names + D_names
 
     def add_batch(self,batch):
         self.batch = batch
+
+    def __getstate__(self):
+        # Only the attributes that are set (e.g. not 'batch' before add_batch), including None
+        return {attr:getattr(self,attr) for attr in self.__slots__ if hasattr(self,attr)}
+    def __setstate__(self,state):
+        for attr,value in state.items():
+            setattr(self,attr,value)
 #--------------------------------------------------------------------------------------------------#
 class Chain:
     """ Abstract class for TCR chain holding all relevant characteristics.
 
+        The attributes are stored in __slots__ instead of a per-object dictionary, and the
+        strings repeated across chains (loci, alleles, booleans and V, D, J usages) are
+        interned, so that all chains share a single copy of each of them.
+
         Attributes
         ----------
         locus : str
@@ -207,9 +156,12 @@ class Chain:
         fill_metadata(meta_dict)
             Reads a python dictionary and assigns its values to the class attributes.
     """
+    __slots__ = ('locus','allele','productive','TPM','stop_codon','in_frame','ID','CDR3nt',
+                 'CDR3aa','V','J')
+    _fields = __slots__
     def __init__(self,locus,allele):
-        self.locus = locus
-        self.allele = allele
+        self.locus = sys.intern(locus)
+        self.allele = sys.intern(allele)
         self.productive = None
         self.TPM = None
         self.stop_codon = None
@@ -221,43 +173,158 @@ class Chain:
         self.J = None
 
     def fill_metadata(self,meta_dict):
-        self.productive = meta_dict['Productive']
-        self.V = meta_dict['V segment']
-        self.J = meta_dict['J segment']
+        self.productive = sys.intern(meta_dict['Productive'])
+        self.V = sys.intern(meta_dict['V segment'])
+        self.J = sys.intern(meta_dict['J segment'])
         self.CDR3aa = meta_dict['CDR3aa']
         self.CDR3nt = meta_dict['CDR3nt']
         self.TPM = float(meta_dict['TPM'])
-        self.stop_codon = meta_dict['Stop codon']
-        self.in_frame = meta_dict['In frame']
+        self.stop_codon = sys.intern(meta_dict['Stop codon'])
+        self.in_frame = sys.intern(meta_dict['In frame'])
         self.ID = meta_dict['ID']
+
+    def __getstate__(self):
+        return tuple(getattr(self,attr,None) for attr in self._fields)
+    def __setstate__(self,state):
+        for attr,value in zip(self._fields,state):
+            setattr(self,attr,value)
 #-----------------------------------------------------------------------------------------------------
 class AlphaChain(Chain):
     """ Wrapper of the abstract class with no modifications."""
-    def __init(self):
-        super().__init__()
+    __slots__ = ()
 class BetaChain(Chain):
     """ Wrapper of the abstract class that includes the D usage attribute and function."""
-    def __init(self):
-        super().__init__()
+    __slots__ = ('D',)
+    _fields = Chain._fields + __slots__
     def add_D_segment(self,D):
-        self.D = D
+        self.D = sys.intern(D)
 class GammaChain(Chain):
     """ Wrapper of the abstract class with no modifications."""
-    def __init(self):
-        super().__init__()
+    __slots__ = ()
 class DeltaChain(Chain):
     """ Wrapper of the abstract class with no modifications."""
-    def __init(self):
-        super().__init__()
+    __slots__ = ('D',)
+    _fields = Chain._fields + __slots__
     def add_D_segment(self,D):
-        self.D = D
+        self.D = sys.intern(D)
+#-----------------------------------------------------------------------------------------------------
+def parse_filtered_TCRs(in_file):
+    """ Streaming parser of the 'filtered_TCRs.txt' file coming from TraCeR assemble.
+
+      Reads the file line by line with a small state machine and yields its records as soon
+      as they are complete, without keeping the file in memory. The number of recombinants
+      is the last number of its line (e.g. 'TCRA recombinants: 12'), and the fields of a
+      chain are all the 'key:<tab>value' lines after its '##' header, up to the next header,
+      so any number of chains and of fields per chain are accepted.
+
+      Parameters
+      ----------
+      in_file : string
+        Path for the 'filtered_TCRs.txt' file.
+
+      Yields
+      ------
+      tuple
+        ('name',name) for the name of the cell, ('recombinants',n) for the number of chains
+        of each locus, in the order of the file, and ('chain',fields) for each chain, where
+        fields is a dictionary with its data fields.
+    """
+    state = 'start'
+    with open(in_file,'r',encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+            if state=='start':
+                if line and not line.startswith('-'):
+                    state = 'header'
+                    yield 'name',line
+            elif line.startswith('##'):
+                if state=='chain':
+                    yield 'chain',fields
+                state = 'chain'
+                fields = {}
+            elif line.startswith('#'):
+                if state=='chain':
+                    yield 'chain',fields
+                state = 'section'
+            elif state=='chain':
+                data_pair = line.split(':\t',1)
+                if len(data_pair)>1: # Exclude blank lines
+                    fields[data_pair[0]] = data_pair[1]
+            elif state=='header' and 'recombinants' in line:
+                yield 'recombinants',int(line.split()[-1])
+    if state=='chain':
+        yield 'chain',fields
+#-----------------------------------------------------------------------------------------------------
+def read_tracer_cell(in_file,loci):
+    """ Reads the output from TraCeR assemble for a given cell and locus pair.
+
+      Parses the 'filtered_TCRs.txt' file with parse_filtered_TCRs() and adds each chain to
+      a new Cell object as soon as it is read. The chains get the alleles of the locus pair
+      in the order of the file, as given by Cell.AB_chain_names or Cell.GD_chain_names.
+
+      Parameters
+      ----------
+      in_file : string
+        Path for the 'filtered_TCRs.txt' file.
+      loci : string
+        Locus pair of the file, either 'AB' or 'GD'.
+
+      Raises
+      ------
+      ValueError
+          If the file does not have the number of recombinants of both loci, or if the locus
+          of a chain is not in 'loci'. The latter can only happen if the cell is not correctly
+          initialized.
+
+      Returns
+      -------
+      Cell
+        Cell object with the chains of the locus pair and their meta-data loaded.
+    """
+    chain_classes = {'A':AlphaChain,'B':BetaChain,'G':GammaChain,'D':DeltaChain}
+    cell = Cell()
+    counts = []
+    names = None
+    cont = 0 # Counter for the number of chains
+    for record,value in parse_filtered_TCRs(in_file):
+        if record=='name':
+            cell.name = value
+        elif record=='recombinants':
+            counts.append(value)
+        else:
+            if names is None: # Initialize the cell when the numbers of chains are known
+                names = _reset_loci(cell,loci,counts)
+            allele = names[cont]
+            locus = allele[0]
+            if locus not in loci:
+                raise ValueError("The locus has to be either '{}' or '{}'".format(*loci))
+            chain = chain_classes[locus](locus,allele)
+            if locus in ['B','D']:
+                chain.add_D_segment(value['D segment'])
+            chain.fill_metadata(value) # Fill in data from file
+            cell.add_chain(chain) # Add chain to cell
+            cont = cont+1 # Next chain
+    if names is None:
+        _reset_loci(cell,loci,counts)
+    return cell
+#-----------------------------------------------------------------------------------------------------
+def _reset_loci(cell,loci,counts):
+    """ Creates the chain placeholders of a cell for a locus pair and returns their names."""
+    if len(counts)<2:
+        raise ValueError("The file does not have the number of recombinants of the loci {}"\
+                         .format(loci))
+    if loci=='AB':
+        cell.reset_AB(counts[0],counts[1])
+        return cell.AB_chain_names
+    cell.reset_GD(counts[0],counts[1])
+    return cell.GD_chain_names
 #-----------------------------------------------------------------------------------------------------
 def create_cell_from_AB(in_file):
     """ Reads the AB output from TraCeR assemble for a given cell and returns the Cell object.
 
-      Reads the 'filtered_TCRs.txt' file coming from TraCeR assemble for a given cell,
-      extracts the information for the available chains and writes it in a new Cell object
-      as metadata.
+      Reads the 'filtered_TCRs.txt' file coming from TraCeR assemble for a given cell with
+      read_tracer_cell(), extracts the information for the available chains and writes it in a
+      new Cell object as metadata.
 
       Parameters
       ----------
@@ -275,43 +342,48 @@ def create_cell_from_AB(in_file):
       Cell
         Cell object with all the chains and their meta-data loaded.
     """
-    # Read file
-    with open(in_file,'r',encoding='utf8') as f:
-        lines = f.readlines()
-    # Create Cell object
-    n_A = int(lines[3].strip()[-1])
-    n_B = int(lines[4].strip()[-1])
-    cell = Cell(lines[1].strip(),
-                     n_A = n_A,
-                     n_B = n_B)
+    return read_tracer_cell(in_file,'AB')
+#-----------------------------------------------------------------------------------------------------
+def create_cell_from_GD(in_file):
+    """ Reads the GD output from TraCeR assemble for a given cell and returns the Cell object.
 
-    cont = 0 # Counter for the number of chains
-    for i in range(len(lines)):
-        if lines[i].startswith('##TRINITY'): # Detect chain data
-            # Extract data from text chunk
-            text_chunk = lines[i+1:i+11]
-            i=i+10
-            chain_dict = {}
-            allele = cell.AB_chain_names[cont]
-            locus = allele[0]
-            for line in text_chunk:
-                # Organize data fields in dictionary
-                data_pair = line.strip().split(':\t')
-                if len(data_pair)>1: # Exclude blank lines
-                    chain_dict[data_pair[0]]=data_pair[1]
-            # Create Chain object based on locus
-            if locus=='A':
-                chain = AlphaChain(locus,allele)
-            elif locus=='B':
-                chain = BetaChain(locus,allele)
-                chain.add_D_segment(chain_dict['D segment'])
-            else:
-                raise ValueError("The locus has to be either 'A' or 'B'")
-
-            chain.fill_metadata(chain_dict) # Fill in data from file
-            cell.add_chain(chain) # Add chain to cell
-            cont = cont+1 # Next chain
-    return cell
+      Reads the 'filtered_TCRs.txt' file coming from TraCeR assemble for a given cell with
+      read_tracer_cell(), extracts the information for the available chains and writes it in a
+      new Cell object without AB chains, that can be merged with the AB data with
+      merge_GD_data().
+
+      Parameters
+      ----------
+      in_file : string
+        Path for the GD 'filtered_TCRs.txt' file.
+
+      Raises
+      ------
+      ValueError
+          If the locus of a chain is not 'G' or 'D'. This can only happen if the cell is not
+          correctly initialized.
+
+      Returns
+      -------
+      Cell
+        Cell object with the GD chains and their meta-data loaded.
+    """
+    return read_tracer_cell(in_file,'GD')
+#-----------------------------------------------------------------------------------------------------
+def merge_GD_data(GD_cell,cells):
+    """ Copies the GD chains of a cell read with create_cell_from_GD() to the right Cell object.
+
+      Parameters
+      ----------
+      GD_cell : Cell
+        Cell object with the GD chains.
+      cells : dictionary
+        Dictionary where the cells initialized with AB were stored.
+    """
+    cell = cells[GD_cell.name]
+    cell.reset_GD(GD_cell.n_G,GD_cell.n_D)
+    cell.G_chains = GD_cell.G_chains
+    cell.D_chains = GD_cell.D_chains
 #-----------------------------------------------------------------------------------------------------
 def append_GD_data(in_file,cells):
     """ Reads the GD output from TraCeR assemble apends data to the right Cell objects.
@@ -333,40 +405,109 @@ def append_GD_data(in_file,cells):
           If the locus of a chain is not 'G' or 'D'. This can only happen if the cell is not
           correctly initialized.
     """
-    # Read file
-    with open(in_file,'r',encoding='utf8') as f:
-        lines = f.readlines()
-    # Look for initialized Cell object
-    n_G = int(lines[3].strip()[-1])
-    n_D = int(lines[4].strip()[-1])
-    name = lines[1].strip()
-    cell = cells[name]
-    cell.reset_GD(n_G,n_D)
+    merge_GD_data(create_cell_from_GD(in_file),cells)
+#-----------------------------------------------------------------------------------------------------
+def read_tracer_output(in_path,threads=16):
+    """ Reads the AB and GD output from TraCeR assemble for all cells of a plate in parallel.
 
-    cont = 0 # Counter for the number of chains
-    for i in range(len(lines)):
-        if lines[i].startswith('##TRINITY'): # Detect chain data
-            # Extract data from text chunk
-            text_chunk = lines[i+1:i+11]
-            i=i+10
-            chain_dict = {}
-            allele = cell.GD_chain_names[cont]
-            locus = allele[0]
-            for line in text_chunk:
-                # Organize data fields in dictionary
-                data_pair = line.strip().split(':\t')
-                if len(data_pair)>1: # Exclude blank lines
-                    chain_dict[data_pair[0]]=data_pair[1]
-            # Create Chain object based on locus
-            if locus=='G':
-                chain = GammaChain(locus,allele)
-            elif locus=='D':
-                chain = DeltaChain(locus,allele)
-                chain.add_D_segment(chain_dict['D segment'])
-            else:
-                raise ValueError("The locus has to be either 'G' or 'D'")
-
-            chain.fill_metadata(chain_dict) # Fill in data from file
-            cell.add_chain(chain) # Add chain to cell
-            cont = cont+1 # Next chain
-    cells[name] = cell # Update cell
+      Lists the cell folders in the 'AB' and 'GD' subfolders of 'in_path' and reads their
+      'filtered_TCRs.txt' files with a pool of threads, so that the latency of opening many
+      small files (e.g. on network filesystems) overlaps. The results are returned in the order
+      of the sorted folder names, regardless of the order in which the files are read.
+
+      Parameters
+      ----------
+      in_path : string
+        Path for the folder with the 'AB' and 'GD' output folders of TraCeR assemble.
+      threads : int, optional
+        Number of files read at the same time. Default is 16.
+
+      Returns
+      -------
+      AB : dictionary
+        Dictionary mapping each folder in 'AB' to a tuple (cell,exception), where cell is the
+        Cell object created with create_cell_from_AB(), or None if the folder has no
+        'filtered_TCRs.txt' file or it could not be read, and exception is the exception
+        raised when reading the file or None.
+      GD : dictionary
+        Same as AB for the folders in 'GD', with Cell objects created with
+        create_cell_from_GD().
+    """
+    jobs = []
+    for loci,reader in (('AB',create_cell_from_AB),('GD',create_cell_from_GD)):
+        loci_path = os.path.join(in_path,loci)
+        with os.scandir(loci_path) as entries:
+            folders = sorted(entry.name for entry in entries if entry.is_dir())
+        jobs.extend((loci,folder,reader,os.path.join(loci_path,folder,'filtered_TCR_seqs',
+                                                     'filtered_TCRs.txt')) for folder in folders)
+    def read(job):
+        try:
+            return job[2](job[3]),None
+        except FileNotFoundError:
+            return None,None
+        except Exception as exc:
+            return None,exc
+    results = {'AB':{},'GD':{}}
+    with ThreadPoolExecutor(threads) as executor:
+        for result,job in zip(tqdm.tqdm(executor.map(read,jobs),total=len(jobs),
+                                        desc='Reading TraCeR output',mininterval=1),jobs):
+            results[job[0]][job[1]] = result
+    return results['AB'],results['GD']
+#-----------------------------------------------------------------------------------------------------
+CHAIN_FIELDS = ['productive','TPM','stop_codon','in_frame','ID','CDR3nt','CDR3aa','V','J']
+# Schema of the dataset columns of each chain field. The V, D and J usages are categorical
+CHAIN_DTYPES = {'productive':'boolean','TPM':'float64','stop_codon':'boolean',
+                'in_frame':'boolean','ID':'string','CDR3nt':'string','CDR3aa':'string',
+                'V':'category','J':'category','D':'category'}
+def chain_columns(allele):
+    """ Returns the dataset column names of a chain allele, e.g. 'A_1' or 'D_2'.
+        The B and D loci have an additional column for the D segment.
+    """
+    fields = CHAIN_FIELDS + ['D'] if allele[0] in ['B','D'] else CHAIN_FIELDS
+    return [allele + '_' + field for field in fields]
+#-----------------------------------------------------------------------------------------------------
+def cells_to_dataframe(cells,n_alleles=2):
+    """ Builds the TCR dataset with one row per cell and the metadata of its chains as columns.
+
+      Collects the metadata of the chains in one list per column and creates the dataframe
+      at once, with a fixed set of columns: 'n_alleles' alleles per locus (A_1, A_2, B_1, ...,
+      D_2), plus any further allele present in a cell, in locus and allele order. Missing
+      chains are left empty. The columns have the dtypes of CHAIN_DTYPES: nullable booleans
+      for 'productive', 'stop_codon' and 'in_frame', floats for 'TPM', categories for the V,
+      D and J usages and strings for the rest.
+
+      Parameters
+      ----------
+      cells : dictionary
+        Dictionary mapping cell names to Cell objects.
+      n_alleles : int, optional
+        Minimum number of alleles per locus in the columns. Default is 2.
+
+      Returns
+      -------
+      DataFrame
+        Dataset with the cell names as index.
+    """
+    loci = ['A','B','G','D']
+    n = {l:max([n_alleles] + [getattr(cell,'n_' + l) for cell in cells.values()]) for l in loci}
+    columns = {}
+    dtypes = {}
+    for l in loci:
+        for i in range(1,n[l]+1):
+            for col,field in zip(chain_columns(l + '_' + str(i)),CHAIN_FIELDS + ['D']):
+                columns[col] = np.full(len(cells),np.nan) if field=='TPM' \
+                               else np.full(len(cells),None,dtype=object)
+                dtypes[col] = CHAIN_DTYPES[field]
+    for row,cell in enumerate(cells.values()):
+        for chain in cell.A_chains + cell.B_chains + cell.G_chains + cell.D_chains:
+            if chain is None:
+                continue
+            for col,field in zip(chain_columns(chain.allele),CHAIN_FIELDS + ['D']):
+                columns[col][row] = getattr(chain,field)
+    for col,dtype in dtypes.items():
+        if dtype=='boolean': # TraCeR writes booleans as 'True' and 'False'
+            columns[col] = pd.array([None if v is None else v=='True' for v in columns[col]],
+                                    dtype='boolean')
+        else:
+            columns[col] = pd.array(columns[col],dtype=dtype)
+    return pd.DataFrame(columns,index=list(cells.keys()))
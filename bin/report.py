@@ -0,0 +1,292 @@
+""" Time, resource and throughput instrumentation of the stages and cells of the pipeline.
+
+        * measure
+        * path_bytes
+        * count_reads
+        * reads_from_log
+        * append_record
+        * read_records
+        * summarize
+
+    Each stage of a run appends a record to '<report_dir>/stages.tsv', and the stages running a
+    command per cell (see scheduler.py) write one record per cell in their own log. A record has
+    the wall time, the CPU time (user + system), the peak resident memory, the size of the input
+    and output files and the number of reads processed. The reads are taken from the logs and
+    reports that the tools of each stage already write (see 'reads_from_log'), since counting
+    them in the fastq files reads all the data of the stage again. The peak memory is the one of the largest
+    process of the command, as given by the kernel for the finished process and its descendants,
+    not the sum of processes running at the same time. The summary joins the records of the stages
+    and their cells in '<report_dir>/run_report.json' and '<report_dir>/summary.tsv'. Can be called
+    as a script from the bash scripts of the pipeline, e.g.
+
+        python3 bin/report.py run results/run_reports/Plate_1/stages.tsv collect \
+        --inputs data/04_SS3_Tracer_assembled_cells/Plate_1/ -- ./src/05_collect_assemble.py ...
+        python3 bin/report.py summary results/run_reports/Plate_1 \
+        --cells trim=data/03_SS3_trimmed_fastq/Plate_1_log.tsv
+
+    Only the standard library is used, so that it can run in any of the containers.
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import sys
+import csv
+import gzip
+import json
+import re
+import shlex
+import time
+import argparse
+import subprocess
+from statistics import median
+from tracker import list_files
+#---------------------------------------------------------------------------------------------------#
+# Columns of the records, after the name of the stage or cell
+FIELDS = ['status','return_code','start','seconds','cpu_seconds','max_rss_mb','input_mb',
+          'output_mb','reads']
+#---------------------------------------------------------------------------------------------------#
+def measure(command,stdout=None):
+    """ Runs a shell command and measures its time and peak memory.
+
+        Parameters
+        ----------
+        command : string
+            Shell command.
+        stdout : file, optional
+            File where the output and errors of the command are written. Default is None,
+            meaning the standard output and error.
+
+        Returns
+        -------
+        dictionary
+            Dictionary with the 'status', 'return_code', 'start' time, wall time ('seconds'),
+            CPU time ('cpu_seconds') and peak resident memory ('max_rss_mb') of the command.
+    """
+    start = time.time()
+    process = subprocess.Popen(command,shell=True,stdout=stdout,
+                               stderr=None if stdout is None else subprocess.STDOUT)
+    _,status,usage = os.wait4(process.pid,0)
+    code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    process.returncode = code
+    return {'status':'success' if code==0 else 'failure','return_code':code,
+            'start':time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(start)),
+            'seconds':round(time.time()-start,1),
+            'cpu_seconds':round(usage.ru_utime+usage.ru_stime,1),
+            'max_rss_mb':round(usage.ru_maxrss/1024,1)} # ru_maxrss is in KB
+#---------------------------------------------------------------------------------------------------#
+def path_bytes(paths):
+    """ Returns the total size in bytes of files and directories. Missing paths count as 0."""
+    return sum(os.path.getsize(f) for f in list_files(p for p in paths if os.path.exists(p)))
+#---------------------------------------------------------------------------------------------------#
+def count_reads(paths):
+    """ Counts the reads of fastq files, compressed with gzip or not.
+
+        The files are read whole, so it takes about as long as reading the input of a stage.
+        Prefer 'reads_from_log' when the stage reports the number of reads.
+
+        Parameters
+        ----------
+        paths : list of strings
+            Paths to the fastq files. Missing files count as 0 reads.
+
+        Returns
+        -------
+        int
+            Number of reads, as the number of lines divided by 4.
+    """
+    n_lines = 0
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with (gzip.open if path.endswith('.gz') else open)(path,'rb') as f:
+            for chunk in iter(lambda: f.read(2**24),b''):
+                n_lines += chunk.count(b'\n')
+    return n_lines//4
+#---------------------------------------------------------------------------------------------------#
+def reads_from_log(paths,pattern):
+    """ Reads the number of reads reported in the logs or reports of a tool.
+
+        Parameters
+        ----------
+        paths : list of strings
+            Paths to the logs. Missing logs count as 0 reads.
+        pattern : string
+            Regular expression with a group matching the number of reads, e.g.
+            'Total reads processed: *([0-9,]+)' for the reports of TrimGalore. Commas in the
+            number are ignored.
+
+        Returns
+        -------
+        int
+            Sum of the first match in each log, or None if no log has a match.
+    """
+    regex = re.compile(pattern)
+    reads = None
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with open(path,errors='replace') as f:
+            match = regex.search(f.read())
+        if match is not None:
+            reads = (reads or 0) + int(match.group(1).replace(',',''))
+    return reads
+#---------------------------------------------------------------------------------------------------#
+def append_record(log_file,name,record,key='cell'):
+    """ Appends a record to a tab-separated log, writing the header if the log is new.
+
+        Parameters
+        ----------
+        log_file : string
+            Path to the log.
+        name : string
+            Name of the stage or cell.
+        record : dictionary
+            Values of the columns in FIELDS. Missing values are left empty.
+        key : string, optional
+            Name of the first column. Default is 'cell'.
+    """
+    new = not os.path.isfile(log_file) or os.path.getsize(log_file)==0
+    with open(log_file,'a') as f:
+        if new:
+            f.write('\t'.join([key] + FIELDS) + '\n')
+        f.write('\t'.join([name] + ['' if record.get(c) is None else str(record[c])
+                                    for c in FIELDS]) + '\n')
+#---------------------------------------------------------------------------------------------------#
+def read_records(log_file):
+    """ Reads the records of a tab-separated log, converting the numeric columns.
+
+        Returns
+        -------
+        list of dictionaries
+            Records of the log, with None for the empty values.
+    """
+    if not os.path.isfile(log_file):
+        return []
+    records = []
+    with open(log_file) as f:
+        for row in csv.DictReader(f,delimiter='\t'):
+            for col,value in row.items():
+                if value in ('','NA'):
+                    row[col] = None
+                elif col in ['return_code','reads']:
+                    row[col] = int(value)
+                elif col in FIELDS[1:] and col!='start':
+                    row[col] = float(value)
+            records.append(row)
+    return records
+#---------------------------------------------------------------------------------------------------#
+def _total(values,func=sum):
+    values = [v for v in values if v is not None]
+    return round(func(values),1) if values else None
+#---------------------------------------------------------------------------------------------------#
+def summarize(report_dir,cell_logs={},outlier_factor=5):
+    """ Joins the records of the stages and cells of a run and finds the outlier cells.
+
+        The peak memory, sizes and reads missing in the record of a stage are taken from its
+        cells (maximum of the peak memory and sum of the rest). A cell is an outlier if its wall
+        time or peak memory is more than 'outlier_factor' times the median of its stage.
+        Writes '<report_dir>/run_report.json' and '<report_dir>/summary.tsv'.
+
+        Parameters
+        ----------
+        report_dir : string
+            Folder of the report of the run, with the records of the stages in 'stages.tsv'.
+        cell_logs : dictionary, optional
+            Dictionary mapping the name of each stage to the log of its cells.
+        outlier_factor : float, optional
+            Times the median of its stage above which a cell is an outlier. Default is 5.
+
+        Returns
+        -------
+        summary : list of dictionaries
+            Summary of each stage, with its number of cells and failures, its throughput in
+            reads per second and its slowest cell.
+        outliers : list of dictionaries
+            Outlier cells, with their stage, the measure and its value and median in the stage.
+    """
+    stages = read_records(os.path.join(report_dir,'stages.tsv'))
+    cells = {stage:read_records(log) for stage,log in cell_logs.items()}
+    summary = []
+    outliers = []
+    for record in stages:
+        stage = record['stage']
+        stage_cells = cells.get(stage,[])
+        row = dict(record)
+        row['cells'] = len(stage_cells)
+        row['failed'] = sum(c['status']!='success' for c in stage_cells)
+        for col,func in [('max_rss_mb',max),('input_mb',sum),('output_mb',sum),('reads',sum)]:
+            if row[col] is None:
+                row[col] = _total((c[col] for c in stage_cells),func)
+        row['reads_per_second'] = round(row['reads']/row['seconds'],1) \
+                                  if row['reads'] and row['seconds'] else None
+        row['slowest_cell'] = max(stage_cells,key=lambda c: c['seconds'] or 0)['cell'] \
+                              if stage_cells else None
+        summary.append(row)
+        for col in ['seconds','max_rss_mb']:
+            values = [c[col] for c in stage_cells if c[col]]
+            if len(values)<2:
+                continue
+            limit = outlier_factor*median(values)
+            outliers.extend({'stage':stage,'cell':c['cell'],'measure':col,'value':c[col],
+                             'stage_median':median(values)}
+                            for c in stage_cells if c[col] and c[col]>limit)
+    with open(os.path.join(report_dir,'run_report.json'),'w') as f:
+        json.dump({'stages':summary,'cells':cells,'outliers':outliers},f,indent=1)
+    columns = ['stage','status','seconds','cpu_seconds','max_rss_mb','input_mb','output_mb',
+               'reads','reads_per_second','cells','failed','slowest_cell']
+    with open(os.path.join(report_dir,'summary.tsv'),'w') as f:
+        f.write('\t'.join(columns) + '\n')
+        for row in summary:
+            f.write('\t'.join('' if row[c] is None else str(row[c]) for c in columns) + '\n')
+    return summary, outliers
+#---------------------------------------------------------------------------------------------------#
+def _print_table(rows,columns):
+    table = [columns] + [['-' if r[c] is None else str(r[c]) for c in columns] for r in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(columns))]
+    for row in table:
+        print('  '.join(v.rjust(w) for v,w in zip(row,widths)))
+#---------------------------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Records and summarizes the time and resources of the stages of a run.")
+    subparsers = parser.add_subparsers(dest='action',required=True)
+    run = subparsers.add_parser('run',help="Runs the command given after '--' and appends its record to a log.")
+    run.add_argument('log',type=str,help="Tab-separated log of the stages, e.g. <report_dir>/stages.tsv.")
+    run.add_argument('stage',type=str,help="Name of the stage.")
+    run.add_argument('--inputs',type=str,nargs='*',default=[],help="Input files or directories of the stage.")
+    run.add_argument('--outputs',type=str,nargs='*',default=[],help="Output files or directories of the stage.")
+    run.add_argument('--reads',type=str,nargs='*',default=[],help="Fastq files whose reads are counted as processed, reading them whole.")
+    run.add_argument('--reads_log',type=str,nargs=2,default=None,metavar=('LOG','PATTERN'),help="Log with the number of reads processed and regular expression matching it in a group.")
+    summary = subparsers.add_parser('summary',help="Writes the report of a run and prints its summary.")
+    summary.add_argument('report_dir',type=str,help="Folder of the report of the run.")
+    summary.add_argument('--cells',type=str,nargs='*',default=[],help="Logs of the cells of each stage, as <stage>=<log>.")
+    summary.add_argument('--outlier_factor',type=float,default=5,help="Times the median of its stage above which a cell is reported. Defaults to 5.")
+    # The command of 'run' is everything after '--'
+    argv = sys.argv[1:]
+    command = argv[argv.index('--')+1:] if '--' in argv else []
+    o = parser.parse_args(argv[:argv.index('--')] if '--' in argv else argv)
+
+    if o.action=='run':
+        if not command:
+            parser.error("No command given after '--'.")
+        record = measure(command[0] if len(command)==1 else shlex.join(command))
+        record['input_mb'] = round(path_bytes(o.inputs)/2**20,1)
+        record['output_mb'] = round(path_bytes(o.outputs)/2**20,1)
+        if o.reads_log is not None:
+            record['reads'] = reads_from_log([o.reads_log[0]],o.reads_log[1])
+        elif o.reads:
+            record['reads'] = count_reads(o.reads)
+        os.makedirs(os.path.dirname(o.log) or '.',exist_ok=True)
+        append_record(o.log,o.stage,record,key='stage')
+        sys.exit(record['return_code'])
+    else:
+        cell_logs = dict(c.split('=',1) for c in o.cells)
+        rows, outliers = summarize(o.report_dir,cell_logs,o.outlier_factor)
+        _print_table(rows,['stage','status','seconds','cpu_seconds','max_rss_mb','input_mb',
+                           'output_mb','reads','reads_per_second','cells','failed'])
+        if outliers:
+            print("\nOutlier cells ({} times the median of their stage):".format(o.outlier_factor))
+            _print_table(outliers,['stage','cell','measure','value','stage_median'])
+        print("\nReport saved in {}".format(os.path.join(o.report_dir,'run_report.json')))
@@ -0,0 +1,227 @@
+""" Cell-level parallel execution of the per-cell stages of the pipeline.
+
+        * parse_size
+        * read_tracer_memory
+        * run_cell_jobs
+
+    Runs a shell command for each cell, with several cells at a time sharing a budget of cores
+    and memory. With a folder of completion markers (see tracker.py), the cells already
+    finished with the same inputs are skipped. Can be called as a script from the bash scripts of the pipeline, e.g.
+
+        python3 bin/scheduler.py --cores 64 --threads_per_job 4 --cells $CELLS \
+        --log log.tsv -- "tracer assemble -p {threads} ... {cell}"
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import sys
+import argparse
+import threading
+import configparser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tracker import pending_cells, write_marker
+from report import measure, path_bytes, count_reads, reads_from_log, append_record
+#---------------------------------------------------------------------------------------------------#
+def parse_size(size):
+    """ Converts a memory size like the ones in 'tracer.conf' ('1G', '500M') into bytes.
+
+        Parameters
+        ----------
+        size : string or int
+            Memory size, optionally followed by the unit K, M, G or T (powers of 1024).
+
+        Raises
+        ------
+        ValueError
+            If the size does not have a valid format.
+
+        Returns
+        -------
+        int
+            Size in bytes.
+    """
+    if isinstance(size,int):
+        return size
+    units = {'K':2**10,'M':2**20,'G':2**30,'T':2**40}
+    size = size.strip().upper().rstrip('B')
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1])*units[size[-1]])
+        return int(size)
+    except ValueError:
+        raise ValueError("Invalid memory size '{}'. Has to be a number followed by K, M, G or T."\
+                         .format(size)) from None
+#---------------------------------------------------------------------------------------------------#
+def read_tracer_memory(conf_file):
+    """ Reads the maximum memory of the Trinity Jellyfish component from a TraCeR config file.
+
+        Parameters
+        ----------
+        conf_file : string
+            Path to the TraCeR configuration file, e.g. 'bin/tracer.conf'.
+
+        Returns
+        -------
+        int
+            Value of 'max_jellyfish_memory' in bytes, or None if it is not set.
+    """
+    conf = configparser.ConfigParser()
+    conf.read(conf_file)
+    if not conf.has_option('trinity_options','max_jellyfish_memory'):
+        return None
+    return parse_size(conf.get('trinity_options','max_jellyfish_memory'))
+#---------------------------------------------------------------------------------------------------#
+def run_cell_jobs(cells,command,cores,threads_per_job=1,mem_per_job=None,memory=None,
+                  log_file=None,out_dir=None,processes_per_cell=1,marker_dir=None,inputs=(),
+                  outputs=(),dry_run=False,reads=(),reads_log=None):
+    """ Runs a shell command for each cell, several cells at a time.
+
+        Formats 'command' for each cell, replacing '{cell}' by the name of the cell and
+        '{threads}' by 'threads_per_job', and runs it in a shell. The number of cells run at the
+        same time is the number of jobs fitting in 'cores' with 'threads_per_job' threads each
+        and, if 'mem_per_job' is given, in 'memory' with 'mem_per_job' each. If the command of a
+        cell starts several processes at the same time (e.g. the AB and GD assemblies of TraCeR),
+        'processes_per_cell' multiplies the threads and memory taken by each cell. The result of
+        each cell is appended to the tab-separated 'log_file' as soon as it finishes, with its
+        wall and CPU time, peak memory, size of 'inputs' and 'outputs' and number of reads,
+        read from the log or report of the cell given in 'reads_log' (see report.py). Counting
+        the reads of the fastq files 'reads' instead reads the whole files again after the
+        command, so it is only done when asked for.
+
+        If 'marker_dir' is given, only the cells without an up to date marker are run, and the
+        marker of each cell is written when its command succeeds. 'inputs' and 'outputs' are the
+        files of each cell, with the placeholder '{cell}', checked and saved in the markers.
+
+        Parameters
+        ----------
+        cells : list of strings
+            Names of the cells.
+        command : string
+            Shell command with the placeholders '{cell}' and '{threads}'.
+        cores : int
+            Total number of cores available.
+        threads_per_job : int, optional
+            Number of threads given to each cell. Default is 1.
+        mem_per_job : int or string, optional
+            Memory used by each cell, e.g. the 'max_jellyfish_memory' of TraCeR. Default is None.
+        memory : int or string, optional
+            Total memory available. Default is None, meaning the physical memory of the node.
+        log_file : string, optional
+            Path to the tab-separated log with the result of each cell. Default is None.
+        out_dir : string, optional
+            Folder where the output of the command of each cell is saved as '<cell>.log'. If
+            None, the output of all cells is printed together. Default is None.
+        processes_per_cell : int, optional
+            Number of processes with 'threads_per_job' threads and 'mem_per_job' memory started
+            by the command of each cell. Default is 1.
+        marker_dir : string, optional
+            Folder with the completion markers of the cells. Default is None.
+        inputs : list of strings, optional
+            Input files or directories of each cell, with the placeholder '{cell}'.
+        outputs : list of strings, optional
+            Output files or directories of each cell, with the placeholder '{cell}'.
+        dry_run : bool, optional
+            If True, prints the cells that would be run without running them. Default is False.
+        reads : list of strings, optional
+            Fastq files of each cell whose reads are counted in the log, with the placeholder
+            '{cell}'. Only used without 'reads_log'.
+        reads_log : tuple of strings, optional
+            Log or report of each cell with its number of reads, with the placeholder '{cell}'
+            (e.g. '<out_dir>/{cell}.log'), and regular expression matching the number in a
+            group. Default is None.
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each cell to the return code of its command.
+    """
+    if marker_dir is not None:
+        n_cells = len(cells)
+        cells = pending_cells(marker_dir,cells,inputs,outputs)
+        print("{} of {} cells are up to date, skipping them".format(n_cells-len(cells),n_cells))
+    if dry_run:
+        for cell in cells:
+            print("Would run cell {}: {}".format(cell,command.format(cell=cell,
+                                                                    threads=threads_per_job)))
+        return {}
+    n_jobs = max(1,cores//(threads_per_job*processes_per_cell))
+    if mem_per_job is not None:
+        if memory is None:
+            memory = os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+        n_jobs = max(1,min(n_jobs,parse_size(memory)//(parse_size(mem_per_job)*processes_per_cell)))
+    if out_dir is not None:
+        os.makedirs(out_dir,exist_ok=True)
+    print("Running {} cells, {} at a time with {} threads each".format(len(cells),n_jobs,
+                                                              threads_per_job*processes_per_cell))
+    lock = threading.Lock()
+    if log_file is not None:
+        open(log_file,'w').close()
+
+    def run(cell):
+        cmd = command.format(cell=cell,threads=threads_per_job)
+        if out_dir is None:
+            record = measure(cmd)
+        else:
+            with open(os.path.join(out_dir,cell + '.log'),'w') as out:
+                record = measure(cmd,stdout=out)
+        code = record['return_code']
+        if marker_dir is not None:
+            marker = os.path.join(marker_dir,cell + '.json')
+            if code==0:
+                write_marker(marker,[p.format(cell=cell) for p in inputs],
+                             [p.format(cell=cell) for p in outputs])
+            elif os.path.exists(marker):
+                os.remove(marker)
+        if log_file is not None:
+            record['input_mb'] = round(path_bytes([p.format(cell=cell) for p in inputs])/2**20,1)
+            record['output_mb'] = round(path_bytes([p.format(cell=cell) for p in outputs])/2**20,1)
+            if reads_log is not None:
+                record['reads'] = reads_from_log([reads_log[0].format(cell=cell)],reads_log[1])
+            elif reads:
+                record['reads'] = count_reads([p.format(cell=cell) for p in reads])
+            with lock:
+                append_record(log_file,cell,record)
+        return code
+
+    codes = {}
+    with ThreadPoolExecutor(n_jobs) as executor:
+        futures = {executor.submit(run,cell):cell for cell in cells}
+        for future in as_completed(futures):
+            cell = futures[future]
+            codes[cell] = future.result()
+            print("Cell {} {} ({}/{})".format(cell,'finished' if codes[cell]==0 else 'FAILED',
+                                             len(codes),len(cells)))
+    n_failed = sum(code!=0 for code in codes.values())
+    print("{} cells finished, {} failed".format(len(cells)-n_failed,n_failed))
+    return codes
+#---------------------------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a shell command for each cell, several cells at a time.")
+    parser.add_argument('command',type=str,help="Shell command with the placeholders '{cell}' and '{threads}'.")
+    parser.add_argument('--cells',type=str,nargs='*',required=True,help="Names of the cells.")
+    parser.add_argument('--cores',type=int,required=True,help="Total number of cores available.")
+    parser.add_argument('--threads_per_job',type=int,default=1,help="Number of threads given to each cell. Defaults to 1.")
+    parser.add_argument('--mem_per_job',type=str,default=None,help="Memory used by each cell, e.g. '1G'. Defaults to 'max_jellyfish_memory' in --tracer_conf if given.")
+    parser.add_argument('--memory',type=str,default=None,help="Total memory available, e.g. '200G'. Defaults to the physical memory of the node.")
+    parser.add_argument('--processes_per_cell',type=int,default=1,help="Number of processes started at the same time by the command of each cell. Defaults to 1.")
+    parser.add_argument('--tracer_conf',type=str,default=None,help="TraCeR configuration file to read the memory per cell from.")
+    parser.add_argument('--log',type=str,default=None,help="Path to the tab-separated log with the result of each cell.")
+    parser.add_argument('--out_dir',type=str,default=None,help="Folder where the output of each cell is saved as <cell>.log.")
+    parser.add_argument('--marker_dir',type=str,default=None,help="Folder with the completion markers of the cells, to skip the finished ones.")
+    parser.add_argument('--inputs',type=str,nargs='*',default=[],help="Input files or directories of each cell, with the placeholder '{cell}'.")
+    parser.add_argument('--outputs',type=str,nargs='*',default=[],help="Output files or directories of each cell, with the placeholder '{cell}'.")
+    parser.add_argument('--reads',type=str,nargs='*',default=[],help="Fastq files of each cell whose reads are counted in the log, reading them whole, with the placeholder '{cell}'.")
+    parser.add_argument('--reads_log',type=str,nargs=2,default=None,metavar=('LOG','PATTERN'),help="Log of each cell with its number of reads, with the placeholder '{cell}', and regular expression matching the number in a group.")
+    parser.add_argument('--dry_run',action='store_true',help="Prints the cells that would be run without running them.")
+    o = parser.parse_args()
+
+    mem_per_job = o.mem_per_job
+    if mem_per_job is None and o.tracer_conf is not None:
+        mem_per_job = read_tracer_memory(o.tracer_conf)
+    codes = run_cell_jobs(o.cells,o.command,o.cores,o.threads_per_job,mem_per_job,o.memory,o.log,
+                          o.out_dir,o.processes_per_cell,o.marker_dir,o.inputs,o.outputs,
+                          o.dry_run,o.reads,o.reads_log)
+    sys.exit(int(any(code!=0 for code in codes.values())))
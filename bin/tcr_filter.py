@@ -0,0 +1,186 @@
+""" Functions for keeping only the reads of a cell that can come from the TCR loci.
+
+        * read_loci
+        * locus_read_names
+        * KmerIndex
+        * filter_read_pairs
+
+    A read pair is kept if one of its mates is aligned over a TCR locus (given as a .bed file of
+    genome coordinates) or shares a k-mer with the V, J and C sequences of the TCR genes (given as
+    fasta files). The first test uses the .bam file of the aligned reads of the cell, and the second
+    one finds the TCR reads left unmapped or aligned elsewhere, e.g. those spanning the V(D)J
+    junction. Both mates of a pair are always kept or discarded together.
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import gzip
+import pysam
+#---------------------------------------------------------------------------------------------------#
+def _contig(name):
+    """ Internal function. Name of a contig without the prefix 'chr', so that both namings match."""
+    return name[3:] if name.startswith('chr') else name
+#---------------------------------------------------------------------------------------------------#
+def read_loci(bed_file):
+    """ Reads the coordinates of the TCR loci from a .bed file.
+
+        Parameters
+        ----------
+        bed_file : string
+            Path to the .bed file, with the contig, start and end (0-based, end excluded) of
+            each locus in the first three columns.
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each contig, without the prefix 'chr', to a list of (start,end)
+            intervals.
+    """
+    loci = {}
+    with open(bed_file) as f:
+        for line in f:
+            if not line.strip() or line.startswith(('#','track','browser')):
+                continue
+            contig, start, end = line.split('\t')[:3]
+            loci.setdefault(_contig(contig),[]).append((int(start),int(end)))
+    return loci
+#---------------------------------------------------------------------------------------------------#
+def locus_read_names(bam_file,loci):
+    """ Finds the reads aligned over the TCR loci, or whose mate is.
+
+        Parameters
+        ----------
+        bam_file : string
+            Path to the .bam file of the aligned reads of a cell, sorted or not.
+        loci : dict
+            Coordinates of the loci, as given by 'read_loci'.
+
+        Returns
+        -------
+        set
+            Names (bytes) of the reads with one of the mates overlapping a locus.
+    """
+    names = set()
+    with pysam.AlignmentFile(bam_file,"rb",check_sq=False) as bam:
+        # Intervals by reference id, to avoid comparing contig names for every read
+        intervals = {i:loci.get(_contig(name),[]) for i,name in enumerate(bam.references)}
+        for aln in bam.fetch(until_eof=True):
+            if not aln.is_unmapped:
+                start, end = aln.reference_start, aln.reference_end
+                if any(s<end and start<e for s,e in intervals[aln.reference_id]):
+                    names.add(aln.query_name.encode())
+                    continue
+            if aln.is_paired and not aln.mate_is_unmapped:
+                start = aln.next_reference_start
+                if any(s<=start<e for s,e in intervals.get(aln.next_reference_id,[])):
+                    names.add(aln.query_name.encode())
+    return names
+#---------------------------------------------------------------------------------------------------#
+class KmerIndex:
+    """ Set of the k-mers of reference sequences in both strands.
+
+        A read matches the index if one of its k-mers starting every 'step' bases (and the last
+        one) is in the set. A read is then found whenever it shares at least k + step - 1 bases
+        with a reference sequence, without looking up all its k-mers.
+
+        Attributes
+        ----------
+        k : int
+            Length of the k-mers.
+        step : int
+            Distance between the k-mers of a read that are looked up.
+        kmers : set
+            K-mers (bytes) of the reference sequences and their reverse complements.
+
+        Methods
+        -------
+        __init__(fasta_files,k=25,step=4)
+            Reads the sequences of the fasta files and adds their k-mers to the set.
+        matches(seq)
+            Whether the sequence 'seq' (bytes) has any of the k-mers looked up in the set.
+    """
+    _COMPLEMENT = bytes.maketrans(b'ACGTNacgtn',b'TGCANtgcan')
+
+    def __init__(self,fasta_files,k=25,step=4):
+        if k<1 or step<1:
+            raise ValueError("The k-mer length and the step have to be positive.")
+        self.k = k
+        self.step = step
+        self.kmers = set()
+        for fasta_file in fasta_files:
+            with pysam.FastxFile(fasta_file) as fasta:
+                for record in fasta:
+                    seq = record.sequence.upper().encode()
+                    for strand in (seq,seq.translate(self._COMPLEMENT)[::-1]):
+                        self.kmers.update(strand[i:i+k] for i in range(len(strand)-k+1))
+
+    def matches(self,seq):
+        k = self.k
+        kmers = self.kmers
+        last = len(seq) - k
+        for i in range(0,last,self.step):
+            if seq[i:i+k] in kmers:
+                return True
+        return last>=0 and seq[last:] in kmers
+#---------------------------------------------------------------------------------------------------#
+def _read_name(header):
+    """ Internal function. Name of a read from its fastq header, without '@', comment or mate."""
+    name = header[1:].split(maxsplit=1)[0]
+    return name[:-2] if name[-2:] in (b'/1',b'/2') else name
+#---------------------------------------------------------------------------------------------------#
+def filter_read_pairs(fastq_ins,fastq_outs,index,names=frozenset(),compress_level=1):
+    """ Writes the read pairs of a cell that come from the TCR loci.
+
+        The two fastq files are read together, so the mates have to be in the same order in
+        both, as written by 'samtools fastq' or the splitting to fastq of step 1. A pair is kept
+        if its name is in 'names' or one of its mates matches the k-mer index. The output is
+        written to temporary files that are moved in place when complete. It is read once by the
+        trimming of step 3, so it is compressed at the fastest level by default.
+
+        Parameters
+        ----------
+        fastq_ins : tuple of strings
+            Paths to the R1 and R2 fastq files of the cell, compressed with gzip or not.
+        fastq_outs : tuple of strings
+            Paths to the output R1 and R2 fastq.gz files.
+        index : KmerIndex
+            Index of the k-mers of the V, J and C sequences.
+        names : set, optional
+            Names (bytes) of the reads aligned over the TCR loci, as given by
+            'locus_read_names'. Default is an empty set.
+        compress_level : int, optional
+            Gzip compression level of the output, from 0 (stored, not compressed) to 9. Default
+            is 1.
+
+        Returns
+        -------
+        tuple
+            Number of read pairs read and number of read pairs kept.
+    """
+    n_pairs = 0
+    n_kept = 0
+    opener = [gzip.open if path.endswith('.gz') else open for path in fastq_ins]
+    temps = [path + '.tmp' for path in fastq_outs]
+    with opener[0](fastq_ins[0],'rb') as in1, opener[1](fastq_ins[1],'rb') as in2, \
+         gzip.open(temps[0],'wb',compress_level) as out1, \
+         gzip.open(temps[1],'wb',compress_level) as out2:
+        while True:
+            r1 = [in1.readline() for _ in range(4)]
+            r2 = [in2.readline() for _ in range(4)]
+            if not r1[0] or not r2[0]:
+                if r1[0] or r2[0]:
+                    raise ValueError("The fastq files {} have different numbers of reads."
+                                     .format(fastq_ins))
+                break
+            n_pairs += 1
+            if _read_name(r1[0]) in names or index.matches(r1[1].rstrip()) or \
+               index.matches(r2[1].rstrip()):
+                out1.write(b''.join(r1))
+                out2.write(b''.join(r2))
+                n_kept += 1
+    for temp,path in zip(temps,fastq_outs):
+        os.replace(temp,path)
+    return n_pairs, n_kept
@@ -0,0 +1,222 @@
+""" Shared cache of the reference indices of TraCeR, built once and reused by all cells and runs.
+
+        * reference_files
+        * cache_key
+        * build_cache
+
+    Without a base index, 'tracer assemble' indexes the whole base transcriptome of the species
+    for every cell to quantify its TCRs, which takes longer than assembling them. The cache keeps a
+    kallisto (or salmon) index of the base transcriptome in '<cache_dir>/<species>_<method>_<key>/'
+    with a copy of the configuration file that points to it in '[kallisto_base_indices]' (or
+    '[salmon_base_indices]'), so that the cells run 'tracer assemble --small_index' with it.
+    The key is a hash of the configuration file and of the reference files (the base transcriptome
+    and the resources of the species in TraCeR), so any change builds a new entry instead of
+    reusing a stale one. An entry is built in a temporary folder under a lock and moved in place
+    when complete, so that concurrent runs build it once, and it is then only read, with its files
+    made read-only. Can be called as a script from the bash scripts of the pipeline, e.g.
+
+        TRACER_CONF=$(python3 bin/tracer_cache.py bin/tracer.conf Hsap data/tracer_cache/)
+
+    Only the standard library is used, so that it can run in any of the containers.
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import sys
+import json
+import stat
+import fcntl
+import shutil
+import hashlib
+import argparse
+import subprocess
+import configparser
+from tracker import list_files, file_signature
+#---------------------------------------------------------------------------------------------------#
+def _read_conf(conf_file):
+    conf = configparser.ConfigParser()
+    if not conf.read(conf_file):
+        raise FileNotFoundError("TraCeR configuration file {} not found.".format(conf_file))
+    return conf
+#---------------------------------------------------------------------------------------------------#
+def reference_files(conf_file,species):
+    """ Finds the reference files of a species used by TraCeR.
+
+        Parameters
+        ----------
+        conf_file : string
+            Path to the TraCeR configuration file.
+        species : string
+            Species, as in the option '-s' of TraCeR, e.g. 'Hsap'.
+
+        Raises
+        ------
+        ValueError
+            If the configuration file has no base transcriptome for the species.
+
+        Returns
+        -------
+        list of strings
+            Paths to the base transcriptome and to the files of the resources of the species
+            (combinatorial recombinomes and IgBlast databases) in the TraCeR folder.
+    """
+    conf = _read_conf(conf_file)
+    if not conf.has_option('base_transcriptomes',species):
+        raise ValueError("No base transcriptome for species {} in {}.".format(species,conf_file))
+    files = [conf.get('base_transcriptomes',species)]
+    if conf.has_option('tracer_location','tracer_path'):
+        resources = os.path.join(conf.get('tracer_location','tracer_path'),'resources',species)
+        if os.path.isdir(resources):
+            files.extend(list_files([resources]))
+    return files
+#---------------------------------------------------------------------------------------------------#
+def _hashes(files,signature_file):
+    """ Internal function. Md5 hashes of files, reusing the ones saved in 'signature_file' for
+        the files with the same size and modification time."""
+    old = {}
+    if os.path.isfile(signature_file):
+        with open(signature_file) as f:
+            old = json.load(f)
+    signatures = {}
+    for path in files:
+        st = os.stat(path)
+        sig = old.get(path)
+        if sig is None or sig['size']!=st.st_size or sig['mtime']!=st.st_mtime_ns:
+            sig = file_signature(path)
+        signatures[path] = sig
+    if signatures!={p:old.get(p) for p in signatures}:
+        old.update(signatures)
+        with open(signature_file + '.tmp{}'.format(os.getpid()),'w') as f:
+            json.dump(old,f,indent=1)
+        os.replace(signature_file + '.tmp{}'.format(os.getpid()),signature_file)
+    return [signatures[path]['md5'] for path in files]
+#---------------------------------------------------------------------------------------------------#
+def cache_key(conf_file,species,quant_method='kallisto',signature_file=None):
+    """ Computes the key of the cache entry of a configuration and species.
+
+        Parameters
+        ----------
+        conf_file : string
+            Path to the TraCeR configuration file.
+        species : string
+            Species, as in the option '-s' of TraCeR.
+        quant_method : string, optional
+            'kallisto' or 'salmon'. Default is 'kallisto'.
+        signature_file : string, optional
+            Json file where the hashes of the reference files are kept, so that they are only
+            computed again when the files change. Default is None, hashing them every time.
+
+        Returns
+        -------
+        string
+            Sha256 hash of the configuration file, the species, the method and the md5 hashes
+            of the reference files.
+    """
+    files = reference_files(conf_file,species)
+    if signature_file is None:
+        hashes = [file_signature(path)['md5'] for path in files]
+    else:
+        hashes = _hashes(files,signature_file)
+    sha = hashlib.sha256()
+    with open(conf_file,'rb') as f:
+        sha.update(f.read())
+    for value in [species,quant_method] + files + hashes:
+        sha.update(b'\0' + value.encode())
+    return sha.hexdigest()
+#---------------------------------------------------------------------------------------------------#
+def _make_read_only(path):
+    for f in list_files([path]):
+        os.chmod(f,os.stat(f).st_mode & ~(stat.S_IWUSR|stat.S_IWGRP|stat.S_IWOTH))
+#---------------------------------------------------------------------------------------------------#
+def build_cache(conf_file,species,cache_dir,quant_method='kallisto',threads=1):
+    """ Builds the cache entry of a configuration and species, unless it already exists.
+
+        Parameters
+        ----------
+        conf_file : string
+            Path to the TraCeR configuration file.
+        species : string
+            Species, as in the option '-s' of TraCeR.
+        cache_dir : string
+            Folder of the cache, e.g. on the local scratch of the node. Created if missing.
+        quant_method : string, optional
+            'kallisto' or 'salmon', as in the option '-q' of TraCeR. Default is 'kallisto'.
+        threads : int, optional
+            Number of threads of 'salmon index'. Default is 1.
+
+        Raises
+        ------
+        subprocess.CalledProcessError
+            If the indexing command fails. The partial entry is removed.
+
+        Returns
+        -------
+        string
+            Path to the configuration file of the entry, to be given to TraCeR in TRACER_CONF
+            together with the option '--small_index'.
+    """
+    if quant_method not in ('kallisto','salmon'):
+        raise ValueError("Invalid quantification method '{}'. Has to be 'kallisto' or 'salmon'."\
+                         .format(quant_method))
+    os.makedirs(cache_dir,exist_ok=True)
+    key = cache_key(conf_file,species,quant_method,os.path.join(cache_dir,'signatures.json'))
+    entry = os.path.abspath(os.path.join(cache_dir,'{}_{}_{}'.format(species,quant_method,key[:16])))
+    entry_conf = os.path.join(entry,'tracer.conf')
+    if os.path.isfile(entry_conf):
+        return entry_conf
+    with open(entry + '.lock','w') as lock:
+        # Other runs building the same entry wait here and then find it complete
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        if os.path.isfile(entry_conf):
+            return entry_conf
+        conf = _read_conf(conf_file)
+        transcriptome = conf.get('base_transcriptomes',species)
+        tool = conf.get('tool_locations',quant_method + '_path',fallback=quant_method)
+        temp = entry + '.tmp{}'.format(os.getpid())
+        shutil.rmtree(temp,ignore_errors=True)
+        os.makedirs(temp)
+        try:
+            if quant_method=='kallisto':
+                index = 'kallisto.idx'
+                command = [tool,'index','-i',os.path.join(temp,index),transcriptome]
+            else:
+                index = 'salmon'
+                command = [tool,'index','-t',transcriptome,'-i',os.path.join(temp,index),
+                           '-p',str(threads)]
+            # The standard output is left for the path of the configuration file
+            print("Building the {} index of {} in {}".format(quant_method,transcriptome,entry),
+                  file=sys.stderr,flush=True)
+            subprocess.run(command,check=True,stdout=sys.stderr)
+            section = quant_method + '_base_indices'
+            if not conf.has_section(section):
+                conf.add_section(section)
+            conf.set(section,species,os.path.join(entry,index))
+            with open(os.path.join(temp,'tracer.conf'),'w') as f:
+                conf.write(f)
+            with open(os.path.join(temp,'key.json'),'w') as f:
+                json.dump({'key':key,'conf_file':os.path.abspath(conf_file),'species':species,
+                           'quant_method':quant_method,
+                           'reference_files':reference_files(conf_file,species)},f,indent=1)
+            _make_read_only(temp)
+            os.rename(temp,entry)
+        except BaseException:
+            shutil.rmtree(temp,ignore_errors=True)
+            raise
+    return entry_conf
+#---------------------------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the shared reference indices of TraCeR once and prints the configuration file that uses them.")
+    parser.add_argument('conf_file',type=str,help="TraCeR configuration file, e.g. bin/tracer.conf.")
+    parser.add_argument('species',type=str,help="Species, as in the option '-s' of TraCeR, e.g. Hsap.")
+    parser.add_argument('cache_dir',type=str,help="Folder of the cache, e.g. on the local scratch of the node.")
+    parser.add_argument('--quant_method',type=str,default='kallisto',choices=['kallisto','salmon'],help="Quantification method of TraCeR. Defaults to kallisto.")
+    parser.add_argument('--threads',type=int,default=1,help="Number of threads used to build the salmon index. Defaults to 1.")
+    o = parser.parse_args()
+
+    try:
+        print(build_cache(o.conf_file,o.species,o.cache_dir,o.quant_method,o.threads))
+    except (OSError,ValueError,configparser.Error,subprocess.CalledProcessError) as e:
+        sys.exit("Could not build the TraCeR cache: {}".format(e))
@@ -0,0 +1,234 @@
+""" Completion markers to resume the pipeline without repeating finished work.
+
+        * file_signature
+        * list_files
+        * signature
+        * unchanged
+        * is_complete
+        * write_marker
+        * pending_cells
+        * mark_cells
+
+    Each finished cell (or stage, for the steps running on whole plates) leaves a marker file
+    '<marker_dir>/<cell>.json' with the size, modification time and md5 hash of its input and
+    output files. A cell is complete if its marker exists, all of its outputs exist and none of
+    its inputs or outputs has changed since. Files with a new modification time are hashed, so
+    a file rewritten with the same content (e.g. by splitting the plate again after adding
+    wells) does not trigger the following steps. Can be called as a script from the bash
+    scripts of the pipeline, e.g.
+
+        python3 bin/tracker.py pending data/02_SS3_merged_fastq/Plate_1_done --cells $CELLS \
+        --inputs 'Aligned/{cell}.bam' --outputs '{cell}/{cell}_R1.fastq.gz'
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+#---------------------------------------------------------------------------------------------------#
+def file_signature(path):
+    """ Computes the signature of a file, used to know if it has changed.
+
+        Parameters
+        ----------
+        path : string
+            Path to the file.
+
+        Returns
+        -------
+        dictionary
+            Dictionary with the size, modification time (in ns) and md5 hash of the file.
+    """
+    md5 = hashlib.md5()
+    with open(path,'rb') as f:
+        for chunk in iter(lambda: f.read(2**20),b''):
+            md5.update(chunk)
+    st = os.stat(path)
+    return {'size':st.st_size,'mtime':st.st_mtime_ns,'md5':md5.hexdigest()}
+#---------------------------------------------------------------------------------------------------#
+def list_files(paths):
+    """ Lists the files in 'paths', walking recursively through the directories.
+
+        Parameters
+        ----------
+        paths : list of strings
+            Paths to files or directories.
+
+        Returns
+        -------
+        list of strings
+            Paths to the files, in sorted order within each directory.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root,dirs,names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root,name) for name in sorted(names))
+        else:
+            files.append(path)
+    return files
+#---------------------------------------------------------------------------------------------------#
+def signature(paths):
+    """ Computes the signatures of files and directories.
+
+        Parameters
+        ----------
+        paths : list of strings
+            Paths to files or directories. Directories are replaced by all of the files in them.
+
+        Returns
+        -------
+        dictionary
+            Dictionary mapping each file to its signature as given by 'file_signature'.
+    """
+    return {f:file_signature(f) for f in list_files(paths)}
+#---------------------------------------------------------------------------------------------------#
+def unchanged(paths,old):
+    """ Checks that files are the same as when their signatures were taken.
+        Only the files with a new modification time are hashed.
+
+        Parameters
+        ----------
+        paths : list of strings
+            Paths to files or directories.
+        old : dictionary
+            Signatures of the files, as given by 'signature'.
+
+        Returns
+        -------
+        bool
+            True if the files are the same and have the same content as in 'old'.
+    """
+    files = list_files(paths)
+    if sorted(files)!=sorted(old):
+        return False
+    for f in files:
+        try:
+            st = os.stat(f)
+        except FileNotFoundError:
+            return False
+        if st.st_size!=old[f]['size']:
+            return False
+        if st.st_mtime_ns!=old[f]['mtime'] and file_signature(f)['md5']!=old[f]['md5']:
+            return False
+    return True
+#---------------------------------------------------------------------------------------------------#
+def is_complete(marker_file,inputs,outputs):
+    """ Checks if the work of a marker is complete and up to date.
+
+        Parameters
+        ----------
+        marker_file : string
+            Path to the marker file.
+        inputs : list of strings
+            Paths to the input files or directories.
+        outputs : list of strings
+            Paths to the output files or directories.
+
+        Returns
+        -------
+        bool
+            True if the marker exists, all outputs exist and no input or output has changed.
+    """
+    if not os.path.isfile(marker_file) or not all(os.path.exists(p) for p in outputs):
+        return False
+    with open(marker_file) as f:
+        marker = json.load(f)
+    return unchanged(inputs,marker['inputs']) and unchanged(outputs,marker['outputs'])
+#---------------------------------------------------------------------------------------------------#
+def write_marker(marker_file,inputs,outputs):
+    """ Writes the marker of a finished work with the signatures of its inputs and outputs.
+        The file is replaced atomically, so an interrupted write never leaves a valid marker.
+
+        Parameters
+        ----------
+        marker_file : string
+            Path to the marker file.
+        inputs : list of strings
+            Paths to the input files or directories.
+        outputs : list of strings
+            Paths to the output files or directories.
+    """
+    os.makedirs(os.path.dirname(marker_file) or '.',exist_ok=True)
+    marker = {'finished':time.strftime('%Y-%m-%d %H:%M:%S'),
+              'inputs':signature(inputs),'outputs':signature(outputs)}
+    with open(marker_file + '.tmp','w') as f:
+        json.dump(marker,f,indent=1)
+    os.replace(marker_file + '.tmp',marker_file)
+#---------------------------------------------------------------------------------------------------#
+def _cell_paths(patterns,cell):
+    return [p.format(cell=cell) for p in patterns]
+#---------------------------------------------------------------------------------------------------#
+def pending_cells(marker_dir,cells,inputs,outputs):
+    """ Finds the cells whose work is missing or out of date.
+
+        Parameters
+        ----------
+        marker_dir : string
+            Folder with the markers of the cells.
+        cells : list of strings
+            Names of the cells.
+        inputs : list of strings
+            Paths to the input files or directories of each cell, with the placeholder '{cell}'.
+        outputs : list of strings
+            Paths to the output files or directories of each cell, with the placeholder '{cell}'.
+
+        Returns
+        -------
+        list of strings
+            Names of the cells that have to be run, in the same order as 'cells'.
+    """
+    return [cell for cell in cells if not is_complete(os.path.join(marker_dir,cell + '.json'),
+                                                      _cell_paths(inputs,cell),
+                                                      _cell_paths(outputs,cell))]
+#---------------------------------------------------------------------------------------------------#
+def mark_cells(marker_dir,cells,inputs,outputs):
+    """ Writes the markers of the cells whose outputs all exist.
+
+        Parameters
+        ----------
+        marker_dir : string
+            Folder with the markers of the cells.
+        cells : list of strings
+            Names of the cells.
+        inputs : list of strings
+            Paths to the input files or directories of each cell, with the placeholder '{cell}'.
+        outputs : list of strings
+            Paths to the output files or directories of each cell, with the placeholder '{cell}'.
+
+        Returns
+        -------
+        list of strings
+            Names of the cells that were marked.
+    """
+    marked = []
+    for cell in cells:
+        outs = _cell_paths(outputs,cell)
+        if all(os.path.exists(p) for p in outs):
+            write_marker(os.path.join(marker_dir,cell + '.json'),_cell_paths(inputs,cell),outs)
+            marked.append(cell)
+    return marked
+#---------------------------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Checks and writes completion markers of the cells of a step.")
+    parser.add_argument('action',type=str,choices=['pending','mark'],help="'pending' prints the cells that have to be run, 'mark' writes the markers of the finished cells.")
+    parser.add_argument('marker_dir',type=str,help="Folder with the markers of the cells.")
+    parser.add_argument('--cells',type=str,nargs='*',default=[],help="Names of the cells, or of the step if it runs on the whole plate.")
+    parser.add_argument('--inputs',type=str,nargs='*',default=[],help="Input files or directories of each cell, with the placeholder '{cell}'.")
+    parser.add_argument('--outputs',type=str,nargs='*',default=[],help="Output files or directories of each cell, with the placeholder '{cell}'.")
+    o = parser.parse_args()
+
+    if o.action=='pending':
+        cells = pending_cells(o.marker_dir,o.cells,o.inputs,o.outputs)
+        print("{} of {} pending".format(len(cells),len(o.cells)),file=sys.stderr)
+    else:
+        cells = mark_cells(o.marker_dir,o.cells,o.inputs,o.outputs)
+        print("{} of {} marked as finished".format(len(cells),len(o.cells)),file=sys.stderr)
+    print('\n'.join(cells))
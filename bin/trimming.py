@@ -0,0 +1,404 @@
+""" Adapter and quality trimming of the paired fastq files of many cells in one pool of workers.
+
+        * detect_adapter
+        * quality_trim_index
+        * adapter_start
+        * trim_cell
+        * trim_cells
+        * write_stats
+
+    Approximates the default paired-end trimming of TrimGalore (cutadapt with quality cutoff 20,
+    error rate 0.1, minimum overlap 1 and minimum length 20, with the adapter detected from the
+    first reads) without starting a TrimGalore process, writing its reports and compressing
+    intermediate files for every cell. The reads are first trimmed by quality from the 3' end with
+    the algorithm of BWA and cutadapt, and then cut at the first occurrence of the adapter, or of a
+    prefix of it at the 3' end. Unlike cutadapt, the adapter is matched with substitutions only,
+    not insertions or deletions, so the output is not the same as that of TrimGalore for the
+    reads with an indel in the adapter (see bench/bench_trimming.py). The pairs with a mate
+    shorter than the minimum length are discarded, and the rest are written to
+    '<cell>_R1_val_1.fq.gz' and '<cell>_R2_val_2.fq.gz' as TrimGalore does.
+
+    Only the standard library is used, so that it can run in any of the containers.
+
+    Authors: Juan Sebastian Diaz Boada
+             juan.sebastian.diaz.boada@ki.se
+
+    18/10/26
+"""
+import os
+import csv
+import gzip
+import time
+import multiprocessing
+from itertools import islice, zip_longest
+from tracker import pending_cells, write_marker
+from report import path_bytes, append_record
+#---------------------------------------------------------------------------------------------------#
+# Adapters detected by TrimGalore, in its order of preference for ties
+ADAPTERS = {'Illumina':b'AGATCGGAAGAGC','Nextera':b'CTGTCTCTTATA','smallRNA':b'TGGAATTCTCGG'}
+STATS = ['adapter','read_pairs','pairs_written','pairs_too_short','r1_with_adapter',
+         'r2_with_adapter','bases','quality_trimmed_bases','bases_written']
+#---------------------------------------------------------------------------------------------------#
+def _open(path,mode='rb',compress_level=6,name=None):
+    """ Internal function. Opens a fastq file, compressed with gzip if its name (or 'name', for
+        temporary files) ends in '.gz'."""
+    if (name or path).endswith('.gz'):
+        return gzip.open(path,mode,compresslevel=compress_level) if 'w' in mode else \
+               gzip.open(path,mode)
+    return open(path,mode)
+#---------------------------------------------------------------------------------------------------#
+def _reads(f,chunk_size=2**22):
+    """ Internal function. Iterates over the (header, sequence, separator, qualities) lines of a
+        fastq, reading it in chunks to avoid a call per line."""
+    rest = b''
+    while True:
+        chunk = f.read(chunk_size)
+        lines = (rest + chunk).split(b'\n')
+        if chunk:
+            rest = lines.pop() # Incomplete last line
+            n = len(lines) - len(lines)%4
+            rest = b'\n'.join(lines[n:] + [rest])
+        else:
+            if len(lines[-1])==0:
+                lines.pop()
+            n = len(lines)
+            if n%4:
+                raise ValueError("Truncated fastq file {}".format(f.name))
+        for i in range(0,n,4):
+            yield lines[i:i+4]
+        if not chunk:
+            return
+#---------------------------------------------------------------------------------------------------#
+def detect_adapter(fastq_file,n_reads=1000000):
+    """ Finds the adapter of a library as TrimGalore does.
+
+        Parameters
+        ----------
+        fastq_file : string
+            Path to the R1 fastq file.
+        n_reads : int, optional
+            Number of reads scanned. Default is 1000000.
+
+        Returns
+        -------
+        string
+            Name of the key of ADAPTERS found in most reads, 'Illumina' if none is found.
+    """
+    counts = dict.fromkeys(ADAPTERS,0)
+    with _open(fastq_file) as f:
+        for record in islice(_reads(f),n_reads):
+            for name,adapter in ADAPTERS.items():
+                if adapter in record[1]:
+                    counts[name] += 1
+    return max(counts,key=counts.get) if any(counts.values()) else 'Illumina'
+#---------------------------------------------------------------------------------------------------#
+def quality_trim_index(qual,cutoff=20,base=33):
+    """ Length of a read after trimming its low quality 3' end, as in BWA and cutadapt.
+
+        Parameters
+        ----------
+        qual : bytes
+            Quality string of the read.
+        cutoff : int, optional
+            Phred quality cutoff. Default is 20.
+        base : int, optional
+            Offset of the qualities. Default is 33.
+
+        Returns
+        -------
+        int
+            Number of bases kept.
+    """
+    s = 0
+    max_s = 0
+    stop = len(qual)
+    threshold = cutoff + base
+    for i in range(len(qual)-1,-1,-1):
+        s += threshold - qual[i]
+        if s<0:
+            break
+        if s>max_s:
+            max_s = s
+            stop = i
+    return stop
+#---------------------------------------------------------------------------------------------------#
+def _mismatches(a,b):
+    return sum(x!=y for x,y in zip(a,b))
+#---------------------------------------------------------------------------------------------------#
+def adapter_start(seq,adapter,error_rate=0.1,min_overlap=1):
+    """ Position where a 3' adapter starts in a read.
+
+        The adapter is searched in full, with at most int(error_rate*len(adapter)) mismatches,
+        and then as a prefix of at least 'min_overlap' bases at the 3' end of the read, with at
+        most int(error_rate*overlap) mismatches. The full adapter is found with exact searches
+        of error + 1 pieces of it, since one of them has no mismatch.
+
+        Parameters
+        ----------
+        seq : bytes
+            Sequence of the read.
+        adapter : bytes
+            Sequence of the adapter.
+        error_rate : float, optional
+            Maximum fraction of mismatches. Default is 0.1.
+        min_overlap : int, optional
+            Minimum number of bases of the adapter at the 3' end of the read. Default is 1.
+
+        Returns
+        -------
+        int
+            Position of the first base of the adapter, or the length of the read if absent.
+    """
+    n = len(adapter)
+    max_errors = int(error_rate*n)
+    best = len(seq)
+    if max_errors==0:
+        pos = seq.find(adapter)
+        if pos>=0:
+            return pos
+    else:
+        piece = -(-n//(max_errors+1))
+        for offset in range(0,n,piece):
+            part = adapter[offset:offset+piece]
+            pos = seq.find(part)
+            while 0<=pos and pos-offset<best:
+                start = pos - offset
+                if start>=0 and start+n<=len(seq) and \
+                   _mismatches(seq[start:start+n],adapter)<=max_errors:
+                    best = start
+                    break
+                pos = seq.find(part,pos+1)
+        if best<len(seq):
+            return best
+    for overlap in range(min(n-1,len(seq)),min_overlap-1,-1):
+        errors = int(error_rate*overlap)
+        if seq.endswith(adapter[:overlap]) if errors==0 else \
+           _mismatches(seq[len(seq)-overlap:],adapter[:overlap])<=errors:
+            return len(seq) - overlap
+    return len(seq)
+#---------------------------------------------------------------------------------------------------#
+def trim_cell(fastq_ins,fastq_outs,adapter=None,quality=20,length=20,error_rate=0.1,stringency=1,
+              compress_level=6):
+    """ Trims the paired fastq files of a cell.
+
+        The output is written to temporary files that are moved in place when complete.
+
+        Parameters
+        ----------
+        fastq_ins : tuple of strings
+            Paths to the R1 and R2 fastq files, with the mates in the same order.
+        fastq_outs : tuple of strings
+            Paths to the trimmed R1 and R2 fastq files.
+        adapter : string, optional
+            Key of ADAPTERS or sequence of the adapter, the same for both mates. Default is None,
+            detecting it with 'detect_adapter'.
+        quality : int, optional
+            Phred quality cutoff for the 3' ends. Default is 20.
+        length : int, optional
+            Minimum length of both mates for a pair to be kept. Default is 20.
+        error_rate : float, optional
+            Maximum fraction of mismatches with the adapter. Default is 0.1.
+        stringency : int, optional
+            Minimum overlap with the adapter at the 3' end. Default is 1.
+        compress_level : int, optional
+            Gzip compression level of the output files. Default is 6.
+
+        Returns
+        -------
+        dictionary
+            Trimming stats of the cell, with the keys of STATS.
+    """
+    if adapter is None:
+        adapter = detect_adapter(fastq_ins[0])
+    sequence = ADAPTERS.get(adapter,adapter.encode() if isinstance(adapter,str) else adapter)
+    stats = dict.fromkeys(STATS[1:],0)
+    stats['adapter'] = adapter if adapter in ADAPTERS else sequence.decode()
+    temps = [path + '.tmp' for path in fastq_outs]
+    with _open(fastq_ins[0]) as in1, _open(fastq_ins[1]) as in2, \
+         _open(temps[0],'wb',compress_level,fastq_outs[0]) as out1, \
+         _open(temps[1],'wb',compress_level,fastq_outs[1]) as out2:
+        buffers = ([],[])
+        for r1,r2 in zip_longest(_reads(in1),_reads(in2)):
+            if r1 is None or r2 is None:
+                raise ValueError("The fastq files {} have different numbers of reads."
+                                 .format(fastq_ins))
+            stats['read_pairs'] += 1
+            trimmed = []
+            for mate,(header,seq,sep,qual) in zip((1,2),(r1,r2)):
+                stats['bases'] += len(seq)
+                stop = quality_trim_index(qual,quality)
+                stats['quality_trimmed_bases'] += len(seq) - stop
+                start = adapter_start(seq[:stop],sequence,error_rate,stringency)
+                if start<stop:
+                    stats['r{}_with_adapter'.format(mate)] += 1
+                trimmed.append((header,seq[:start],sep,qual[:start]))
+            if len(trimmed[0][1])<length or len(trimmed[1][1])<length:
+                stats['pairs_too_short'] += 1
+                continue
+            stats['pairs_written'] += 1
+            for buffer,(header,seq,sep,qual) in zip(buffers,trimmed):
+                stats['bases_written'] += len(seq)
+                buffer.append(b'\n'.join((header,seq,sep,qual,b'')))
+            if len(buffers[0])>=10000:
+                out1.write(b''.join(buffers[0]))
+                out2.write(b''.join(buffers[1]))
+                buffers = ([],[])
+        out1.write(b''.join(buffers[0]))
+        out2.write(b''.join(buffers[1]))
+    for temp,path in zip(temps,fastq_outs):
+        os.replace(temp,path)
+    return stats
+#---------------------------------------------------------------------------------------------------#
+def _cell_files(in_dir,out_dir,cell):
+    """ Internal function. Input and output fastq files of a cell, named as in TrimGalore."""
+    fastq_ins = [os.path.join(in_dir,cell,cell + '_R{}.fastq.gz'.format(i)) for i in (1,2)]
+    fastq_outs = [os.path.join(out_dir,cell,cell + '_R{0}_val_{0}.fq.gz'.format(i)) for i in (1,2)]
+    return fastq_ins, fastq_outs
+#---------------------------------------------------------------------------------------------------#
+def _reset_peak_rss():
+    """ Internal function. Resets the peak resident memory of this process (VmHWM) to its
+        current one, returning False if the kernel does not allow it (before Linux 4.0)."""
+    try:
+        with open('/proc/self/clear_refs','w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+#---------------------------------------------------------------------------------------------------#
+def _peak_rss_mb():
+    """ Internal function. Peak resident memory of this process in MB since it was last reset."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return round(int(line.split()[1])/1024,1) # In kB
+    return None
+#---------------------------------------------------------------------------------------------------#
+def _trim_job(args):
+    """ Internal function. Trims a cell in a worker, returning its stats and its record for the
+        log. The peak memory of the worker is reset before the cell, so that it is the one of
+        the cell and not of the largest cell trimmed before by the same worker, as the
+        cumulative 'ru_maxrss' of the process would be. If it cannot be reset, it is left empty."""
+    cell, in_dir, out_dir, kwargs = args
+    fastq_ins, fastq_outs = _cell_files(in_dir,out_dir,cell)
+    reset = _reset_peak_rss()
+    start = time.time()
+    cpu_start = time.process_time()
+    try:
+        os.makedirs(os.path.dirname(fastq_outs[0]),exist_ok=True)
+        stats = trim_cell(fastq_ins,fastq_outs,**kwargs)
+        code = 0
+    except Exception as e:
+        print("Cell {}: {}".format(cell,e),flush=True)
+        stats = None
+        code = 1
+    record = {'status':'success' if code==0 else 'failure','return_code':code,
+              'start':time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(start)),
+              'seconds':round(time.time()-start,1),
+              'cpu_seconds':round(time.process_time()-cpu_start,1),
+              'max_rss_mb':_peak_rss_mb() if reset else None,
+              'input_mb':round(path_bytes(fastq_ins)/2**20,1),
+              'output_mb':round(path_bytes(fastq_outs)/2**20,1),
+              'reads':stats['read_pairs'] if stats else None}
+    return cell, stats, record
+#---------------------------------------------------------------------------------------------------#
+def trim_cells(cells,in_dir,out_dir,processes=1,log_file=None,stats_file=None,marker_dir=None,
+               dry_run=False,**kwargs):
+    """ Trims the fastq files of many cells in one pool of worker processes.
+
+        Each worker trims whole cells, read from '<in_dir>/<cell>/<cell>_R1.fastq.gz' and
+        '_R2.fastq.gz' and written to '<out_dir>/<cell>/<cell>_R1_val_1.fq.gz' and
+        '_R2_val_2.fq.gz'. As in 'scheduler.run_cell_jobs', the result of each cell is appended
+        to 'log_file' as soon as it finishes, and with 'marker_dir' only the cells without an up
+        to date completion marker are trimmed. The workers live for the whole run, and the peak
+        memory of each cell in the column 'max_rss_mb' of the log is the peak resident memory
+        (VmHWM) of its worker while trimming it, reset before each cell through
+        '/proc/self/clear_refs'. Where the kernel does not allow the reset, the column is left
+        empty rather than giving the peak of the worker over all its cells. The workers are
+        started from a 'forkserver' process, so that the memory of the calling process is not
+        counted in theirs.
+
+        Parameters
+        ----------
+        cells : list of strings
+            Names of the cells.
+        in_dir : string
+            Folder with the fastq files of the cells.
+        out_dir : string
+            Folder where the trimmed fastq files are saved.
+        processes : int, optional
+            Number of worker processes. Default is 1.
+        log_file : string, optional
+            Path to the tab-separated log with the result of each cell. Default is None.
+        stats_file : string, optional
+            Path to the tab-separated table with the trimming stats of each cell. The rows of
+            the cells trimmed again are replaced. Default is None.
+        marker_dir : string, optional
+            Folder with the completion markers of the cells. Default is None.
+        dry_run : bool, optional
+            If True, prints the cells that would be trimmed without trimming them. Default is
+            False.
+        **kwargs
+            Options of 'trim_cell'.
+
+        Returns
+        -------
+        dict
+            Dictionary mapping each cell trimmed to its stats, or None if it failed.
+    """
+    if marker_dir is not None:
+        n_cells = len(cells)
+        inputs, outputs = _cell_files(in_dir,out_dir,'{cell}')
+        cells = pending_cells(marker_dir,cells,inputs,outputs)
+        print("{} of {} cells are up to date, skipping them".format(n_cells-len(cells),n_cells))
+    if dry_run:
+        for cell in cells:
+            print("Would trim cell {}".format(cell))
+        return {}
+    print("Trimming {} cells in {} processes".format(len(cells),processes))
+    if log_file is not None:
+        open(log_file,'w').close()
+    results = {}
+    jobs = [(cell,in_dir,out_dir,kwargs) for cell in cells]
+    # The workers are forked from a new server process, so that they do not share the memory of
+    # the calling process, which would count in the peak memory of their cells
+    context = multiprocessing.get_context('forkserver')
+    with context.Pool(max(1,min(processes,len(cells)))) as pool:
+        for cell,stats,record in pool.imap_unordered(_trim_job,jobs):
+            results[cell] = stats
+            if marker_dir is not None:
+                marker = os.path.join(marker_dir,cell + '.json')
+                if stats is not None:
+                    write_marker(marker,*_cell_files(in_dir,out_dir,cell))
+                elif os.path.exists(marker):
+                    os.remove(marker)
+            if log_file is not None:
+                append_record(log_file,cell,record)
+            print("Cell {} {} ({}/{})".format(cell,'finished' if stats else 'FAILED',len(results),
+                                             len(cells)),flush=True)
+    if stats_file is not None:
+        write_stats(stats_file,{cell:stats for cell,stats in results.items() if stats})
+    n_failed = sum(stats is None for stats in results.values())
+    print("{} cells finished, {} failed".format(len(cells)-n_failed,n_failed))
+    return results
+#---------------------------------------------------------------------------------------------------#
+def write_stats(stats_file,stats):
+    """ Writes the trimming stats of the cells to a tab-separated table, keeping the rows of the
+        other cells already in it.
+
+        Parameters
+        ----------
+        stats_file : string
+            Path to the table.
+        stats : dictionary
+            Dictionary mapping each cell to its stats, as given by 'trim_cell'.
+    """
+    rows = {}
+    if os.path.isfile(stats_file):
+        with open(stats_file) as f:
+            rows = {row['cell']:row for row in csv.DictReader(f,delimiter='\t')}
+    rows.update({cell:dict(values,cell=cell) for cell,values in stats.items()})
+    with open(stats_file + '.tmp','w') as f:
+        f.write('\t'.join(['cell'] + STATS) + '\n')
+        for cell in sorted(rows):
+            f.write('\t'.join(str(rows[cell][c]) for c in ['cell'] + STATS) + '\n')
+    os.replace(stats_file + '.tmp',stats_file)
@@ -12,8 +12,10 @@ fi
 # Define the help function
 function help {
   # Print the usage message
-  echo "Usage: $0 [PLATE_NAME][NODES]"
+  echo "Usage: $0 [-n] [-s] [-p] [-t REFERENCE] [-c CACHE_DIR] [PLATE_NAME][NODES][CELL_NODES]"
   echo "Runs the Smart-seq3 TCR extraction pipeline on a the sequencing data of a plate."
+  echo "The work finished in a previous run with the same inputs is skipped, so an interrupted"
+  echo "run can be resumed and the wells added to a plate are processed without redoing the rest."
   echo "A wrapper of Pysam, samtools, TrimGalore and TraCeR"
   echo "This script assumes the existence of a directory structure as in the repo"
   echo "https://github.com/scReumaKI/smartseq3-TCR"
@@ -23,10 +25,24 @@ function help {
   echo "Parameters:"
   echo "  PLATE_NAME     Name of the plate as prefix of sequencing files and folder names."
   echo "  NODES          Number of nodes to use in parallel computations. Defaults to 10."
+  echo "  CELL_NODES     Number of nodes given to each cell in TraCeR. Defaults to 4."
   echo ""
   # Print the list of options
   echo "Options:"
   echo "  -h, --help        display this help and exit"
+  echo "  -n, --dry_run     print the steps and cells that would be run, without running them"
+  echo "  -s, --stream_fastq"
+  echo "                    split the bam files of the plate directly into the fastq files of step 2,"
+  echo "                    without writing a bam file per cell, and skip step 2"
+  echo "  -p, --python_trim trim all cells in one pool of python processes instead of one TrimGalore"
+  echo "                    run per cell. Not equivalent to TrimGalore: adapters with an indel are"
+  echo "                    not trimmed (see bin/trimming.py and bench/bench_trimming.py)"
+  echo "  -t, --tcr_filter REFERENCE"
+  echo "                    keep only the reads of the TCR loci before trimming, given the V, J and C"
+  echo "                    sequences in REFERENCE (a fasta file or a folder with .fa files)"
+  echo "  -c, --tracer_cache CACHE_DIR"
+  echo "                    build the index of the base transcriptome of TraCeR once in CACHE_DIR, e.g. on"
+  echo "                    local scratch, and share it among all cells and runs (see bin/tracer_cache.py)"
   # Exit with a success status code
   exit 0
 }
@@ -34,9 +50,33 @@ function help {
 if [ "$1" = "-h" ] || [ "$1" = "--help" ]; then
   help
 fi
+while [[ "$1" == -* ]]; do
+  case $1 in
+    -n|--dry_run)
+      # Exported so that the scripts running in the containers see it
+      export DRY_RUN=1
+      shift;;
+    -s|--stream_fastq)
+      STREAM_FASTQ=1
+      shift;;
+    -p|--python_trim)
+      PYTHON_TRIM=1
+      shift;;
+    -t|--tcr_filter)
+      TCR_REFERENCE=$2
+      shift 2;;
+    -c|--tracer_cache)
+      export TRACER_CACHE=$2
+      shift 2;;
+    *)
+      echo "Error: unknown option $1" >&2
+      exit 1;;
+  esac
+done
 PLATE_NAME=$1
 shift
 NODES=${1:-10}
+CELL_NODES=${2:-4}
 echo "Nodes = $NODES"
 # Handling missing data
 if [ ! -d data/00_SS3_raw_data/${PLATE_NAME}/ ];then
@@ -78,41 +118,143 @@ if [ ! -f env/04_tracer_SS3.sif ];then
 else
   echo "Container env/04_tracer_SS3.sif already exists. Using existing image..."
 fi
+# Completion markers of each step are saved in the folder <output folder>_done/, except for
+# step 5, whose output folder is read by step 6 as a folder of plates
+TRACKER="singularity exec env/01_pysam_SS3.sif python3 bin/tracker.py"
+RAW=data/00_SS3_raw_data/${PLATE_NAME}/${PLATE_NAME}
+SPLIT=data/01_SS3_splitted_bams/${PLATE_NAME}
+MERGED=data/02_SS3_merged_fastq/${PLATE_NAME}
+FILTERED=data/02_SS3_filtered_fastq/${PLATE_NAME}
+ASSEMBLED=data/04_SS3_Tracer_assembled_cells/${PLATE_NAME}
+COLLECTED=data/05_SS3_collected_TCRs/${PLATE_NAME}
+COLLECTED_DONE=data/.markers/05_SS3_collected_TCRs/${PLATE_NAME}_done
+# Time and resources of each stage are saved in a report per run (see bin/report.py)
+REPORT=results/run_reports/${PLATE_NAME}/$(date +%Y%m%d_%H%M%S)
+REPORTER="singularity exec env/01_pysam_SS3.sif python3 bin/report.py"
+if [ -z "$DRY_RUN" ];then
+  mkdir -p $REPORT
+fi
+# CPU time of the finished children of this shell, from the output of the 'times' builtin
+CHILDREN_CPU='NR==2 {split($1,u,/[ms]/); split($2,s,/[ms]/); print u[1]*60+u[2]+s[1]*60+s[2]}'
+# Runs a stage in a container, appending its wall and CPU time to the report. The peak memory,
+# sizes and reads of the stages are added from the logs of their cells in the summary
+function timed {
+  local STAGE=$1
+  shift
+  if [ -n "$DRY_RUN" ];then
+    "$@"
+    return
+  fi
+  local START=$(date +%s.%N)
+  times > $REPORT/.times
+  local CPU_START=$(awk "$CHILDREN_CPU" $REPORT/.times)
+  "$@"
+  local CODE=$?
+  times > $REPORT/.times
+  if [ ! -f $REPORT/stages.tsv ];then
+    printf "stage\tstatus\treturn_code\tstart\tseconds\tcpu_seconds\tmax_rss_mb\tinput_mb\toutput_mb\treads\n" \
+    > $REPORT/stages.tsv
+  fi
+  printf "%s\t%s\t%d\t%s\t%.1f\t%.1f\t\t\t\t\n" $STAGE $( (( CODE )) && echo failure || echo success ) \
+  $CODE "$(date -d @${START%.*} '+%Y-%m-%d %H:%M:%S')" $(awk "BEGIN {print $(date +%s.%N) - $START}") \
+  $(awk "$CHILDREN_CPU" $REPORT/.times | awk -v c=$CPU_START '{print $1 - c}') >> $REPORT/stages.tsv
+  return $CODE
+}
 # ---------------------------------------------------------------------------- #
 # 01. SPLIT BAM files
 echo "================================================================================="
 ./env/figlet.sif "1. Pysam"
 echo "================================================================================="
-# Split Aligned reads file
-if [ ! -d data/01_SS3_splitted_bams/${PLATE_NAME}/Aligned/ ];then
-  mkdir -p data/01_SS3_splitted_bams/${PLATE_NAME}/Aligned/
-  echo "Created folder for Aligned reads"
-fi
-./env/01_pysam_SS3.sif \
-data/00_SS3_raw_data/${PLATE_NAME}/${PLATE_NAME}.filtered.tagged.Aligned.out.bam \
-data/00_SS3_raw_data/${PLATE_NAME}/${PLATE_NAME}.barcodes.csv \
-data/01_SS3_splitted_bams/${PLATE_NAME}/Aligned/ \
---condition_tag_col Barcode --condition_name_col Name --bam_tag_flag BC
-# Split unmapped reads file
-if [ ! -d data/01_SS3_splitted_bams/${PLATE_NAME}/unmapped/ ];then
-  mkdir -p data/01_SS3_splitted_bams/${PLATE_NAME}/unmapped/
-  echo "Created folder for unmapped reads"
-fi
-./env/01_pysam_SS3.sif \
-data/00_SS3_raw_data/${PLATE_NAME}/${PLATE_NAME}.filtered.tagged.unmapped.bam \
-data/00_SS3_raw_data/${PLATE_NAME}/${PLATE_NAME}.barcodes.csv \
-data/01_SS3_splitted_bams/${PLATE_NAME}/unmapped/ \
---condition_tag_col Barcode --condition_name_col Name --bam_tag_flag BC
+if [ -n "$STREAM_FASTQ" ];then
+  # Split Aligned and unmapped reads straight into the merged fastq files of each cell, with the
+  # unmapped reads after the Aligned ones as in step 2. The fastq files are read once by the next
+  # step, so they are compressed at the fastest level
+  STREAM_IO="--inputs ${RAW}.filtered.tagged.Aligned.out.bam ${RAW}.filtered.tagged.unmapped.bam \
+  ${RAW}.barcodes.csv --outputs ${MERGED}/"
+  if [ -z "$($TRACKER pending ${MERGED}_done --cells split $STREAM_IO)" ];then
+    echo "The bam files of plate ${PLATE_NAME} are already split into fastq files. Skipping..."
+  elif [ -n "$DRY_RUN" ];then
+    echo "Would split the bam files of plate ${PLATE_NAME} into fastq files"
+  else
+    mkdir -p ${MERGED}/
+    $REPORTER run $REPORT/stages.tsv split $STREAM_IO -- ./src/01_split_bam_by_tag_and_condition_file.py \
+    ${RAW}.filtered.tagged.Aligned.out.bam ${RAW}.barcodes.csv ${MERGED}/ \
+    --condition_tag_col Barcode --condition_name_col Name --bam_tag_flag BC \
+    --fastq --append_bam ${RAW}.filtered.tagged.unmapped.bam --compress_level 1 \
+    --threads $(( NODES > 1 ? NODES / 2 : 1 )) --compress_threads $(( NODES > 1 ? NODES / 2 : 1 )) && \
+    $TRACKER mark ${MERGED}_done --cells split $STREAM_IO > /dev/null
+  fi
+else
+  # Split Aligned and unmapped reads files in parallel, used by steps 2 and 2b
+  SPLIT_BAMS=${SPLIT}/
+  if [ ! -d data/01_SS3_splitted_bams/${PLATE_NAME}/Aligned/ ];then
+    mkdir -p data/01_SS3_splitted_bams/${PLATE_NAME}/Aligned/
+    echo "Created folder for Aligned reads"
+  fi
+  if [ ! -d data/01_SS3_splitted_bams/${PLATE_NAME}/unmapped/ ];then
+    mkdir -p data/01_SS3_splitted_bams/${PLATE_NAME}/unmapped/
+    echo "Created folder for unmapped reads"
+  fi
+  SPLIT_IO="--inputs ${RAW}.filtered.tagged.Aligned.out.bam ${RAW}.filtered.tagged.unmapped.bam \
+  ${RAW}.barcodes.csv --outputs ${SPLIT}/Aligned/ ${SPLIT}/unmapped/"
+  if [ -z "$($TRACKER pending ${SPLIT}_done --cells split $SPLIT_IO)" ];then
+    echo "The bam files of plate ${PLATE_NAME} are already split. Skipping..."
+  elif [ -n "$DRY_RUN" ];then
+    echo "Would split the bam files of plate ${PLATE_NAME}"
+  else
+    $REPORTER run $REPORT/stages.tsv split $SPLIT_IO -- ./src/01_split_bam_by_tag_and_condition_file.py \
+    ${RAW}.filtered.tagged.Aligned.out.bam ${RAW}.barcodes.csv ${SPLIT}/Aligned/ \
+    --condition_tag_col Barcode --condition_name_col Name --bam_tag_flag BC \
+    --extra_bam ${RAW}.filtered.tagged.unmapped.bam ${SPLIT}/unmapped/ \
+    --threads $(( NODES > 1 ? NODES / 2 : 1 )) && \
+    $TRACKER mark ${SPLIT}_done --cells split $SPLIT_IO > /dev/null
+  fi
+fi
 # ---------------------------------------------------------------------------- #
 # 01. Translate and merge
 echo "================================================================================="
 ./env/figlet.sif "2. Samtools"
 echo "================================================================================="
-if [ ! -d data/02_SS3_merged_fastq/${PLATE_NAME}/ ];then
-  mkdir -p data/02_SS3_merged_fastq/${PLATE_NAME}/
+if [ -n "$STREAM_FASTQ" ];then
+  echo "The fastq files of plate ${PLATE_NAME} are written by step 1. Skipping..."
+else
+  if [ ! -d data/02_SS3_merged_fastq/${PLATE_NAME}/ ];then
+    mkdir -p data/02_SS3_merged_fastq/${PLATE_NAME}/
+  fi
+  BAM2FASTQ_LOG=${MERGED}_log.tsv
+  shopt -s nullglob
+  CELLS=$(for FILE in ${SPLIT}/Aligned/*.bam;do basename $FILE .bam; done)
+  MERGED_IO="--inputs ${SPLIT}/Aligned/{cell}.bam ${SPLIT}/unmapped/{cell}.bam \
+  --outputs ${MERGED}/{cell}/{cell}_R1.fastq.gz ${MERGED}/{cell}/{cell}_R2.fastq.gz"
+  PENDING=$($TRACKER pending ${MERGED}_done --cells $CELLS $MERGED_IO)
+  if [ -z "$PENDING" ];then
+    echo "All cells of plate ${PLATE_NAME} are already converted to fastq. Skipping..."
+  elif [ -n "$DRY_RUN" ];then
+    echo "Would convert to fastq the cells: "$PENDING
+  else
+    timed bam2fastq ./env/02_samtools_SS3.sif ${SPLIT}/ ${MERGED}/ $NODES $PENDING
+    # Only the cells converted successfully are marked, the rest are converted again next run
+    CONVERTED=$(awk -F '\t' 'NR>1 && $2=="success" {print $1}' ${MERGED}_log.tsv)
+    if [ -n "$CONVERTED" ];then
+      $TRACKER mark ${MERGED}_done --cells $CONVERTED $MERGED_IO > /dev/null
+    fi
+  fi
+fi
+# ---------------------------------------------------------------------------- #
+# 02b. Optional filter of the reads of the TCR loci
+TRIM_INPUT=${MERGED}/
+if [ -n "$TCR_REFERENCE" ];then
+  echo "================================================================================="
+  ./env/figlet.sif "2b. TCR filter"
+  echo "================================================================================="
+  if [ -z "$DRY_RUN" ];then
+    mkdir -p ${FILTERED}/
+  fi
+  # Without the bam files per cell (--stream_fastq), the reads are only matched to the reference
+  timed tcr_filter singularity exec env/01_pysam_SS3.sif ./src/02b_filter_tcr_reads.sh \
+  ${MERGED}/ ${FILTERED}/ $NODES $TCR_REFERENCE $SPLIT_BAMS
+  TRIM_INPUT=${FILTERED}/
 fi
-./env/02_samtools_SS3.sif data/01_SS3_splitted_bams/${PLATE_NAME}/ \
-data/02_SS3_merged_fastq/${PLATE_NAME}/ $NODES
 # ---------------------------------------------------------------------------- #
 # 02. Trim adapters
 echo "================================================================================="
@@ -121,27 +263,26 @@ echo "==========================================================================
 if [ ! -d data/03_SS3_trimmed_fastq/${PLATE_NAME}/ ];then
   mkdir -p data/03_SS3_trimmed_fastq/${PLATE_NAME}/
 fi
-./env/03_trimgalore_SS3.sif data/02_SS3_merged_fastq/${PLATE_NAME}/ \
-data/03_SS3_trimmed_fastq/${PLATE_NAME}/ 8
+if [ -n "$PYTHON_TRIM" ];then
+  # The trimmed files are read once by TraCeR, so they are compressed at the fastest level
+  timed trim singularity exec env/01_pysam_SS3.sif python3 ./src/03_trim_cells.py $TRIM_INPUT \
+  data/03_SS3_trimmed_fastq/${PLATE_NAME}/ --processes $NODES --compress_level 1 ${DRY_RUN:+--dry_run}
+else
+  timed trim ./env/03_trimgalore_SS3.sif $TRIM_INPUT \
+  data/03_SS3_trimmed_fastq/${PLATE_NAME}/ $NODES 8
+fi
 # ---------------------------------------------------------------------------- #
 # 03. TCR assemble
 echo "================================================================================="
 ./env/figlet.sif "4. TraCeR"
 echo "================================================================================="
-# Assemble alpha-beta
-if [ ! -d data/04_SS3_Tracer_assembled_cells/${PLATE_NAME}/AB/ ];then
-  mkdir -p data/04_SS3_Tracer_assembled_cells/${PLATE_NAME}/AB/
-  echo "Created folder for AB TCRs"
-fi
-./env/04_tracer_SS3.sif data/03_SS3_trimmed_fastq/${PLATE_NAME}/ \
-data/04_SS3_Tracer_assembled_cells/${PLATE_NAME}/AB $NODES 'AB'
-# Assemble gamma-delta
-if [ ! -d data/04_SS3_Tracer_assembled_cells/${PLATE_NAME}/GD/ ];then
-  mkdir -p data/04_SS3_Tracer_assembled_cells/${PLATE_NAME}/GD/
-  echo "Created folder for GD TCRs"
-fi
-./env/04_tracer_SS3.sif data/03_SS3_trimmed_fastq/${PLATE_NAME}/ \
-data/04_SS3_Tracer_assembled_cells/${PLATE_NAME}/GD $NODES 'GD'
+# Assemble alpha-beta and gamma-delta of each cell at the same time, in AB/ and GD/
+if [ ! -d ${ASSEMBLED}/ ];then
+  mkdir -p ${ASSEMBLED}/
+  echo "Created folder for AB and GD TCRs"
+fi
+timed tracer ./env/04_tracer_SS3.sif data/03_SS3_trimmed_fastq/${PLATE_NAME}/ \
+${ASSEMBLED}/ $NODES 'ABGD' $CELL_NODES
 # ---------------------------------------------------------------------------- #
 # 04. TCR collection
 echo "================================================================================="
@@ -150,6 +291,23 @@ echo "==========================================================================
 if [ ! -d data/05_SS3_collected_TCRs/${PLATE_NAME}/ ];then
   mkdir -p data/05_SS3_collected_TCRs/${PLATE_NAME}/
 fi
-singularity exec env/01_pysam_SS3.sif ./src/05_collect_assemble.py \
-data/04_SS3_Tracer_assembled_cells/${PLATE_NAME}/ \
-data/05_SS3_collected_TCRs/${PLATE_NAME}/${PLATE_NAME}.tsv
+# The markers of the assembled cells change whenever a cell is assembled again
+COLLECTED_IO="--inputs ${ASSEMBLED}_done/ --outputs ${COLLECTED}/${PLATE_NAME}.tsv"
+if [ -z "$($TRACKER pending $COLLECTED_DONE --cells collect $COLLECTED_IO)" ];then
+  echo "The TCRs of plate ${PLATE_NAME} are already collected. Skipping..."
+elif [ -n "$DRY_RUN" ];then
+  echo "Would collect the TCRs of plate ${PLATE_NAME}"
+else
+  $REPORTER run $REPORT/stages.tsv collect --inputs ${ASSEMBLED}/ \
+  --outputs ${COLLECTED}/${PLATE_NAME}.tsv -- ./src/05_collect_assemble.py \
+  ${ASSEMBLED}/ ${COLLECTED}/${PLATE_NAME}.tsv && \
+  $TRACKER mark $COLLECTED_DONE --cells collect $COLLECTED_IO > /dev/null
+fi
+# ---------------------------------------------------------------------------- #
+# Run report
+if [ -z "$DRY_RUN" ];then
+  echo "================================================================================="
+  $REPORTER summary $REPORT --cells ${BAM2FASTQ_LOG:+bam2fastq=$BAM2FASTQ_LOG} ${TCR_REFERENCE:+tcr_filter=${FILTERED}_log.tsv} \
+  trim=data/03_SS3_trimmed_fastq/${PLATE_NAME}_log.tsv tracer=${ASSEMBLED}_log.tsv
+  rm -f $REPORT/.times
+fi
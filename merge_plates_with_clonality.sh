@@ -20,6 +20,9 @@ function help {
   echo "Options:"
   echo "  --input_dir       Relative path to the directory containing the Tracer output for each plate. Defaults to 'data/05_SS3_collected_TCRs'."
   echo "  --out_file        Relative path to the output dataset file. Defaults to 'results/TCR_clonality.tsv'."
+  echo "  --threads         Number of plates read and treated at the same time. Defaults to 8."
+  echo "  --fuzzy           Also group the clones whose CDR3 differ in at most this number of edits. Defaults to none."
+  echo "  --index           Folder of the persistent clone index, to only treat new or changed plates. Defaults to none."
   echo "  -h, --help        display this help and exit"
   # Exit with a success status code
   exit 0
@@ -27,6 +30,9 @@ function help {
 # Set default values for the input folder and output file
 input_dir="data/05_SS3_collected_TCRs"
 out_file="results/TCR_clonality.tsv"
+threads=8
+index=""
+fuzzy=""
 # Process the command-line arguments
 while [ $# -gt 0 ]; do
   case "$1" in
@@ -38,6 +44,18 @@ while [ $# -gt 0 ]; do
       out_file=$2
       shift 2
       ;;
+    --threads)
+      threads=$2
+      shift 2
+      ;;
+    --index)
+      index=$2
+      shift 2
+      ;;
+    --fuzzy)
+      fuzzy=$2
+      shift 2
+      ;;
     --help)
       # Print usage message and exit
       help
@@ -49,4 +67,9 @@ while [ $# -gt 0 ]; do
   esac
 done
 # ---------------------------------------------------------------------------- #
-singularity exec env/01_pysam_SS3.sif ./src/06_clonality_analysis.py $input_dir $out_file
+# Time and resources of the run are saved in results/run_reports/clonality/ (see bin/report.py)
+REPORT=results/run_reports/clonality/$(date +%Y%m%d_%H%M%S)
+singularity exec env/01_pysam_SS3.sif python3 bin/report.py run $REPORT/stages.tsv clonality \
+--inputs $input_dir --outputs $out_file -- \
+./src/06_clonality_analysis.py $input_dir $out_file --threads $threads ${index:+--index $index} ${fuzzy:+--fuzzy $fuzzy} && \
+singularity exec env/01_pysam_SS3.sif python3 bin/report.py summary $REPORT
@@ -29,9 +29,55 @@
         The tag in the bam file that contains the sample barcode. Defaults to 'BC' for zUMIs output.
     name_part_filer : string (optional)
         Use to limit itself to samples names that contain a particular substring. Defaults to None.
+    extra_bam : 2 strings (optional)
+        Another multiplexed .bam file and its output folder, split with the same barcodes in a
+        parallel process. Can be given several times. E.g. the unmapped reads of the plate.
+    threads : int (optional)
+        Number of htslib threads to decompress each input .bam file. Defaults to 1.
+    max_open_files : int (optional)
+        Maximum number of output .bam files open at the same time per input file. Defaults to 128.
+    fastq : bool (optional)
+        Write paired fastq.gz files per cell in 'bam_out'/<name>/ instead of .bam files, skipping
+        the conversion of '02_bam2fastq.sh'.
+    append_bam : string (optional)
+        Another multiplexed .bam file whose reads are appended to the same fastq files, after those
+        of 'bam_in'. E.g. the unmapped reads of the plate. Can be given several times. Only used
+        with 'fastq'.
+    compress_level : int (optional)
+        Gzip compression level of the fastq files, from 0 (stored, not compressed) to 9. Only used
+        with 'fastq'. Defaults to 6.
+    compress_threads : int (optional)
+        Number of threads compressing the fastq files. Only used with 'fastq'. Defaults to 1.
+    max_pending : int (optional)
+        Maximum number of reads waiting for their mate. Reads evicted from this buffer are lost,
+        counted and warned about. Only used with 'fastq'. Defaults to 1000000.
+    barcode_index : bool (optional)
+        Read only the records of the selected cells by seeking to them with a barcode index of
+        each input .bam file, saved as '<bam>.bci' and built on first use. Meant to extract a few
+        cells with 'name_part_filter' without decompressing the whole file.
+    barcode_mismatches : int (optional)
+        Assign the reads whose barcode has at most this number of substitutions from the barcode
+        of a single cell of 'condition_csv' to that cell, and save the numbers of exact, corrected
+        and discarded reads of each cell in '<bam_out>_barcodes.tsv'. Sequences equally close to
+        several barcodes are discarded. Defaults to None, keeping only exact barcodes without
+        report; 0 gives the report without correction.
 
 """
-import pandas, argparse, pysam, tqdm
+import os, sys, argparse, multiprocessing
+
+module_path = os.path.abspath('bin')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from bam_functions import read_condition_file, barcode_neighbours, barcode_report, split_bam, \
+                          split_bam_to_fastq
+
+def save_barcode_report(bam_out,barcode_counts,tag_to_name,corrections,ambiguous):
+    """ Saves the exact, corrected and discarded reads of each cell next to 'bam_out'."""
+    report = barcode_report(barcode_counts,tag_to_name,corrections,ambiguous)
+    report.to_csv(bam_out.rstrip('/') + '_barcodes.tsv',sep='\t',index=False)
+    print("{}: {} exact, {} corrected and {} discarded reads".format(bam_out,
+          report['exact'].sum(),report['corrected'].sum(),report['discarded'].iloc[-1]))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -42,17 +88,43 @@ if __name__ == '__main__':
     parser.add_argument('--condition_name_col',type=str,default='Name',help="Name of the column containing the cell name in 'condition_csv'. Defaults to 'Name'.")
     parser.add_argument('--bam_tag_flag',type=str,default='BC',help="The tag in the bam file that contains the sample barcode. Defaults to 'BC' for zUMIs output.")
     parser.add_argument('--name_part_filter',type=str,default=None,help="Use to limit itself to samples names that contain a particular substring. Defaults to None.")
+    parser.add_argument('--extra_bam',type=str,nargs=2,action='append',default=[],metavar=('BAM_IN','BAM_OUT'),help="Another multiplexed .bam file and its output folder, split with the same barcodes in a parallel process. Can be given several times.")
+    parser.add_argument('--threads',type=int,default=1,help="Number of htslib threads to decompress each input .bam file. Defaults to 1.")
+    parser.add_argument('--max_open_files',type=int,default=128,help="Maximum number of output .bam files open at the same time per input file. Defaults to 128.")
+    parser.add_argument('--fastq',action='store_true',help="Write paired fastq.gz files per cell in 'bam_out'/<name>/ instead of .bam files.")
+    parser.add_argument('--append_bam',type=str,action='append',default=[],help="Another multiplexed .bam file whose reads are appended to the same fastq files, after those of 'bam_in'. Can be given several times. Only used with --fastq.")
+    parser.add_argument('--compress_level',type=int,default=6,choices=range(10),help="Gzip compression level of the fastq files, from 0 (stored, not compressed) to 9. Only used with --fastq. Defaults to 6.")
+    parser.add_argument('--compress_threads',type=int,default=1,help="Number of threads compressing the fastq files. Only used with --fastq. Defaults to 1.")
+    parser.add_argument('--max_pending',type=int,default=1000000,help="Maximum number of reads waiting for their mate. Only used with --fastq. Defaults to 1000000.")
+    parser.add_argument('--barcode_mismatches',type=int,default=None,help="Correct the barcodes with at most this number of substitutions from a single valid barcode and save the reads per cell in <bam_out>_barcodes.tsv. Defaults to None (exact barcodes, no report).")
+    parser.add_argument('--barcode_index',action='store_true',help="Read only the records of the selected cells through a barcode index of each input .bam file (<bam>.bci), built on first use.")
     o = parser.parse_args()
 
-    CT = pandas.read_csv(o.condition_csv)
-    if o.name_part_filter is not None:
-        CT = CT.loc[CT[o.condition_name_col].str.contains(o.name_part_filter),:]
-    tag_to_name = dict(zip(CT.loc[:,o.condition_tag_col], CT.loc[:,o.condition_name_col].astype(str)))
-
-    bam_in = pysam.AlignmentFile(o.bam_in, "rb",check_sq=False)
-    name_to_bam = {name:pysam.AlignmentFile(o.bam_out + name + '.bam', "wb", template=bam_in) for name in set(tag_to_name.values())}
-
-    for aln in tqdm.tqdm(bam_in.fetch(until_eof=True)):
-        barcode = aln.get_tag(o.bam_tag_flag)
-        if barcode in tag_to_name.keys():
-            name_to_bam[tag_to_name[barcode]].write(aln)
+    tag_to_name = read_condition_file(o.condition_csv,o.condition_tag_col,o.condition_name_col,o.name_part_filter)
+    split_tags = tag_to_name
+    count_barcodes = o.barcode_mismatches is not None
+    if count_barcodes:
+        # Neighbours of all the barcodes of the plate, so that no read is moved to another cell
+        barcodes = read_condition_file(o.condition_csv,o.condition_tag_col,o.condition_name_col)
+        corrections, ambiguous = barcode_neighbours(barcodes,o.barcode_mismatches)
+        split_tags = {seq:tag_to_name[bc] for seq,bc in corrections.items() if bc in tag_to_name}
+    if o.fastq:
+        result = split_bam_to_fastq([o.bam_in] + o.append_bam,o.bam_out,split_tags,o.bam_tag_flag,
+                                    o.threads,o.max_pending,compress_level=o.compress_level,
+                                    compress_threads=o.compress_threads,
+                                    barcode_index=o.barcode_index,count_barcodes=count_barcodes)
+        if count_barcodes:
+            save_barcode_report(o.bam_out,result[3],tag_to_name,corrections,ambiguous)
+        sys.exit(0)
+    jobs = [(o.bam_in,o.bam_out)] + [tuple(extra) for extra in o.extra_bam]
+    jobs = [(bam_in,bam_out,split_tags,o.bam_tag_flag,o.threads,i,o.max_open_files,o.barcode_index,
+             count_barcodes) for i,(bam_in,bam_out) in enumerate(jobs)]
+    if len(jobs)==1:
+        results = [split_bam(*jobs[0])]
+    else:
+        # One process per input file, so that the output per cell keeps the order of each input
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results = pool.starmap(split_bam,jobs)
+    if count_barcodes:
+        for job,result in zip(jobs,results):
+            save_barcode_report(job[1],result[3],tag_to_name,corrections,ambiguous)
@@ -7,16 +7,17 @@
 # Define the help function
 function help {
   # Print the usage message
-  echo "Usage: $0 [INPUT_DIR][OUTPUT_DIR][NODES]"
+  echo "Usage: $0 [INPUT_DIR][OUTPUT_DIR][NODES][CELLS...]"
   echo "Converts all of the .bam files in INPUT_DIR into fastq files for the
         Aligned and unmapped directories. Then concatenates the 2 fastqfiles of the
-        same cell."
+        same cell. The time, size and reads of each cell are saved in OUTPUT_DIR_log.tsv."
   echo ""
   # Print a description of the script's parameters
   echo "Parameters:"
   echo "  INPUT_DIR     Relative path to the directory containing the single-cell .bam files."
   echo "  OUTPUT_DIR    Relative path to the directory where the fastq files will be saved."
   echo "  NODES         Number of nodes for samtools."
+  echo "  CELLS         Names of the cells to convert. Defaults to all cells in INPUT_DIR/Aligned."
   echo ""
   # Print the list of options
   echo "Options:"
@@ -32,38 +33,82 @@ fi
 INPUT_DIR=$1
 OUTPUT_DIR=$2
 NODES=$3
+shift 3
+if [ $# -gt 0 ]; then
+  CELLS=$@
+else
+  CELLS=$(for FILE in ${INPUT_DIR}Aligned/*.bam;do basename $FILE .bam; done)
+fi
 
 TEMP_DIR=${OUTPUT_DIR}__temporary_fastq__
-mkdir $TEMP_DIR
-mkdir $TEMP_DIR/__Aligned__
-mkdir $TEMP_DIR/__unmapped__
+mkdir -p $TEMP_DIR/__Aligned__
+mkdir -p $TEMP_DIR/__unmapped__
 echo "Created temporary folders"
-for FILE in ${INPUT_DIR}Aligned/*.bam;do
-  NAME=$(basename $FILE .bam)
+# A failure of samtools sort in the pipes fails the cell, not only one of samtools fastq
+set -o pipefail
+# Log of each cell, with the same columns as the logs of bin/scheduler.py. The CPU time of the
+# finished children is given by the 'times' builtin, that has to run in this shell (not in a
+# pipe or subshell). The peak memory is not available in bash and is left empty
+LOG=${OUTPUT_DIR%/}_log.tsv
+printf "cell\tstatus\treturn_code\tstart\tseconds\tcpu_seconds\tmax_rss_mb\tinput_mb\toutput_mb\treads\n" > $LOG
+CHILDREN_CPU='NR==2 {split($1,u,/[ms]/); split($2,s,/[ms]/); print u[1]*60+u[2]+s[1]*60+s[2]}'
+FAILED=0
+for NAME in $CELLS;do
+  START=$(date +%s.%N)
+  times > $TEMP_DIR/times
+  CPU_START=$(awk "$CHILDREN_CPU" $TEMP_DIR/times)
+  FILE=${INPUT_DIR}Aligned/${NAME}.bam
+  CODE=0
   # Create fastq files for the aligned bams
   echo "Creating aligned fastq files for cell "$NAME
   samtools sort -n $FILE | samtools fastq --threads $NODES \
   -1 $TEMP_DIR/__Aligned__/${NAME}_R1.fastq.gz \
   -2 $TEMP_DIR/__Aligned__/${NAME}_R2.fastq.gz \
-  -0 /dev/null -s /dev/null
+  -0 /dev/null -s /dev/null 2> $TEMP_DIR/${NAME}_fastq.err || CODE=$?
   # Create fastq files for the unmapped files
-  echo "Creating unmapped fastq files for cell "$NAME
-  samtools sort -n ${INPUT_DIR}unmapped/${NAME}.bam | samtools fastq --threads $NODES \
-  -1 $TEMP_DIR/__unmapped__/${NAME}_R1.fastq.gz \
-  -2 $TEMP_DIR/__unmapped__/${NAME}_R2.fastq.gz \
-  -0 /dev/null -s /dev/null
-  # Concatenate Aligned and unmapped fastq files
-  mkdir ${OUTPUT_DIR}${NAME}
-  cat $TEMP_DIR/__Aligned__/${NAME}_R1.fastq.gz > ${OUTPUT_DIR}${NAME}/${NAME}_R1.fastq.gz
-  cat $TEMP_DIR/__Aligned__/${NAME}_R2.fastq.gz > ${OUTPUT_DIR}${NAME}/${NAME}_R2.fastq.gz
-  cat $TEMP_DIR/__unmapped__/${NAME}_R1.fastq.gz >> ${OUTPUT_DIR}${NAME}/${NAME}_R1.fastq.gz
-  cat $TEMP_DIR/__unmapped__/${NAME}_R2.fastq.gz >> ${OUTPUT_DIR}${NAME}/${NAME}_R2.fastq.gz
-  echo "Concatenated Aligned and unmapped for cell "$NAME
+  if (( ! CODE ));then
+    echo "Creating unmapped fastq files for cell "$NAME
+    samtools sort -n ${INPUT_DIR}unmapped/${NAME}.bam | samtools fastq --threads $NODES \
+    -1 $TEMP_DIR/__unmapped__/${NAME}_R1.fastq.gz \
+    -2 $TEMP_DIR/__unmapped__/${NAME}_R2.fastq.gz \
+    -0 /dev/null -s /dev/null 2>> $TEMP_DIR/${NAME}_fastq.err || CODE=$?
+  fi
+  # Concatenate Aligned and unmapped fastq files, moving them in place only when complete
+  if (( ! CODE ));then
+    mkdir -p ${OUTPUT_DIR}${NAME} && \
+    cat $TEMP_DIR/__Aligned__/${NAME}_R1.fastq.gz $TEMP_DIR/__unmapped__/${NAME}_R1.fastq.gz \
+    > $TEMP_DIR/${NAME}_R1.fastq.gz && \
+    cat $TEMP_DIR/__Aligned__/${NAME}_R2.fastq.gz $TEMP_DIR/__unmapped__/${NAME}_R2.fastq.gz \
+    > $TEMP_DIR/${NAME}_R2.fastq.gz && \
+    mv $TEMP_DIR/${NAME}_R1.fastq.gz ${OUTPUT_DIR}${NAME}/${NAME}_R1.fastq.gz && \
+    mv $TEMP_DIR/${NAME}_R2.fastq.gz ${OUTPUT_DIR}${NAME}/${NAME}_R2.fastq.gz || CODE=$?
+  fi
+  if (( CODE ));then
+    echo "Failed to convert cell $NAME (exit code $CODE), its fastq files are left unchanged" >&2
+    STATUS=failure
+    FAILED=1
+  else
+    echo "Concatenated Aligned and unmapped for cell "$NAME
+    STATUS=success
+  fi
   echo "======================================================================"
-  rm $TEMP_DIR/__Aligned__/${NAME}_R1.fastq.gz
-  rm $TEMP_DIR/__Aligned__/${NAME}_R2.fastq.gz
-  rm $TEMP_DIR/__unmapped__/${NAME}_R1.fastq.gz
-  rm $TEMP_DIR/__unmapped__/${NAME}_R2.fastq.gz
+  rm -f $TEMP_DIR/__Aligned__/${NAME}_R[12].fastq.gz $TEMP_DIR/__unmapped__/${NAME}_R[12].fastq.gz \
+  $TEMP_DIR/${NAME}_R[12].fastq.gz
+  # Read pairs, as half the reads processed by both samtools fastq (without secondary and
+  # supplementary alignments), taken from their messages instead of reading the bam files again
+  cat $TEMP_DIR/${NAME}_fastq.err >&2
+  READS=$(awk '/processed [0-9]+ reads/ {n += $3} END {print int(n/2)}' $TEMP_DIR/${NAME}_fastq.err)
+  rm -f $TEMP_DIR/${NAME}_fastq.err
+  times > $TEMP_DIR/times
+  CPU=$(awk "$CHILDREN_CPU" $TEMP_DIR/times)
+  SECONDS_CELL=$(awk "BEGIN {print $(date +%s.%N) - $START}")
+  OUTPUTS="${OUTPUT_DIR}${NAME}/${NAME}_R1.fastq.gz ${OUTPUT_DIR}${NAME}/${NAME}_R2.fastq.gz"
+  INPUT_MB=$(stat -c %s $FILE ${INPUT_DIR}unmapped/${NAME}.bam | awk '{s += $1} END {print s/2^20}')
+  OUTPUT_MB=$(stat -c %s $OUTPUTS 2>/dev/null | awk '{s += $1} END {print s/2^20}')
+  printf "%s\t%s\t%d\t%s\t%.1f\t%.1f\t\t%.1f\t%.1f\t%d\n" $NAME $STATUS $CODE \
+  "$(date -d @${START%.*} '+%Y-%m-%d %H:%M:%S')" $SECONDS_CELL $(awk "BEGIN {print $CPU - $CPU_START}") \
+  $INPUT_MB $OUTPUT_MB $READS >> $LOG
 done
 rm -rf $TEMP_DIR
 echo "Deleted temporary folders"
+exit $FAILED
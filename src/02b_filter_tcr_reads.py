@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================================
+# 02b_filter_tcr_reads.py
+# Author: Juan Sebastian Diaz Boada
+# juan.sebastian.diaz.boada@ki.se
+# Creation Date: 18/10/26
+# =============================================================================================
+""" Keeps only the read pairs of a cell that can come from the TCR loci.
+
+    Reads the fastq files of a cell written by step 2 and writes the read pairs with a mate
+    aligned over the TCR loci (from the .bam file of the aligned reads of the cell in step 1) or
+    sharing a k-mer with the V, J and C sequences of the TCR genes. Both mates of a pair are kept
+    or discarded together. The output has the same layout as the input, so that step 3 runs on it.
+
+    Parameters
+    ----------
+    fastq_in : string
+        Path to the folder with the fastq files of the cells, as <fastq_in>/<cell>/<cell>_R1.fastq.gz.
+    fastq_out : string
+        Path to the folder where the filtered fastq files are saved, with the same layout.
+    cell : string
+        Name of the cell.
+    reference : list of strings
+        Fasta files, or folders with .fa and .fasta files, with the V, J and C sequences.
+    bam_in : string, optional
+        Path to the folder with the split .bam files of step 1, as <bam_in>/Aligned/<cell>.bam.
+        Defaults to None, using only the k-mers.
+    loci : string, optional
+        .bed file with the coordinates of the TCR loci in the genome the reads were aligned to.
+        Defaults to 'bin/tcr_loci_GRCh38.bed'.
+    k : int, optional
+        Length of the k-mers. Defaults to 25.
+    step : int, optional
+        Distance between the k-mers looked up in each read. Defaults to 4.
+    compress_level : int, optional
+        Gzip compression level of the filtered fastq files, from 0 (stored, not compressed) to 9.
+        Defaults to 1.
+
+"""
+import os,sys
+import argparse
+
+module_path = os.path.abspath('bin')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from tcr_filter import read_loci, locus_read_names, KmerIndex, filter_read_pairs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fastq_in',type=str,help="Path to the folder with the fastq files of the cells.")
+    parser.add_argument('fastq_out',type=str,help="Path to the folder where the filtered fastq files are saved.")
+    parser.add_argument('cell',type=str,help="Name of the cell.")
+    parser.add_argument('--reference',type=str,nargs='+',required=True,help="Fasta files, or folders with .fa and .fasta files, with the V, J and C sequences.")
+    parser.add_argument('--bam_in',type=str,default=None,help="Path to the folder with the split .bam files of step 1. Defaults to None, using only the k-mers.")
+    parser.add_argument('--loci',type=str,default='bin/tcr_loci_GRCh38.bed',help="Bed file with the coordinates of the TCR loci. Defaults to 'bin/tcr_loci_GRCh38.bed'.")
+    parser.add_argument('--k',type=int,default=25,help="Length of the k-mers. Defaults to 25.")
+    parser.add_argument('--step',type=int,default=4,help="Distance between the k-mers looked up in each read. Defaults to 4.")
+    parser.add_argument('--compress_level',type=int,default=1,choices=range(10),help="Gzip compression level of the filtered fastq files. Defaults to 1.")
+    o = parser.parse_args()
+
+    fasta_files = []
+    for path in o.reference:
+        if os.path.isdir(path):
+            fasta_files.extend(sorted(os.path.join(path,f) for f in os.listdir(path) \
+                                      if f.endswith(('.fa','.fasta'))))
+        else:
+            fasta_files.append(path)
+    if not fasta_files:
+        sys.exit("No fasta files found in {}".format(o.reference))
+    index = KmerIndex(fasta_files,o.k,o.step)
+    names = frozenset()
+    if o.bam_in is not None:
+        names = locus_read_names(os.path.join(o.bam_in,'Aligned',o.cell + '.bam'),read_loci(o.loci))
+    fastq_ins = [os.path.join(o.fastq_in,o.cell,o.cell + suffix) for suffix in ('_R1.fastq.gz','_R2.fastq.gz')]
+    os.makedirs(os.path.join(o.fastq_out,o.cell),exist_ok=True)
+    fastq_outs = [os.path.join(o.fastq_out,o.cell,o.cell + suffix) for suffix in ('_R1.fastq.gz','_R2.fastq.gz')]
+    n_pairs, n_kept = filter_read_pairs(fastq_ins,fastq_outs,index,names,o.compress_level)
+    print("{}: kept {} of {} read pairs ({:.2f}%), {} reads aligned over the TCR loci".format(
+          o.cell,n_kept,n_pairs,100*n_kept/max(n_pairs,1),len(names)))
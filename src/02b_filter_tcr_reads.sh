@@ -0,0 +1,54 @@
+#!/bin/bash
+# ============================================================================ #
+# 02b_filter_tcr_reads.sh                                                      #
+# Author: Juan Sebastian Diaz Boada                                            #
+# Creation Date: 18/10/2026                                                    #
+# ============================================================================ #
+# Define the help function
+function help {
+  # Print the usage message
+  echo "Usage: $0 [INPUT_DIR][OUTPUT_DIR][NODES][REFERENCE][BAM_DIR]"
+  echo "Keeps only the read pairs of each cell that can come from the TCR loci, several cells at a time."
+  echo "The cells already filtered from the same fastq files (with a marker in OUTPUT_DIR_done/) are skipped."
+  echo "If the variable DRY_RUN is set, only prints the cells that would be filtered."
+  echo ""
+  # Print a description of the script's parameters
+  echo "Parameters:"
+  echo "  INPUT_DIR     Relative path to the directory containing the single-cell folders with fastq files."
+  echo "  OUTPUT_DIR    Relative path to the directory where the filtered fastq files will be saved."
+  echo "  NODES         Number of cells filtered at the same time."
+  echo "  REFERENCE     Fasta file, or folder with .fa files, with the V, J and C sequences of the TCR genes."
+  echo "  BAM_DIR       Relative path to the directory with the split .bam files of step 1, to also keep"
+  echo "                the reads aligned over the TCR loci of bin/tcr_loci_GRCh38.bed. Optional."
+  echo ""
+  # Print the list of options
+  echo "Options:"
+  echo "  -h, --help        display this help and exit"
+  # Exit with a success status code
+  exit 0
+}
+# Parse the options and arguments
+if [ "$1" = "-h" ] || [ "$1" = "--help" ]; then
+  help
+fi
+# ---------------------------------------------------------------------------- #
+INPUT_DIR=$1
+OUTPUT_DIR=$2
+NODES=$3
+REFERENCE=$4
+BAM_DIR=$5
+if [ -n "$BAM_DIR" ];then
+  BAM_INPUT="${BAM_DIR%/}/Aligned/{cell}.bam"
+  BAM_OPTION="--bam_in $BAM_DIR"
+fi
+
+shopt -s nullglob
+CELLS=$(for DIR in ${INPUT_DIR}/*;do basename $DIR; done)
+# The log of each cell is saved in OUTPUT_DIR_logs/ and the summary in OUTPUT_DIR_log.tsv, with
+# the read pairs of the cell taken from the line of its log with the pairs kept
+python3 bin/scheduler.py --cells $CELLS --cores $NODES --threads_per_job 1 \
+--log ${OUTPUT_DIR%/}_log.tsv --out_dir ${OUTPUT_DIR%/}_logs ${DRY_RUN:+--dry_run} \
+--marker_dir ${OUTPUT_DIR%/}_done --reads_log ${OUTPUT_DIR%/}_logs/{cell}.log 'kept [0-9]+ of ([0-9,]+) read pairs' \
+--inputs ${INPUT_DIR}/{cell}/{cell}_R1.fastq.gz ${INPUT_DIR}/{cell}/{cell}_R2.fastq.gz $REFERENCE $BAM_INPUT \
+--outputs $OUTPUT_DIR{cell}/{cell}_R1.fastq.gz $OUTPUT_DIR{cell}/{cell}_R2.fastq.gz -- \
+"python3 src/02b_filter_tcr_reads.py $INPUT_DIR $OUTPUT_DIR {cell} --reference $REFERENCE $BAM_OPTION"
@@ -7,14 +7,17 @@
 # Define the help function
 function help {
   # Print the usage message
-  echo "Usage: $0 [INPUT_DIR][OUTPUT_DIR][NODES]"
-  echo "Runs TrimGalore over all cell fastq files."
+  echo "Usage: $0 [INPUT_DIR][OUTPUT_DIR][NODES][CELL_NODES]"
+  echo "Runs TrimGalore over all cell fastq files, several cells at a time."
+  echo "The cells already trimmed from the same fastq files (with a marker in OUTPUT_DIR_done/) are skipped."
+  echo "If the variable DRY_RUN is set, only prints the cells that would be trimmed."
   echo ""
   # Print a description of the script's parameters
   echo "Parameters:"
   echo "  INPUT_DIR     Relative path to the directory containing the single-cell folders with fastq files."
   echo "  OUTPUT_DIR    Relative path to the directory where the trimmed fastq files will be saved."
-  echo "  NODES         Number of nodes for TrimGalore."
+  echo "  NODES         Total number of nodes for TrimGalore."
+  echo "  CELL_NODES    Number of nodes for each cell. Defaults to NODES (one cell at a time)."
   echo ""
   # Print the list of options
   echo "Options:"
@@ -30,17 +33,18 @@ fi
 INPUT_DIR=$1
 OUTPUT_DIR=$2
 NODES=$3
+CELL_NODES=${4:-$NODES}
 
-for DIR in ${INPUT_DIR}/*;do
-  CELL=$(basename $DIR)
-  echo "======================================================================="
-  # Create cell folder if not existing
-  if [ ! -d $OUTPUT_DIR$CELL ];then
-    mkdir $OUTPUT_DIR$CELL
-    echo "Created folder for cell $CELL"
-  else
-    echo "Writting on existing directory $OUTPUT_DIR$CELL"
-  fi
-  trim_galore --paired ${INPUT_DIR}/${CELL}/${CELL}_R1.fastq.gz ${INPUT_DIR}/${CELL}/${CELL}_R2.fastq.gz -o $OUTPUT_DIR$CELL --cores $NODES
-  echo "Trimmed cell $CELL successfully"
-done
+shopt -s nullglob
+CELLS=$(for DIR in ${INPUT_DIR}/*;do basename $DIR; done)
+# The log of each cell is saved in OUTPUT_DIR_logs/ and the summary in OUTPUT_DIR_log.tsv, with
+# the read pairs of the cell taken from the trimming report of its R1 file
+python3 bin/scheduler.py --cells $CELLS --cores $NODES --threads_per_job $CELL_NODES \
+--log ${OUTPUT_DIR%/}_log.tsv --out_dir ${OUTPUT_DIR%/}_logs ${DRY_RUN:+--dry_run} \
+--marker_dir ${OUTPUT_DIR%/}_done \
+--reads_log $OUTPUT_DIR{cell}/{cell}_R1.fastq.gz_trimming_report.txt 'Total reads processed: *([0-9,]+)' \
+--inputs ${INPUT_DIR}/{cell}/{cell}_R1.fastq.gz ${INPUT_DIR}/{cell}/{cell}_R2.fastq.gz \
+--outputs $OUTPUT_DIR{cell}/{cell}_R1_val_1.fq.gz $OUTPUT_DIR{cell}/{cell}_R2_val_2.fq.gz -- \
+"mkdir -p $OUTPUT_DIR{cell} && \
+trim_galore --paired ${INPUT_DIR}/{cell}/{cell}_R1.fastq.gz ${INPUT_DIR}/{cell}/{cell}_R2.fastq.gz \
+-o $OUTPUT_DIR{cell} --cores {threads}"
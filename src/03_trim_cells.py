@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =============================================================================================
+# 03_trim_cells.py
+# Author: Juan Sebastian Diaz Boada
+# juan.sebastian.diaz.boada@ki.se
+# Creation Date: 18/10/2026
+# =============================================================================================
+""" Trims the adapters and low quality ends of the fastq files of all cells in one process pool.
+
+    Alternative to '03_run_trim_galore.sh' that approximates the default paired-end trimming of
+    TrimGalore in python (see bin/trimming.py), without starting TrimGalore for every cell. It is
+    not equivalent: the adapter is matched with mismatches only, so the reads with an insertion or
+    deletion in the adapter keep it (see bench/bench_trimming.py). Writes files with the same
+    names, '<cell>_R1_val_1.fq.gz' and '<cell>_R2_val_2.fq.gz', the same log and completion
+    markers, and the trimming stats of all cells in one table.
+
+    Parameters
+    ----------
+    in_dir : string
+        Path to the folder with the fastq files of the cells, as <in_dir>/<cell>/<cell>_R1.fastq.gz.
+    out_dir : string
+        Path to the folder where the trimmed fastq files are saved. The log of the cells is saved
+        in <out_dir>_log.tsv, their trimming stats in <out_dir>_trim_stats.tsv and their
+        completion markers in <out_dir>_done/.
+    processes : int, optional
+        Number of cells trimmed at the same time. Defaults to 1.
+    cells : list of strings, optional
+        Names of the cells. Defaults to all the folders in 'in_dir'.
+    adapter : string, optional
+        'Illumina', 'Nextera', 'smallRNA' or the sequence of the adapter. Defaults to None,
+        detecting it in each cell as TrimGalore does.
+    quality : int, optional
+        Phred quality cutoff for the 3' ends. Defaults to 20.
+    length : int, optional
+        Minimum length of both mates for a pair to be kept. Defaults to 20.
+    error_rate : float, optional
+        Maximum fraction of mismatches with the adapter. Defaults to 0.1.
+    stringency : int, optional
+        Minimum overlap with the adapter at the 3' end. Defaults to 1.
+    compress_level : int, optional
+        Gzip compression level of the trimmed fastq files. Defaults to 6.
+    dry_run : bool, optional
+        Only print the cells that would be trimmed.
+
+"""
+import os,sys
+import argparse
+
+module_path = os.path.abspath('bin')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from trimming import trim_cells
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('in_dir',type=str,help="Path to the folder with the fastq files of the cells.")
+    parser.add_argument('out_dir',type=str,help="Path to the folder where the trimmed fastq files are saved.")
+    parser.add_argument('--processes',type=int,default=1,help="Number of cells trimmed at the same time. Defaults to 1.")
+    parser.add_argument('--cells',type=str,nargs='*',default=None,help="Names of the cells. Defaults to all the folders in in_dir.")
+    parser.add_argument('--adapter',type=str,default=None,help="'Illumina', 'Nextera', 'smallRNA' or the sequence of the adapter. Defaults to None, detecting it in each cell.")
+    parser.add_argument('--quality',type=int,default=20,help="Phred quality cutoff for the 3' ends. Defaults to 20.")
+    parser.add_argument('--length',type=int,default=20,help="Minimum length of both mates for a pair to be kept. Defaults to 20.")
+    parser.add_argument('--error_rate',type=float,default=0.1,help="Maximum fraction of mismatches with the adapter. Defaults to 0.1.")
+    parser.add_argument('--stringency',type=int,default=1,help="Minimum overlap with the adapter at the 3' end. Defaults to 1.")
+    parser.add_argument('--compress_level',type=int,default=6,choices=range(10),help="Gzip compression level of the trimmed fastq files. Defaults to 6.")
+    parser.add_argument('--dry_run',action='store_true',help="Only print the cells that would be trimmed.")
+    o = parser.parse_args()
+
+    cells = o.cells
+    if cells is None:
+        cells = sorted(d for d in os.listdir(o.in_dir) if os.path.isdir(os.path.join(o.in_dir,d)))
+    prefix = o.out_dir.rstrip('/')
+    results = trim_cells(cells,o.in_dir,o.out_dir,o.processes,log_file=prefix + '_log.tsv',
+                         stats_file=prefix + '_trim_stats.tsv',marker_dir=prefix + '_done',
+                         dry_run=o.dry_run,adapter=o.adapter,quality=o.quality,length=o.length,
+                         error_rate=o.error_rate,stringency=o.stringency,
+                         compress_level=o.compress_level)
+    sys.exit(int(any(stats is None for stats in results.values())))
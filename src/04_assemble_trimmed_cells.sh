@@ -7,15 +7,24 @@
 # Define the help function
 function help {
   # Print the usage message
-  echo "Usage: $0 [INPUT_DIR][OUTPUT_DIR][NODES][LOCI]"
-  echo "Runs TraCeR over all trimmed fastq files."
+  echo "Usage: $0 [INPUT_DIR][OUTPUT_DIR][NODES][LOCI][CELL_NODES]"
+  echo "Runs TraCeR over all trimmed fastq files, several cells at a time."
+  echo "The cells already assembled from the same fastq files (with a marker in OUTPUT_DIR_done/) are skipped."
+  echo "If the variable DRY_RUN is set, only prints the cells that would be assembled."
+  echo "If the variable TRACER_CACHE is set, the index of the base transcriptome is built once in"
+  echo "that folder (see bin/tracer_cache.py) and shared by all cells with 'tracer assemble --small_index'."
   echo ""
   # Print a description of the script's parameters
   echo "Parameters:"
   echo "  INPUT_DIR     Relative path to the directory containing the trimmed fastq files."
   echo "  OUTPUT_DIR    Relative path to the directory where the TCR files will be saved."
-  echo "  NODES         Number of nodes for TraCeR."
+  echo "                With LOCI 'ABGD', the TCRs are saved in the subfolders AB/ and GD/."
+  echo "  NODES         Total number of nodes for TraCeR."
   echo "  LOCI          'AB' for assembling alpha-beta chains and 'GD' for assembling gamma-delta chains."
+  echo "                'ABGD' assembles both at the same time for each cell, reading its fastq files once."
+  echo "  CELL_NODES    Number of nodes for each cell. Defaults to NODES (one cell at a time)."
+  echo "                The cells running at the same time also fit in the memory of the node"
+  echo "                with max_jellyfish_memory each, as set in TRACER_CONF."
   echo ""
   # Print the list of options
   echo "Options:"
@@ -31,22 +40,48 @@ fi
 INPUT_DIR=$1
 OUTPUT_DIR=$2
 NODES=$3
+CELL_NODES=${5:-$NODES}
+TRACER_CONF=${TRACER_CONF:-bin/tracer.conf}
 
+# The shared index is built by the first run needing it and only read by the cells
+if [ -n "$TRACER_CACHE" ] && [ -z "$DRY_RUN" ]; then
+  TRACER_CONF=$(python3 bin/tracer_cache.py $TRACER_CONF Hsap $TRACER_CACHE --threads $NODES) || exit 1
+  export TRACER_CONF
+  SMALL_INDEX="--small_index"
+fi
+
+FASTQ="${INPUT_DIR}{cell}/{cell}_R1_val_1.fq.gz ${INPUT_DIR}{cell}/{cell}_R2_val_2.fq.gz"
 if [ $4 == "AB" ]; then
-  LOCI="A B"
+  PROCESSES=1
+  OUTPUTS="${OUTPUT_DIR%/}/{cell}"
+  QUANT="${OUTPUT_DIR%/}/{cell}"
+  COMMAND="tracer assemble --loci A B -p {threads} -s Hsap $SMALL_INDEX $FASTQ {cell} $OUTPUT_DIR"
 elif [ $4 == "GD" ]; then
-  LOCI="G D"
+  PROCESSES=1
+  OUTPUTS="${OUTPUT_DIR%/}/{cell}"
+  QUANT="${OUTPUT_DIR%/}/{cell}"
+  COMMAND="tracer assemble --loci G D -p {threads} -s Hsap $SMALL_INDEX $FASTQ {cell} $OUTPUT_DIR"
+elif [ $4 == "ABGD" ]; then
+  # Both assemblies of a cell run together, so the second one reads the fastq files from cache
+  PROCESSES=2
+  OUTPUTS="${OUTPUT_DIR%/}/AB/{cell} ${OUTPUT_DIR%/}/GD/{cell}"
+  QUANT="${OUTPUT_DIR%/}/AB/{cell}"
+  mkdir -p ${OUTPUT_DIR%/}/AB/ ${OUTPUT_DIR%/}/GD/
+  COMMAND="tracer assemble --loci A B -p {threads} -s Hsap $SMALL_INDEX $FASTQ {cell} ${OUTPUT_DIR%/}/AB & \
+PID=\$!; tracer assemble --loci G D -p {threads} -s Hsap $SMALL_INDEX $FASTQ {cell} ${OUTPUT_DIR%/}/GD; \
+GD=\$?; wait \$PID; AB=\$?; exit \$(( AB || GD ))"
 else
-  echo "Invalid loci. It has to be either AB or GD"
+  echo "Invalid loci. It has to be either AB, GD or ABGD"
   exit 1
 fi
 
-for DIR in ${INPUT_DIR}*;do
-  CELL=$(basename $DIR)
-  R1=${DIR}/${CELL}_R1_val_1.fq.gz
-  R2=${DIR}/${CELL}_R2_val_2.fq.gz
-  echo "================================================================="
-  echo "Running TraCeR for cell $CELL"
-  echo "================================================================="
-  tracer assemble --loci $LOCI -p $NODES -s Hsap $R1 $R2 $CELL $OUTPUT_DIR
-done
+shopt -s nullglob
+CELLS=$(for DIR in ${INPUT_DIR}*/;do basename $DIR; done)
+# The log of each cell is saved in OUTPUT_DIR_logs/ and the summary in OUTPUT_DIR_log.tsv, with
+# the read pairs of the cell taken from the kallisto quantification run by TraCeR
+python3 bin/scheduler.py --cells $CELLS --cores $NODES --threads_per_job $CELL_NODES \
+--processes_per_cell $PROCESSES --tracer_conf $TRACER_CONF \
+--log ${OUTPUT_DIR%/}_log.tsv --out_dir ${OUTPUT_DIR%/}_logs ${DRY_RUN:+--dry_run} \
+--marker_dir ${OUTPUT_DIR%/}_done \
+--reads_log $QUANT/expression_quantification/run_info.json '"n_processed": *([0-9]+)' \
+--inputs $FASTQ --outputs $OUTPUTS -- "$COMMAND"
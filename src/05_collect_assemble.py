@@ -15,12 +15,13 @@
         the new convention Plate-tissue-well. For more details on the directory structure see
         README.md in this folder.
     out_file : string.
-        Path and name of the output dataframe in .csv, tsv or xlsx form.
+        Path and name of the output dataframe in .csv, .tsv, .xlsx, .parquet or .feather form.
+    threads : int, optional.
+        Number of TraCeR files read at the same time. Defaults to 16.
 
 """
 import os,sys
 import argparse
-import pandas as pd
 
 module_path = os.path.abspath('bin')
 if module_path not in sys.path:
@@ -28,71 +29,47 @@ if module_path not in sys.path:
 
 from objects import Cell, Chain
 from objects import AlphaChain, BetaChain, GammaChain, DeltaChain
-from objects import create_cell_from_AB, append_GD_data
+from objects import read_tracer_output, merge_GD_data, cells_to_dataframe
+from data_functions import export_dataframe
 
 parser = argparse.ArgumentParser(description='in and out paths')
 parser.add_argument('in_path', type=str, help='Path of the data folder.')
 parser.add_argument('out_file', type=str, help='Path of the output dataset.')
+parser.add_argument('--threads', type=int, default=16, help='Number of files read at the same time.')
 args = parser.parse_args()
 in_path = args.in_path
-AB_path = os.path.join(in_path,os.path.normpath('AB'))
-GD_path = os.path.join(in_path,os.path.normpath('GD'))
-# Loop over AB
+# Read AB and GD files in parallel
 print("#######################################################################")
-print("Starting alpha-beta files reading...")
+print("Starting alpha-beta and gamma-delta files reading...")
 print("#######################################################################")
+AB,GD = read_tracer_output(in_path,args.threads)
+# Merge AB and GD, in the order of the cell folders
 cells = {}
-cont = 1
-L = len(os.listdir(AB_path))
-for folder in os.listdir(AB_path):
-    file = os.path.join(AB_path,folder,os.path.normpath('filtered_TCR_seqs/filtered_TCRs.txt'))
-    try:
-        if os.path.exists(file):
-            cell = create_cell_from_AB(file)
-        else:
-            cell = Cell(folder)
-    except Exception as exc:
+for folder,(cell,exc) in AB.items():
+    if exc is not None:
         print(f"Invalid or malformed Tracer output for cell {folder}")
         print(f"{exc}")
         continue
-    print("Cell {}, {}/{}".format(cell.name,cont,L))
+    if cell is None:
+        cell = Cell(folder)
     cells[cell.name] = cell
-    cont = cont + 1
-# Loop over GD
-print("#######################################################################")
-print("Starting gamma-delta files reading...")
-print("#######################################################################")
-cont = 1
-L = len(os.listdir(GD_path))
-for folder in os.listdir(GD_path):
-    file = os.path.join(GD_path,folder,os.path.normpath('filtered_TCR_seqs/filtered_TCRs.txt'))
-    if os.path.exists(file):
-        append_GD_data(file,cells)
-    print("Cell {}, {}/{}".format(folder,cont,L))
-    cont = cont +1
+for folder,(cell,exc) in GD.items():
+    if exc is not None:
+        print(f"Invalid or malformed gamma-delta Tracer output for cell {folder}")
+        print(f"{exc}")
+    elif cell is not None:
+        if cell.name in cells:
+            merge_GD_data(cell,cells)
+        else:
+            print(f"Gamma-delta Tracer output for cell {folder} without alpha-beta output")
+print("Read {} cells, {} with gamma-delta output".format(len(cells),
+      sum(cell is not None for cell,_ in GD.values())))
 # Dataframe generation
 print("#######################################################################")
 print("Generating dataframe...")
 print("#######################################################################")
-DF = pd.DataFrame(index=cells.keys())
-cont = 1
-L = len(cells)
-for name,cell in cells.items():
-    print("Cell {}, {}/{}".format(name,cont,L))
-    chains = cell.A_chains + cell.B_chains + cell.G_chains + cell.D_chains
-    for chain in chains:
-        meta_colnames = [chain.allele + '_' + s for s in list(chain.__dict__.keys())][2:]
-        values = list(chain.__dict__.values())[2:]
-        DF.loc[name,meta_colnames] = values
-    cont = cont +1
+DF = cells_to_dataframe(cells)
+print("Dataset with {} cells and {} columns".format(*DF.shape))
 # Export dataset
-file_type = args.out_file.split('.')[-1]
-if file_type == 'tsv':
-    DF.to_csv(args.out_file,sep='\t')
-elif file_type == 'xlsx':
-    DF.to_excel(args.out_file)
-elif file_type == 'csv':
-    DF.to_csv(args.out_file,sep=',')
-else:
-    raise NameError("Invalid output format. Has to be either .tsv, .csv or .xlsx.")
+export_dataframe(DF,args.out_file)
 print("Dataset exported in {}".format(args.out_file))
@@ -18,7 +18,19 @@
         Path to the nested folder with the TCR datasets. A folder per plate and
         one dataset per folder is expected.
     out_file : string.
-        Path and name of the output dataframe in .csv, tsv or xlsx form.
+        Path and name of the output dataframe in .csv, .tsv, .xlsx, .parquet or .feather form.
+    --threads : int, optional.
+        Number of plates read and treated at the same time. Default is 8.
+    --fuzzy : int, optional.
+        Maximum number of edits (Levenshtein distance) between the CDR3 sequences of
+        clones grouped together in the additional 'group_fuzzy_clone_*' columns, to
+        join clones split by sequencing errors. Default is None, meaning no fuzzy
+        grouping.
+    --index : string, optional.
+        Folder of the persistent clone index (see bin/clone_index.py). Only the plates
+        that are new or have changed since the last run are treated, and the clones
+        keep the group numbers given in previous runs, new clones being numbered after
+        them. Default is None, meaning that the clones are grouped from scratch.
 """
 import os
 import sys
@@ -30,135 +42,140 @@ module_path = os.path.abspath('bin')
 if module_path not in sys.path:
     sys.path.append(module_path)
 
-from data_functions import read_dataframe, group_with_freq
-from data_functions import generate_clone_sets, concat_seqs_in_set
+from data_functions import read_dataframe, export_dataframe, group_multiple_with_freq
+from data_functions import generate_clone_keys, count_values, merge_counts, group_fuzzy_clones
+from data_functions import locus_summary, ALLELES
+from objects import chain_columns
+from clone_index import CloneIndex
+from tracker import signature, unchanged
+from concurrent.futures import ThreadPoolExecutor
 
 parser = argparse.ArgumentParser(description='in and out paths')
 parser.add_argument('in_path', type=str, help='Path of the data folder.')
 parser.add_argument('out_file', type=str, help='Path of the output dataset.')
+parser.add_argument('--threads', type=int, default=8, help='Number of plates read and treated at the same time.')
+parser.add_argument('--fuzzy', type=int, default=None, help='Also group the clones whose CDR3 sequences differ in at most this number of edits.')
+parser.add_argument('--index', type=str, default=None, help='Folder of the persistent clone index, to only treat new or changed plates and keep the group numbers.')
 args = parser.parse_args()
 in_path = args.in_path
+clone_cols = {'TCR_AB_nt':['A_1_CDR3nt','A_2_CDR3nt','B_1_CDR3nt','B_2_CDR3nt'],
+              'TCR_AB_aa':['A_1_CDR3aa','A_2_CDR3aa','B_1_CDR3aa','B_2_CDR3aa'],
+              'TCR_GD_nt':['G_1_CDR3nt','G_2_CDR3nt','D_1_CDR3nt','D_2_CDR3nt'],
+              'TCR_GD_aa':['G_1_CDR3aa','G_2_CDR3aa','D_1_CDR3aa','D_2_CDR3aa']}
 # ---------------------------------------------------------------------------- #
-# 1. MERGE DATASETS
-DF = pd.DataFrame()
-for plate in os.listdir(in_path):
-    if plate != '.gitkeep':
-        for file in os.listdir(os.path.join(in_path,plate)):
-            df = read_dataframe(os.path.join(in_path,plate,file))
-            df.insert(0,'Plate',plate)
-            DF = pd.concat([DF,df])
-del(df)
-# ---------------------------------------------------------------------------- #
-# 2. DATA TREATMENT
-# Replace Nans for zero in productive columns
-cols = DF.columns[DF.columns.str.endswith('productive')|DF.columns.str.endswith('stop_codon')|DF.columns.str.endswith('in_frame')]
-for i in cols:
-    DF.loc[:,i] = DF.loc[:,i].fillna(0).astype(int)
-# Fill missing data
-loci = ['A_1','A_2','B_1','B_2','G_1','G_2','D_1','D_2']
-for l in loci:
-    if not np.any(DF.columns.str.contains(l)):
-        DF.insert(len(DF.columns),l+'_productive',0)
-        DF.insert(len(DF.columns),l+'_TPM',np.nan)
-        DF.insert(len(DF.columns),l+'_stop_codon',0)
-        DF.insert(len(DF.columns),l+'_in_frame',0)
-        DF.insert(len(DF.columns),l+'_ID',np.nan)
-        DF.insert(len(DF.columns),l+'_CDR3nt',np.nan)
-        DF.insert(len(DF.columns),l+'_CDR3aa',np.nan)
-        DF.insert(len(DF.columns),l+'_V',np.nan)
-        DF.insert(len(DF.columns),l+'_J',np.nan)
-        if l in ['B_1','B_2','D_1','D_2']:
-            DF.insert(len(DF.columns),l+'_D',np.nan)
-# 1.3 Reorder columns
-loci = ['A_1','A_2','B_1','B_2','G_1','G_2','D_1','D_2']
-new_cols = list([DF.columns[0]])
-for l in loci:
-    new_cols = new_cols + list(DF.columns[DF.columns.str.startswith(l)])
-DF = DF[new_cols]
-# ---------------------------------------------------------------------------- #
-# 3. PRODUCTIVE COLUMNS
-# Productive dataframe
-P = DF.loc[:,DF.columns.str.endswith('productive')]
-P
-# Insert productive columns per loci
-loci = ['A','B','G','D']
-for l in loci:
-    if l in ['A','G']:
-        suffix = '_2_J'
-    elif l in ['B','D']:
-        suffix = '_2_D'
-    idx = int(np.where(DF.columns==l+suffix)[0][0])
-    DF.insert(idx+1,l+'_productive',P.loc[:,P.columns.str.startswith(l)].sum(axis=1))
-# Insert productive columns per loci pair
-idx = int(np.where(DF.columns=='B_productive')[0][0])
-DF.insert(idx+1,'AB_productive',P.iloc[:,:4].sum(axis=1))
-DF.insert(len(DF.columns),'GD_productive',P.iloc[:,4:8].sum(axis=1))
+# Sections 2 to 5 only need the rows of one plate, so each plate is treated on
+# its own (map) and only the counts of its TCRs are merged (reduce) to group
+# the clones of all plates together.
+def treat_plate(plate,file):
+    """ Reads the dataset of a plate, defines its TCRs and counts them."""
+    DF = read_dataframe(file)
+    DF.insert(0,'Plate',plate)
+    # ------------------------------------------------------------------------ #
+    # 2. DATA TREATMENT
+    # Flags as integers, replacing NaNs for zero (typed as boolean in .parquet and .feather inputs)
+    flags, counts, masked = locus_summary(DF)
+    # Fill missing loci and reorder columns
+    new_cols = ['Plate']
+    for l in ALLELES:
+        cols = [c for c in DF.columns if c.startswith(l)]
+        new_cols = new_cols + (cols if cols else chain_columns(l))
+    DF = DF.reindex(columns=new_cols)
+    DF[flags.columns] = flags
+    # ------------------------------------------------------------------------ #
+    # 3. PRODUCTIVE COLUMNS
+    # Productive chains per locus after each locus, and per pair of loci
+    for l,col in [('A','A_2_J'),('B','B_2_D'),('AB','B_productive'),('G','G_2_J'),('D','D_2_D')]:
+        DF.insert(DF.columns.get_loc(col)+1,l+'_productive',counts[l+'_productive'])
+    DF.insert(len(DF.columns),'GD_productive',counts['GD_productive'])
+    # ------------------------------------------------------------------------ #
+    # 4. MASKING SEQUENCES BY PRODUCTIVITY
+    # The masked CDR3 of the AB and GD alleles are given by locus_summary
+    # ------------------------------------------------------------------------ #
+    # 5. CLONE DEFINITION
+    masked = pd.concat([masked['ABnt'],masked['ABaa'],masked['GDnt'],masked['GDaa']],axis=1)
+    TCR = generate_clone_keys(masked,clone_cols)
+    for tcr in clone_cols.keys():
+        DF.insert(len(DF.columns),tcr,TCR[tcr].values)
+    return DF, count_values(DF,list(clone_cols.keys()))
 # ---------------------------------------------------------------------------- #
-# 4. MASKING SEQUENCES BY PRODUCTIVITY
-# CDR3 dataframes
-CDR3nt = DF.loc[:,DF.columns.str.endswith('CDR3nt')]
-CDR3aa = DF.loc[:,DF.columns.str.endswith('CDR3aa')]
-# AB
-AB_CDR3nt = CDR3nt.iloc[:,:4]
-AB_CDR3aa = CDR3aa.iloc[:,:4]
-AB_mask = P.iloc[:,:4].astype(bool)
-# Nucleotide masking
-AB_mask.columns = AB_CDR3nt.columns
-masked_ABnt = AB_CDR3nt.mask(~AB_mask)
-#  Amino acid masking
-AB_mask.columns = AB_CDR3aa.columns
-masked_ABaa = AB_CDR3aa.mask(~AB_mask)
-# GD
-GD_CDR3nt = CDR3nt.iloc[:,4:8]
-GD_CDR3aa = CDR3aa.iloc[:,4:8]
-GD_mask = P.iloc[:,4:8].astype(bool)
-# Nucleotide masking
-GD_mask.columns = GD_CDR3nt.columns
-masked_GDnt = GD_CDR3nt.mask(~GD_mask)
-# Amino acid masking
-GD_mask.columns = GD_CDR3aa.columns
-masked_GDaa = GD_CDR3aa.mask(~GD_mask)
-# ---------------------------------------------------------------------------- #
-# 5. CLONE DEFINITION
-# ABnt
-cols = ['A_1_CDR3nt','A_2_CDR3nt','B_1_CDR3nt','B_2_CDR3nt']
-seq_set_ABnt = generate_clone_sets(masked_ABnt,cols)
-tcr_ABnt = concat_seqs_in_set(seq_set_ABnt)
-# ABaa
-cols = ['A_1_CDR3aa','A_2_CDR3aa','B_1_CDR3aa','B_2_CDR3aa']
-seq_set_ABaa = generate_clone_sets(masked_ABaa,cols)
-tcr_ABaa = concat_seqs_in_set(seq_set_ABaa)
-# GDnt
-cols = ['G_1_CDR3nt','G_2_CDR3nt','D_1_CDR3nt','D_2_CDR3nt']
-seq_set_GDnt = generate_clone_sets(masked_GDnt,cols)
-tcr_GDnt = concat_seqs_in_set(seq_set_GDnt)
-# GDaa
-cols = ['G_1_CDR3aa','G_2_CDR3aa','D_1_CDR3aa','D_2_CDR3aa']
-seq_set_GDaa = generate_clone_sets(masked_GDaa,cols)
-tcr_GDaa = concat_seqs_in_set(seq_set_GDaa)
+# 1. MERGE DATASETS
+# All plates are found first and treated concurrently, then concatenated once. Only the
+# folders are plates and only the files in a readable format are datasets, so that other
+# entries (e.g. the completion markers of older runs) are skipped
+formats = ('.tsv','.csv','.xlsx','.parquet','.feather','.arrow')
+files = []
+for plate in sorted(os.listdir(in_path)):
+    if not os.path.isdir(os.path.join(in_path,plate)):
+        continue
+    for file in sorted(os.listdir(os.path.join(in_path,plate))):
+        if file.endswith(formats):
+            files.append((plate,os.path.join(in_path,plate,file)))
+        else:
+            print("Skipping {}, not a TCR dataset".format(os.path.join(in_path,plate,file)))
+if args.index is None:
+    with ThreadPoolExecutor(max(1,min(args.threads,len(files)))) as executor:
+        results = list(executor.map(lambda f: treat_plate(*f),files))
+    DF = pd.concat([df for df,_ in results])
+    counts = merge_counts([c for _,c in results])
+    del(results)
+else:
+    # Only the new or changed datasets are treated and counted, the rest are read
+    # already treated from the index folder
+    index_file = os.path.join(args.index,'clone_index.json')
+    if os.path.isfile(index_file):
+        index = CloneIndex.load(index_file)
+    else:
+        index = CloneIndex(clone_cols.keys())
+    names = {os.path.relpath(file,in_path):(plate,file) for plate,file in files}
+    cached = lambda name: os.path.join(args.index,'plates',name + '.feather')
+    for name in set(index.datasets) - set(names):
+        index.remove(name)
+        if os.path.exists(cached(name)):
+            os.remove(cached(name))
+        print("Removed dataset {} from the index".format(name))
+    new = [name for name in names if name not in index.datasets or not os.path.exists(cached(name))
+           or not unchanged([names[name][1]],index.datasets[name]['signature'])]
+    def update_plate(name):
+        df, counts = treat_plate(*names[name])
+        os.makedirs(os.path.dirname(cached(name)),exist_ok=True)
+        export_dataframe(df,cached(name))
+        return counts
+    with ThreadPoolExecutor(max(1,min(args.threads,len(new)))) as executor:
+        for name,counts in zip(new,executor.map(update_plate,new)):
+            index.add(name,counts,signature([names[name][1]]))
+            print("Added dataset {} to the index".format(name))
+    n_new = index.number_new()
+    index.save(index_file)
+    print("{} of {} datasets updated, new groups: {}".format(len(new),len(names),n_new))
+    DF = pd.concat([read_dataframe(cached(name)) for name in names])
+# Plates have different categories of V, D and J usages, lost when concatenating
+cols = DF.columns[DF.columns.str.match(r'^[ABGD]_\d+_[VDJ]$')].insert(0,'Plate')
+DF[cols] = DF[cols].astype('category')
 # ---------------------------------------------------------------------------- #
 # 6. CLONE GROUPING AND FREQUENCY CALCULATION
-# ABnt
-DF.insert(len(DF.columns),'TCR_AB_nt',tcr_ABnt)
-DF = group_with_freq(DF,'TCR_AB_nt',group_unique=False,new_name='clone_ABnt')
-# ABaa
-DF.insert(len(DF.columns),'TCR_AB_aa',tcr_ABaa)
-DF = group_with_freq(DF,'TCR_AB_aa',group_unique=False,new_name='clone_ABaa')
-# GDnt
-DF.insert(len(DF.columns),'TCR_GD_nt',tcr_GDnt)
-DF = group_with_freq(DF,'TCR_GD_nt',group_unique=False,new_name='clone_GDnt')
-# GDaa
-DF.insert(len(DF.columns),'TCR_GD_aa',tcr_GDaa)
-DF = group_with_freq(DF,'TCR_GD_aa',group_unique=False,new_name='clone_GDaa')
+clone_names = ['clone_ABnt','clone_ABaa','clone_GDnt','clone_GDaa']
+if args.index is None:
+    DF = group_multiple_with_freq(DF,list(clone_cols.keys()),group_unique=False,
+                                  new_names=clone_names,counts=counts)
+else:
+    DF = index.group(DF,new_names=clone_names)
+# Place each TCR column next to its frequency and group columns
+new_cols = []
+for tcr,clone in zip(clone_cols.keys(),clone_names):
+    new_cols = new_cols + [tcr,'freq_'+clone,'group_'+clone]
+DF = DF[list(DF.columns.drop(new_cols)) + new_cols]
+# ---------------------------------------------------------------------------- #
+# 7. FUZZY CLONE GROUPING
+# Clones within k edits of each other, next to the exact clone columns
+if args.fuzzy is not None:
+    masked = pd.concat(locus_summary(DF)[2].values(),axis=1)
+    fuzzy = group_fuzzy_clones(masked,clone_cols,k=args.fuzzy,new_names=clone_names)
+    for clone in clone_names:
+        idx = int(np.where(DF.columns=='group_'+clone)[0][0])
+        DF.insert(idx+1,'freq_fuzzy_'+clone,fuzzy['freq_fuzzy_'+clone])
+        DF.insert(idx+2,'group_fuzzy_'+clone,fuzzy['group_fuzzy_'+clone])
+    del(masked,fuzzy)
 # ---------------------------------------------------------------------------- #
 # DATA EXPORTING
-file_type = args.out_file.split('.')[-1]
-if file_type == 'tsv':
-    DF.to_csv(args.out_file,sep='\t')
-elif file_type == 'xlsx':
-    DF.to_excel(args.out_file)
-elif file_type == 'csv':
-    DF.to_csv(args.out_file,sep=',')
-else:
-    raise NameError("Invalid output format. Has to be either .tsv, .csv or .xlsx.")
+export_dataframe(DF,args.out_file)
 print("Dataset exported in {}".format(args.out_file))
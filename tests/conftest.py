@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules of bin/ and bench/ are imported as top-level modules, as the scripts of src/ do
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('bin','bench'):
+    if os.path.join(ROOT,folder) not in sys.path:
+        sys.path.append(os.path.join(ROOT,folder))
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+from data_functions import generate_clone_sets, group_sets
+from legacy_group_sets import generate_clone_sets_legacy, group_sets_legacy
+from bench_group_sets import step6_groups, same_clones
+from synthetic import clone_dataframe
+
+COLS = ['A_1','A_2','B_1','B_2']
+
+
+@pytest.mark.parametrize('missing',[0,0.5,0.9])
+def test_group_sets_equals_legacy(missing):
+    df = clone_dataframe(1000,n_seqs=50,missing=missing,seed=3,cols=COLS)
+    legacy = group_sets_legacy(generate_clone_sets_legacy(df,COLS))
+    assert generate_clone_sets(df,COLS)==generate_clone_sets_legacy(df,COLS)
+    assert same_clones(group_sets(generate_clone_sets(df,COLS)),legacy)
+
+
+@pytest.mark.parametrize('missing',[0,0.5,0.9])
+def test_step6_clones_equal_legacy(missing):
+    df = clone_dataframe(1000,n_seqs=50,missing=missing,seed=3,cols=COLS)
+    legacy = group_sets_legacy(generate_clone_sets_legacy(df,COLS))
+    assert same_clones(step6_groups(df,COLS),legacy)
+
+
+def test_groups_ignore_allele_and_repeats():
+    df = pd.DataFrame([['x','y',np.nan,np.nan],
+                       [np.nan,'y','x',np.nan],
+                       ['x','x','y','y'],
+                       ['x',np.nan,np.nan,np.nan],
+                       [np.nan,np.nan,np.nan,np.nan]],columns=COLS)
+    assert list(group_sets_legacy(generate_clone_sets_legacy(df,COLS)))==[1,1,1,3,-1]
+    assert list(group_sets(generate_clone_sets(df,COLS)))==[0,0,0,3,-1]
+    assert same_clones(step6_groups(df,COLS),[0,0,0,3,-1])
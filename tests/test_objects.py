@@ -0,0 +1,22 @@
+import pickle
+from objects import Cell, AlphaChain, BetaChain
+
+
+def test_cell_pickle_keeps_none_and_unset_attributes():
+    cell = pickle.loads(pickle.dumps(Cell()))
+    assert cell.name is None
+    assert (cell.n_A,cell.A_chains,cell.G_chains) == (0,[],[])
+    assert not hasattr(cell,'batch')
+
+
+def test_cell_pickle_round_trip():
+    cell = Cell('P1-A1',n_A=2,n_B=1)
+    chain = BetaChain('B','B_1')
+    chain.add_D_segment('TRBD1')
+    cell.add_chain(chain)
+    cell.add_chain(AlphaChain('A','A_1'))
+    cell.add_batch('batch_1')
+    copy = pickle.loads(pickle.dumps(cell))
+    assert (copy.name,copy.batch,copy.n_A,copy.n_B) == ('P1-A1','batch_1',2,1)
+    assert copy.A_chains[1] is None
+    assert copy.B_chains[0].D == 'TRBD1' and copy.B_chains[0].CDR3nt is None
@@ -0,0 +1,49 @@
+import os
+import glob
+import pytest
+from objects import read_tracer_cell, create_cell_from_AB, create_cell_from_GD
+from legacy_parser import create_cell_legacy
+from synthetic import write_tracer_plate
+from bench_parser import cell_contents
+
+
+@pytest.fixture(scope='module')
+def plate(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('tracer') / 'plate')
+    write_tracer_plate(root,500,seed=1)
+    return root
+
+
+def _files(root,loci):
+    return sorted(glob.glob(os.path.join(root,loci,'*','filtered_TCR_seqs','filtered_TCRs.txt')))
+
+
+@pytest.mark.parametrize('loci',['AB','GD'])
+def test_same_cells_as_legacy_parser(plate,loci):
+    files = _files(plate,loci)
+    assert files
+    for f in files:
+        assert cell_contents(read_tracer_cell(f,loci))==cell_contents(create_cell_legacy(f,loci)), f
+
+
+def test_wrappers_use_the_streaming_parser(plate):
+    f = _files(plate,'AB')[0]
+    assert cell_contents(create_cell_from_AB(f))==cell_contents(read_tracer_cell(f,'AB'))
+    f = _files(plate,'GD')[0]
+    assert cell_contents(create_cell_from_GD(f))==cell_contents(read_tracer_cell(f,'GD'))
+
+
+def test_more_than_nine_chains(tmp_path):
+    root = str(tmp_path / 'plate')
+    write_tracer_plate(root,20,seed=2,max_chains=12)
+    counts = [(c.n_A,len([x for x in c.A_chains if x is not None])) for c in
+              (read_tracer_cell(f,'AB') for f in _files(root,'AB'))]
+    assert any(n>9 for n,_ in counts)
+    assert all(n==filled for n,filled in counts)
+
+
+def test_missing_recombinants(tmp_path):
+    f = tmp_path / 'filtered_TCRs.txt'
+    f.write_text('------------------\ncell\n------------------\n')
+    with pytest.raises(ValueError):
+        read_tracer_cell(str(f),'AB')
@@ -0,0 +1,68 @@
+import csv
+import os
+import shutil
+
+import pytest
+from trimming import ADAPTERS, adapter_start, quality_trim_index, trim_cell, trim_cells
+from bench_trimming import compare_trimmed, reference_trim
+from synthetic import write_fastq_pair
+
+ADAPTER = ADAPTERS['Illumina']
+READ = b'ACGTTGCAACGGTACCATGA'
+
+
+def test_quality_trim_as_cutadapt():
+    # Example of the quality trimming algorithm in the documentation of cutadapt
+    qual = bytes(q + 33 for q in [42,40,26,27,8,7,11,4,2,3])
+    assert quality_trim_index(qual,cutoff=10)==4
+    assert quality_trim_index(b'IIII',cutoff=20)==4
+
+
+def test_adapter_with_substitution_is_found():
+    assert adapter_start(READ + ADAPTER + b'TTTT',ADAPTER)==len(READ)
+    mutated = ADAPTER[:5] + b'T' + ADAPTER[6:]
+    assert adapter_start(READ + mutated + b'TTTT',ADAPTER)==len(READ)
+    assert adapter_start(READ + ADAPTER[:7],ADAPTER)==len(READ)
+
+
+def test_adapter_with_indel_is_not_found():
+    # Unlike cutadapt, which trims these reads at len(READ)
+    deletion = ADAPTER[:5] + ADAPTER[6:]
+    insertion = ADAPTER[:5] + b'T' + ADAPTER[5:]
+    assert adapter_start(READ + deletion + b'TTTT',ADAPTER)>len(READ)
+    assert adapter_start(READ + insertion + b'TTTT',ADAPTER)>len(READ)
+
+
+@pytest.mark.skipif(shutil.which('cutadapt') is None and shutil.which('trim_galore') is None,
+                    reason="needs cutadapt or trim_galore")
+@pytest.mark.parametrize('error_rate',[0,0.1])
+def test_trim_cell_close_to_cutadapt(tmp_path,error_rate):
+    fastq_ins = [str(tmp_path/'cell_R{}.fastq.gz'.format(i)) for i in (1,2)]
+    fastq_outs = [str(tmp_path/'cell_R{0}_val_{0}.fq.gz'.format(i)) for i in (1,2)]
+    indels = write_fastq_pair(fastq_ins,5000,seed=1,error_rate=error_rate)
+    stats = trim_cell(fastq_ins,fastq_outs,adapter='Illumina')
+    _, fastq_reference = reference_trim(fastq_ins,str(tmp_path/'reference'))
+    result = compare_trimmed(fastq_outs,fastq_reference)
+    if error_rate==0:
+        assert result['identical']==stats['pairs_written'] and not result['mismatched']
+    assert result['identical']>=0.95*stats['pairs_written']
+    # Almost all the pairs trimmed differently have an insertion or deletion in the adapter
+    assert len(result['mismatched'] - indels)<=10
+
+
+def test_peak_memory_per_cell(tmp_path):
+    # The memory of the calling process is not counted in the peak of the cells
+    ballast = b'\x01'*300*2**20
+    for cell in ('c1','c2'):
+        os.makedirs(tmp_path/'in'/cell)
+        write_fastq_pair([str(tmp_path/'in'/cell/'{}_R{}.fastq.gz'.format(cell,i)) for i in (1,2)],
+                         200,seed=2)
+    log_file = str(tmp_path/'trim_log.tsv')
+    results = trim_cells(['c1','c2'],str(tmp_path/'in'),str(tmp_path/'out'),processes=1,
+                         log_file=log_file,adapter='Illumina')
+    assert all(results.values())
+    with open(log_file) as f:
+        rows = list(csv.DictReader(f,delimiter='\t'))
+    assert len(rows)==2
+    for row in rows:
+        assert row['max_rss_mb']=='' or 0<float(row['max_rss_mb'])<len(ballast)/2**20